@@ -7,15 +7,17 @@ import datetime
 import subprocess
 import platform
 import shlex
+import signal
 import time
-from shutil import copyfile
 from decimal import Decimal
 import argparse
 import operator
-from math import sqrt, ceil
+from math import sqrt, ceil, erfc
 from functools import reduce
 import re
 import csv
+import hashlib
+import atexit
 
 # Colorful constants
 RED = '\033[91m'
@@ -29,28 +31,290 @@ FPING_COUNT = 500  # Acceptance value should be 500 or more
 PERF_RUNTIME = 1200  # Acceptance value should be 1200 or more
 MIN_NSD_THROUGHPUT = 2000  # Acceptance value with lots of margin
 
+# Traffic patterns of nsdperfTool.py and the nsdperf test each one runs
+TRAFFIC_PATTERNS = {"all2all": "read",
+                    "incast": "write",
+                    "fanout": "read",
+                    "ring": "read"}
+
+# nsdperf test types that can be run on the throughput tests
+NSD_TESTS = ["write", "read", "nwrite", "swrite", "sread", "rw"]
+
+# Loaded latency fping interval in msec and the extra seconds it runs on
+# top of the many to many tests to cover nsdperfTool.py startup
+LOADED_FPING_PERIOD = 200
+LOADED_FPING_MARGIN = 60
+
+# nsdperf buffer size limits for the message size sweep
+MIN_BUFFSIZE = 4 * 1024
+MAX_BUFFSIZE = 16 * 1024 * 1024
+
+# nsdperf socket buffer size and its limits. auto derives it from the
+# bandwidth delay product, rounded up to SOCKSIZE_ROUND
+SOCKSIZE = 4 * 1024 * 1024
+MIN_SOCKSIZE = 64 * 1024
+MAX_SOCKSIZE = 100 * 1024 * 1024  # MAX_SOCKSIZE of nsdperf
+MIN_AUTO_SOCKSIZE = 1024 * 1024
+SOCKSIZE_ROUND = 64 * 1024
+
+# Settings shared by every nsdperf session of the run
+NSDPERF_SETTINGS = {'socksize': str(SOCKSIZE)}
+
 # GITHUB URL
 GIT_URL = "https://github.com/IBM/SpectrumScale_NETWORK_READINESS"
 
 # IP RE
 IPPATT = re.compile('.*inet\s+(?P<ip>.*)\/\d+')
 
+# RDMA command of a nsdperf session, any of the nsdperf RDMA modes
+RDMA_CMD_PATT = re.compile(r'^rdma (on|all|inline)\s*$', re.M)
+
 # devnull redirect destination
-DEVNULL = open(os.devnull, 'w')
+DEVNULL = subprocess.DEVNULL
+
+# Timed spans of the run phases and remote calls, see span_start
+SPANS = []
+
+# Parsed raw result files, see cached_parse. Saved on the log directory so
+# a later --analyze of the same run does not parse them again
+ANALYSIS_CACHE_FILE = ".koet_analysis_cache.json"
+ANALYSIS_CACHE = {'entries': {}, 'hits': 0, 'parsed': 0}
+
+# Results store of all runs, under the log directory
+RESULTS_DB = "results.db"
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_time TEXT NOT NULL,
+    logdir TEXT NOT NULL,
+    version TEXT,
+    hosts TEXT,
+    tests TEXT,
+    patterns TEXT,
+    rdma INTEGER,
+    fping_count INTEGER,
+    perf_runtime INTEGER,
+    min_throughput REAL,
+    max_avg_latency REAL,
+    return_code INTEGER);
+CREATE TABLE IF NOT EXISTS host_latency (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    host TEXT NOT NULL,
+    average REAL, maximum REAL, minimum REAL, stddev REAL);
+CREATE TABLE IF NOT EXISTS pair_latency (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    sent INTEGER, lost INTEGER, average REAL, maximum REAL);
+CREATE TABLE IF NOT EXISTS throughput (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    pattern TEXT NOT NULL,
+    client TEXT NOT NULL,
+    test TEXT NOT NULL,
+    throughput REAL, latency_average REAL, latency_stddev REAL);
+CREATE TABLE IF NOT EXISTS counters (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    pattern TEXT NOT NULL,
+    host TEXT NOT NULL,
+    test TEXT,
+    rx_errors INTEGER, tx_errors INTEGER, retransmits INTEGER);
+CREATE INDEX IF NOT EXISTS runs_time ON runs(run_time);
+CREATE INDEX IF NOT EXISTS host_latency_host ON host_latency(host, run_id);
+CREATE INDEX IF NOT EXISTS pair_latency_source ON pair_latency(source, run_id);
+CREATE INDEX IF NOT EXISTS pair_latency_target ON pair_latency(target, run_id);
+CREATE INDEX IF NOT EXISTS throughput_client ON throughput(client, run_id);
+CREATE INDEX IF NOT EXISTS throughput_test ON throughput(test, run_id);
+CREATE INDEX IF NOT EXISTS counters_host ON counters(host, run_id);
+CREATE INDEX IF NOT EXISTS counters_test ON counters(test, run_id);
+"""
+
+# Default regression thresholds of koet.py compare: throughput drop and
+# latency rise in percent, loss rise in percentage points, retransmitted
+# segments rise and significance level of the latency differences
+COMPARE_THROUGHPUT_DROP = 10.0
+COMPARE_LATENCY_RISE = 20.0
+COMPARE_LOSS_RISE = 0.5
+COMPARE_RETRANSMITS_RISE = 1000
+COMPARE_ALPHA = 0.05
+
+# A server of a throughput run is flagged when it delivers less than this
+# percent of its fair share, the run throughput divided by its servers. The
+# multi-rail test warns about RDMA ports under it of the mean port
+FAIR_SHARE_MIN = 50
+
+# Pre-flight results that passed are reused for PREFLIGHT_CACHE_TTL seconds
+# while the host state they depend on does not change. The commands that
+# read that state and the items each cached check depends on
+PREFLIGHT_CACHE_FILE = "preflight_cache.json"
+PREFLIGHT_CACHE_TTL = 14400
+PREFLIGHT_FINGERPRINT = {
+    "boot_id": "cat /proc/sys/kernel/random/boot_id",
+    "rpmdb": "stat -c %Y /var/lib/rpm/* 2>/dev/null | sort -n | tail -1",
+    "firewalld": "systemctl is-active firewalld 2>/dev/null",
+    "ibdev2netdev": "ibdev2netdev 2>/dev/null | md5sum"}
+PREFLIGHT_CHECKS = {"packages": ["boot_id", "rpmdb"],
+                    "RDMA packages": ["boot_id", "rpmdb"],
+                    "firewalld": ["boot_id", "firewalld"],
+                    "RDMA ports": ["boot_id", "rpmdb", "ibdev2netdev"]}
+
+# nsdperf TCP port and the seconds all the connects of a port probe have
+# to complete, plus the seconds for ssh when it is run from every node
+NSDPERF_PORT = 6668
+TCP_PROBE_DEADLINE = 2
+TCP_PROBE_SSH_WINDOW = 10
+
+# Seconds a remote operation can run before it is cancelled, see
+# traced_call. fping and nsdperf runs also get their expected runtime. The
+# cancelled operations of each host are kept on HOST_TIMEOUTS
+OPERATION_DEADLINES = {"probe": 30, "fping": 60, "loaded fping": 60}
+HOST_TIMEOUTS = {}
+TIMEOUT_RC = 124
+
+# Pre-flight cache of this run, see load_preflight_cache
+PREFLIGHT_CACHE = {'use': True, 'ttl': PREFLIGHT_CACHE_TTL, 'hosts': {},
+                   'fingerprints': {}, 'hits': 0}
 
 # This script version, independent from the JSON versions
-KOET_VERSION = "1.17"
+KOET_VERSION = "1.18"
 
 raw_input = input
 PYTHON3 = True
 
-if PYTHON3:
-    import statistics
+# distro, statistics, sqlite3 and nsdperfTool are imported where they are
+# used, so the results only paths (--analyze, history, compare, --version)
+# start fast and do not need the pre-flight dependencies
+
+
+def span_start(name, host="", command=""):
+    # Starts timing a phase or a remote call, pass it to span_end when done
+    return {'name': name, 'host': host, 'command': command,
+            'start': time.time()}
+
+
+def span_end(span, rc=0):
+    span['duration'] = round(time.time() - span['start'], 6)
+    span['rc'] = rc
+    SPANS.append(span)
+    return rc
+
+
+def operation_timeout(host, name, deadline):
+    # Counts an operation cancelled on its deadline on the host
+    HOST_TIMEOUTS.setdefault(host, []).append(name)
+    print(YELLOW + "WARNING: " + NOCOLOR + "on host " + host + " " + name +
+          " did not complete in " + str(deadline) + " seconds, cancelled")
+
+
+def traced_call(host, command_list, op="probe", **kwargs):
+    # subprocess.call of a remote command, timed as a span and cancelled
+    # after the deadline of op. Returns TIMEOUT_RC if cancelled
+    if host in command_list:
+        name = command_list[command_list.index(host) + 1]
+    else:
+        name = command_list[0]
+    span = span_start(name, host, " ".join(command_list))
     try:
-        import distro
-    except ImportError:
-        sys.exit(RED + "QUIT: " + NOCOLOR +
-                 "Cannot import distro. Check python3-distro is installed\n")
+        return_code = subprocess.call(command_list,
+                                      timeout=OPERATION_DEADLINES[op],
+                                      **kwargs)
+    except subprocess.TimeoutExpired:
+        operation_timeout(host, name, OPERATION_DEADLINES[op])
+        return span_end(span, TIMEOUT_RC)
+    except BaseException:
+        span_end(span, -1)
+        raise
+    return span_end(span, return_code)
+
+
+def traced_read(host, command, op="probe"):
+    # Output of a remote shell command, timed as a span and cancelled after
+    # the deadline of op. Empty if cancelled
+    words = command.split()
+    if host in words:
+        name = words[words.index(host) + 1]
+    else:
+        name = words[0]
+    span = span_start(name, host, command)
+    pipe = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                            universal_newlines=True, start_new_session=True)
+    try:
+        output = pipe.communicate(timeout=OPERATION_DEADLINES[op])[0]
+    except subprocess.TimeoutExpired:
+        # The whole shell pipeline, not only the shell
+        os.killpg(pipe.pid, signal.SIGKILL)
+        pipe.communicate()
+        operation_timeout(host, name, OPERATION_DEADLINES[op])
+        span_end(span, TIMEOUT_RC)
+        return ""
+    span_end(span, pipe.returncode)
+    return output
+
+
+def save_spans(logdir):
+    # One JSON object per line on the log dir, nsdperfTool.py writes its own
+    # spans to nsdperfTool_spans.json on the same dir
+    fileurl = os.path.join(logdir, "koet_spans.json")
+    try:
+        with open(fileurl, 'w') as spans_file:
+            for span in SPANS:
+                spans_file.write(json.dumps(span) + "\n")
+    except BaseException:
+        print(RED + "ERROR: " + NOCOLOR + "Cannot write " + fileurl)
+
+
+def export_chrome_trace(logdir):
+    # Chrome trace-event JSON with all spans of the run. One process per
+    # tool and one thread per host so stragglers stand out on the viewer
+    trace_events = []
+    hosts_tid = {"": 0}
+    for pid, tool in enumerate(["koet", "nsdperfTool"], 1):
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                             'tid': 0, 'args': {'name': tool}})
+        fileurl = os.path.join(logdir, tool + "_spans.json")
+        if not os.path.isfile(fileurl):
+            continue
+        with open(fileurl, 'r') as spans_file:
+            for span_line in spans_file:
+                if span_line.strip() == "":
+                    continue
+                span = json.loads(span_line)
+                if span['host'] not in hosts_tid:
+                    hosts_tid[span['host']] = len(hosts_tid)
+                trace_events.append({
+                    'name': span['name'],
+                    'cat': tool,
+                    'ph': 'X',
+                    'ts': int(span['start'] * 1000000),
+                    'dur': int(span['duration'] * 1000000),
+                    'pid': pid,
+                    'tid': hosts_tid[span['host']],
+                    'args': {'host': span['host'],
+                             'command': span['command'],
+                             'rc': span['rc']}})
+    for pid in [1, 2]:
+        for host, tid in hosts_tid.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M',
+                                 'pid': pid, 'tid': tid,
+                                 'args': {'name': host or "local"}})
+    fileurl = os.path.join(logdir, "trace.json")
+    try:
+        with open(fileurl, 'w') as trace_file:
+            json.dump({'traceEvents': trace_events,
+                       'displayTimeUnit': 'ms'}, trace_file)
+        print(GREEN + "INFO: " + NOCOLOR +
+              "Chrome trace-event file with the run phases can be found " +
+              "at " + fileurl)
+    except BaseException:
+        print(RED + "ERROR: " + NOCOLOR + "Cannot write " + fileurl)
+
+
+def save_trace(logdir, run_span):
+    # Spans and Chrome trace of the run on logdir. It is registered with
+    # atexit, so a run that quits on a host check keeps them too
+    if 'duration' not in run_span:
+        span_end(run_span, 1)
+    save_spans(logdir)
+    export_chrome_trace(logdir)
 
 
 def load_json(json_file_str):
@@ -110,12 +374,30 @@ def check_localnode_is_in(hosts_dictionary):
                  "Local node is not part of the test\n")
 
 
-def estimate_runtime(hosts_dictionary, fp_count, perf_runtime):
+def estimate_runtime(hosts_dictionary, fp_count, perf_runtime,
+                     tests_list, patterns_list, buffsizes_list, rails,
+                     rdma_modes_list):
     number_of_hosts = len(hosts_dictionary)
     estimated_rt_fp = number_of_hosts * fp_count
     # use number of hosts + 1 to include N:N iteration of nsdperf
-    # add 20 sec per node as startup, shutdown, compile overhead
-    estimated_rt_perf = (number_of_hosts + 1) * (20 + perf_runtime)
+    # add 20 sec per node as startup, shutdown, compile overhead. All test
+    # types run on the same nsdperf session so overhead is paid only once
+    # and one more iteration per traffic pattern
+    estimated_rt_perf = (number_of_hosts + 1) * \
+        (20 + perf_runtime * len(tests_list)) + \
+        len(patterns_list) * (20 + perf_runtime)
+    # message size sweep runs on one session
+    if buffsizes_list:
+        estimated_rt_perf = estimated_rt_perf + 20 + \
+            perf_runtime * len(tests_list) * len(buffsizes_list)
+    # multi-rail runs every port alone and then 1 to rails ports
+    if rails:
+        estimated_rt_perf = estimated_rt_perf + 20 + \
+            perf_runtime * len(tests_list) * rails * 2
+    # RDMA mode matrix runs on one session per path MTU and service level
+    if rdma_modes_list:
+        estimated_rt_perf = estimated_rt_perf + 20 + \
+            perf_runtime * len(tests_list) * len(rdma_modes_list)
     estimated_runtime = estimated_rt_fp + estimated_rt_perf
     # minutes we always return 2 even for short test runs
     estimated_runtime_minutes = int(ceil(estimated_runtime / 60.))
@@ -189,6 +471,92 @@ def parse_arguments():
         '(ib0,ib1,...). Must be using OS device names, not mlx names.',
         metavar='PORTS_CSV',
         default="")
+    parser.add_argument(
+        '-t',
+        '--tests',
+        action='store',
+        dest='tests',
+        help='The nsdperf test types to run on the throughput tests on ' +
+        'CSV format (' + ','.join(NSD_TESTS) + '). All of them run on ' +
+        'the same nsdperf session. Default is read',
+        metavar='TESTS_CSV',
+        default="read")
+    parser.add_argument(
+        '--patterns',
+        action='store',
+        dest='patterns',
+        help='Runs extra throughput tests with the traffic patterns on ' +
+        'CSV format (' + ','.join(sorted(TRAFFIC_PATTERNS.keys())) + '). ' +
+        'incast and fanout use the first host as the single server',
+        metavar='PATTERNS_CSV',
+        default="")
+    parser.add_argument(
+        '--loaded_latency',
+        action='store',
+        dest='loaded_latency',
+        help='Runs ICMP latency from the clients to the servers while the ' +
+        'many to many throughput test runs. The optional value is the KPI ' +
+        'of how many msec the average latency under load can grow over ' +
+        'the idle one. Default KPI is ' + str(MAX_AVG_LATENCY) + ' msec',
+        metavar='KPI_INFLATION',
+        type=float,
+        nargs='?',
+        const=MAX_AVG_LATENCY,
+        default=None)
+    parser.add_argument(
+        '--buffsizes',
+        action='store',
+        dest='buffsizes',
+        help='Runs an extra message size sweep with the buffer sizes in ' +
+        'bytes on CSV format, from ' + str(MIN_BUFFSIZE) + ' to ' +
+        str(MAX_BUFFSIZE) + '. It shows throughput and NSD latency ' +
+        'percentiles versus buffer size, not part of the KPI',
+        metavar='BUFFSIZES_CSV',
+        default="")
+    parser.add_argument(
+        '--socksize',
+        action='store',
+        dest='socksize',
+        help='nsdperf socket buffer size in bytes, from ' +
+        str(MIN_SOCKSIZE) + ' to ' + str(MAX_SOCKSIZE) + ', or auto to ' +
+        'derive it from the average RTT of the ICMP test and the speed of ' +
+        'the slowest link. It warns when net.core.rmem_max or wmem_max ' +
+        'are lower. Defaults to ' + str(SOCKSIZE),
+        metavar='SOCKSIZE',
+        default=str(SOCKSIZE))
+    parser.add_argument(
+        '--multirail',
+        action='store_true',
+        dest='multirail',
+        help='Runs an extra RDMA test over every port alone and then over ' +
+        '1 to N ports, on the many to many split of hosts. It shows the ' +
+        'throughput per port and per number of ports with the scaling ' +
+        'efficiency, not part of the KPI. It needs 2 or more ports on --rdma',
+        default=False)
+    parser.add_argument(
+        '--rdma_modes',
+        action='store',
+        dest='rdma_modes',
+        help='Runs an extra RDMA test with every nsdperf RDMA mode on CSV ' +
+        'format, on the many to many split of hosts. A mode is on, all or ' +
+        'inline followed by +sinline, +usecm, +mtuN or +slN, i.e. ' +
+        'all+usecm+mtu4096. It shows throughput, NSD latency percentiles ' +
+        'and CPU use per mode, not part of the KPI. Without a value the ' +
+        'modes are on,all,inline with and without usecm',
+        metavar='MODES_CSV',
+        nargs='?',
+        const="default",
+        default="")
+    parser.add_argument(
+        '--metrics_dir',
+        action='store',
+        dest='metrics_dir',
+        help='Directory where the OpenMetrics file koet.prom with the ' +
+        'results is written, i.e. the node_exporter textfile collector ' +
+        'directory. It is always written as metrics.prom on the log ' +
+        'directory',
+        metavar='METRICS_DIR',
+        default="")
     parser.add_argument(
         '--rpm_check_disabled',
         action='store_true',
@@ -197,6 +565,33 @@ def parse_arguments():
         'sure all required software is installed and no RPM were used ' +
         'to install the required prerequisites',
         default=False)
+    parser.add_argument(
+        '--port_matrix',
+        action='store_true',
+        dest='port_matrix',
+        help='Probes the nsdperf TCP port ' + str(NSDPERF_PORT) + ' from ' +
+        'every host to every other host before the tests, over ssh, and ' +
+        'shows the reachability matrix. It needs python3 on the hosts',
+        default=False)
+    parser.add_argument(
+        '--no-preflight-cache',
+        action='store_true',
+        dest='no_preflight_cache',
+        help='Runs all the pre-flight checks on all hosts. By default a ' +
+        'check that passed on a host is not run again while its result ' +
+        'is younger than the TTL and the host state it depends on, ' +
+        'i.e. boot id, RPM database, firewalld or ibdev2netdev, does not ' +
+        'change',
+        default=False)
+    parser.add_argument(
+        '--preflight-ttl',
+        action='store',
+        dest='preflight_ttl',
+        help='Seconds a passed pre-flight check result is reused. ' +
+        'Defaults to ' + str(PREFLIGHT_CACHE_TTL),
+        metavar='SECONDS',
+        type=int,
+        default=PREFLIGHT_CACHE_TTL)
     parser.add_argument(
         '--save-hosts',
         action='store_true',
@@ -205,6 +600,16 @@ def parse_arguments():
         '--hosts. It does not prompt for confirmation when overwriting',
         default=False)
 
+    parser.add_argument(
+        '--analyze',
+        action='store',
+        dest='analyze_dir',
+        help='Analyzes the results on the log directory of a previous run ' +
+        'against the KPIs given, without running any test nor checks on ' +
+        'the hosts',
+        metavar='LOGDIR',
+        default="")
+
     parser.add_argument('-v', '--version', action='version',
                         version='KOET ' + KOET_VERSION)
     args = parser.parse_args()
@@ -248,14 +653,81 @@ def parse_arguments():
                      "rdma parameter is not on CSV format")
     else:
         rdma_test = False
+    if args.multirail and len(unique_items_list(rdma_ports_list)) < 2:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "multi-rail test needs 2 or more RDMA ports on --rdma\n")
+    rdma_modes_list = []
+    if args.rdma_modes != "":
+        if not rdma_test:
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     "RDMA mode test needs the RDMA ports on --rdma\n")
+        import nsdperfTool
+        if args.rdma_modes == "default":
+            rdma_modes_list = list(nsdperfTool.defaultRdmaMatrix)
+        else:
+            rdma_modes_list = unique_items_list(args.rdma_modes.split(","))
+        for rdma_mode in rdma_modes_list:
+            if nsdperfTool.parseRdmaMode(rdma_mode) is None:
+                sys.exit(RED + "QUIT: " + NOCOLOR +
+                         "unknown RDMA mode " + rdma_mode + "\n")
     if args.save_hosts and not cli_hosts:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "cannot generate hosts file if hosts not passed with --hosts")
 
+    tests_list = unique_items_list(args.tests.split(","))
+    for test_type in tests_list:
+        if test_type not in NSD_TESTS:
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     "unknown nsdperf test type " + test_type + "\n")
+
+    patterns_list = []
+    if args.patterns != "":
+        patterns_list = unique_items_list(args.patterns.split(","))
+        for pattern in patterns_list:
+            if pattern not in TRAFFIC_PATTERNS:
+                sys.exit(RED + "QUIT: " + NOCOLOR +
+                         "unknown traffic pattern " + pattern + "\n")
+
+    if args.preflight_ttl < 0:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "pre-flight TTL cannot be negative\n")
+
+    if args.analyze_dir and not os.path.isdir(args.analyze_dir):
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "log directory " + args.analyze_dir + " does not exist\n")
+
+    if args.metrics_dir and not os.path.isdir(args.metrics_dir):
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "metrics directory " + args.metrics_dir +
+                 " does not exist\n")
+
+    buffsizes_list = []
+    if args.buffsizes != "":
+        buffsizes_list = unique_items_list(args.buffsizes.split(","))
+        for buffsize in buffsizes_list:
+            if not buffsize.isdigit() or \
+               not MIN_BUFFSIZE <= int(buffsize) <= MAX_BUFFSIZE:
+                sys.exit(RED + "QUIT: " + NOCOLOR +
+                         "buffer size " + buffsize + " is not a number " +
+                         "between " + str(MIN_BUFFSIZE) + " and " +
+                         str(MAX_BUFFSIZE) + "\n")
+
+    if args.socksize != "auto" and (
+            not args.socksize.isdigit() or
+            not MIN_SOCKSIZE <= int(args.socksize) <= MAX_SOCKSIZE):
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "socket buffer size " + args.socksize + " is not auto " +
+                 "or a number between " + str(MIN_SOCKSIZE) + " and " +
+                 str(MAX_SOCKSIZE) + "\n")
+
     return (round(args.max_avg_latency, 2), args.fping_count,
             args.perf_runtime, args.perf_throughput,
             cli_hosts, hosts_dictionary, rdma_test, rdma_ports_list,
-            args.no_rpm_check, args.save_hosts)
+            args.no_rpm_check, args.save_hosts, tests_list, patterns_list,
+            buffsizes_list, args.loaded_latency, args.metrics_dir,
+            args.analyze_dir, args.no_preflight_cache, args.preflight_ttl,
+            args.port_matrix, args.multirail, rdma_modes_list,
+            args.socksize)
 
 
 def check_kpi_is_ok(max_avg_latency, fping_count, perf_bw, perf_rt):
@@ -458,6 +930,12 @@ def check_distribution():
     # Decide if this is a redhat or a CentOS. We only checking the running
     # node, that might be a problem
     if PYTHON3:
+        try:
+            import distro
+        except ImportError:
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     "Cannot import distro. Check python3-distro is " +
+                     "installed\n")
         what_dist = distro.distro_release_info()['id']
     else:
         what_dist = platform.dist()[0]
@@ -468,21 +946,114 @@ def check_distribution():
                  "this only runs on RedHat at this moment")
 
 
+def host_fingerprint(host):
+    # The host state the pre-flight results depend on, with a single ssh.
+    # Empty if it cannot be read
+    ssh_command = ('ssh -o StrictHostKeyChecking=no ' +
+                   '-o LogLevel=error ' + host + ' ')
+    remote_command = "; ".join(
+        ["echo " + item + "=$(" + PREFLIGHT_FINGERPRINT[item] + ")"
+         for item in sorted(PREFLIGHT_FINGERPRINT)])
+    try:
+        raw_out = traced_read(host, ssh_command + 'sh -c ' +
+                              shlex.quote(shlex.quote(remote_command)))
+    except BaseException:
+        return {}
+    fingerprint = {}
+    for line in raw_out.splitlines():
+        if "=" in line:
+            item, value = line.split("=", 1)
+            fingerprint[item] = value.strip()
+    return fingerprint
+
+
+def load_preflight_cache(hosts_dictionary, use_cache, ttl):
+    # Loads the pre-flight cache and reads the current state of the hosts
+    PREFLIGHT_CACHE['use'] = use_cache
+    PREFLIGHT_CACHE['ttl'] = ttl
+    fileurl = os.path.join(os.getcwd(), 'log', PREFLIGHT_CACHE_FILE)
+    try:
+        with open(fileurl, 'r') as cache_file:
+            PREFLIGHT_CACHE['hosts'] = json.load(cache_file)
+    except (IOError, ValueError):
+        PREFLIGHT_CACHE['hosts'] = {}
+    for host in hosts_dictionary.keys():
+        PREFLIGHT_CACHE['fingerprints'][host] = host_fingerprint(host)
+    if not use_cache:
+        print(YELLOW + "WARNING: " + NOCOLOR +
+              "pre-flight cache disabled, running all checks on all hosts")
+
+
+def preflight_cached(host, check, check_input):
+    # Returns the cached result of check on host if it passed with the same
+    # input within the TTL and the host state it depends on did not change.
+    # None otherwise
+    if not PREFLIGHT_CACHE['use']:
+        return None
+    entry = PREFLIGHT_CACHE['hosts'].get(host, {}).get(check)
+    fingerprint = PREFLIGHT_CACHE['fingerprints'].get(host, {})
+    if not entry or entry['input'] != check_input:
+        return None
+    age = time.time() - entry['time']
+    if not 0 <= age <= PREFLIGHT_CACHE['ttl']:
+        return None
+    for item in PREFLIGHT_CHECKS[check]:
+        if not fingerprint.get(item) or \
+           entry['fingerprint'].get(item) != fingerprint[item]:
+            return None
+    PREFLIGHT_CACHE['hits'] = PREFLIGHT_CACHE['hits'] + 1
+    print(GREEN + "OK: " + NOCOLOR + "on host " + host + " the " + check +
+          " check is taken from the pre-flight cache, it passed " +
+          str(int(age // 60)) + " min ago and the host did not change")
+    return entry['result']
+
+
+def preflight_store(host, check, check_input, result):
+    # Caches a passed check, unless the host state could not be read
+    fingerprint = PREFLIGHT_CACHE['fingerprints'].get(host, {})
+    items = {item: fingerprint.get(item, "")
+             for item in PREFLIGHT_CHECKS[check]}
+    if not all(items.values()):
+        return
+    PREFLIGHT_CACHE['hosts'].setdefault(host, {})[check] = {
+        'time': time.time(), 'input': check_input, 'fingerprint': items,
+        'result': result}
+
+
+def save_preflight_cache():
+    fileurl = os.path.join(os.getcwd(), 'log', PREFLIGHT_CACHE_FILE)
+    tmp_fileurl = fileurl + ".tmp"
+    try:
+        if not os.path.isdir(os.path.dirname(fileurl)):
+            os.makedirs(os.path.dirname(fileurl))
+        with open(tmp_fileurl, 'w') as cache_file:
+            json.dump(PREFLIGHT_CACHE['hosts'], cache_file, indent=4)
+        os.rename(tmp_fileurl, fileurl)
+    except (IOError, OSError):
+        print(YELLOW + "WARNING: " + NOCOLOR +
+              "cannot save the pre-flight cache on " + fileurl)
+    if PREFLIGHT_CACHE['hits'] > 0:
+        print(GREEN + "INFO: " + NOCOLOR +
+              str(PREFLIGHT_CACHE['hits']) + " pre-flight check[s] " +
+              "taken from the cache, use --no-preflight-cache to run them " +
+              "all")
+
+
 def ssh_rpm_is_installed(host, rpm_package):
     # returns the RC of rpm -q rpm_package or quits if it cannot run rpm
     errors = 0
     try:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'rpm',
-                                       '-q',
-                                       rpm_package],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'rpm',
+                                         '-q',
+                                         rpm_package],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
     except Exception:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "cannot run rpm over ssh on host " + host)
@@ -491,18 +1062,18 @@ def ssh_rpm_is_installed(host, rpm_package):
 
 def ssh_service_is_up(host, service_name):
     try:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'systemctl',
-                                       'is-active',
-                                       '--quiet',
-                                       service_name],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'systemctl',
+                                         'is-active',
+                                         '--quiet',
+                                         service_name],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
     except Exception:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "cannot run systemctl over ssh on host " + host)
@@ -518,6 +1089,8 @@ def firewalld_check(hosts_dictionary):
     # Checks if if firewalld is up on any node
     errors = 0
     for host in hosts_dictionary.keys():
+        if preflight_cached(host, "firewalld", "") is not None:
+            continue
         firewalld_is_up = ssh_service_is_up(host, "firewalld")
         if firewalld_is_up:
             print(
@@ -536,19 +1109,144 @@ def firewalld_check(hosts_dictionary):
                  "on host " +
                  host +
                  " the firewalld service is not running" )
+            preflight_store(host, "firewalld", "", True)
     if errors > 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "Fix the firewalld status before running this tool again.\n")
 
 
+def probe_tcp_ports(hosts_list, tcpport, deadline):
+    # Connects to tcpport of all the hosts at once, non blocking, and waits
+    # for all of them up to deadline seconds in total. Returns the result
+    # per host: open, refused, timeout or the connect error. It imports what
+    # it needs so its source can be run on other nodes, see tcp_port_matrix
+    import errno
+    import selectors
+    import socket
+    import time
+    probe_results = {}
+    selector = selectors.DefaultSelector()
+    for host in hosts_list:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        connect_rc = sock.connect_ex((host, tcpport))
+        if connect_rc in (0, errno.EINPROGRESS):
+            selector.register(sock, selectors.EVENT_WRITE, host)
+        else:
+            probe_results[host] = errno.errorcode.get(connect_rc,
+                                                      str(connect_rc))
+            sock.close()
+    end_time = time.time() + deadline
+    while selector.get_map():
+        timeout = end_time - time.time()
+        if timeout <= 0:
+            break
+        for key, events in selector.select(timeout):
+            connect_rc = key.fileobj.getsockopt(socket.SOL_SOCKET,
+                                                socket.SO_ERROR)
+            if connect_rc == 0:
+                probe_results[key.data] = "open"
+            elif connect_rc == errno.ECONNREFUSED:
+                probe_results[key.data] = "refused"
+            else:
+                probe_results[key.data] = errno.errorcode.get(
+                    connect_rc, str(connect_rc))
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+    for key in list(selector.get_map().values()):
+        probe_results[key.data] = "timeout"
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+    selector.close()
+    return probe_results
+
+
+def tcp_port_matrix(hosts_dictionary, tcpport, deadline):
+    # Runs probe_tcp_ports on every node to all the other nodes, all nodes
+    # at once over ssh, and prints the matrix. Quits if any node cannot
+    # reach the port of other or it is in use
+    import inspect
+    hosts_list = list(hosts_dictionary.keys())
+    remote_python = ("$(command -v python3 || " +
+                     "echo /usr/libexec/platform-python) -c ")
+    probes = {}
+    for source in hosts_list:
+        targets = [target for target in hosts_list if target != source]
+        script = (inspect.getsource(probe_tcp_ports) +
+                  "\nfor host, status in probe_tcp_ports(" + repr(targets) +
+                  ", " + str(tcpport) + ", " + str(deadline) +
+                  ").items():\n    print(host + ' ' + status)\n")
+        command_list = ['ssh', '-o', 'StrictHostKeyChecking=no',
+                        '-o', 'BatchMode=yes', '-o', 'LogLevel=error',
+                        source, remote_python + shlex.quote(script)]
+        span = span_start("tcp probe", source, " ".join(command_list[:-1]))
+        try:
+            probe = subprocess.Popen(command_list, stdin=DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=DEVNULL,
+                                     universal_newlines=True)
+        except (OSError, IOError):
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     "cannot run the TCP port probe on host " + source)
+        probes[source] = (probe, span)
+    end_time = time.time() + deadline + TCP_PROBE_SSH_WINDOW
+    matrix = {}
+    for source in hosts_list:
+        probe, span = probes[source]
+        matrix[source] = {}
+        try:
+            raw_out = probe.communicate(
+                timeout=max(end_time - time.time(), 0))[0]
+        except subprocess.TimeoutExpired:
+            probe.kill()
+            probe.communicate()
+            raw_out = ""
+        span_end(span, probe.returncode)
+        for line in raw_out.splitlines():
+            if len(line.split()) == 2:
+                matrix[source][line.split()[0]] = line.split()[1]
+    print("TCP port " + str(tcpport) + " reachability matrix, from row " +
+          "node to column node:")
+    rows = []
+    for source in hosts_list:
+        rows.append([source] + [
+            "-" if target == source else
+            matrix[source].get(target, "no answer")
+            for target in hosts_list])
+    print_text_table(["from"] + hosts_list, rows)
+    errors = 0
+    for source in hosts_list:
+        if not matrix[source]:
+            errors = errors + 1
+            print(RED + "ERROR: " + NOCOLOR + "the TCP port probe did not " +
+                  "answer on host " + source)
+            continue
+        for target in hosts_list:
+            status = matrix[source].get(target, "no answer")
+            if target == source or status == "refused":
+                continue
+            errors = errors + 1
+            if status == "open":
+                reason = " is in use"
+            else:
+                reason = " cannot be reached (" + status + ")"
+            print(RED + "ERROR: " + NOCOLOR + "from host " + source +
+                  " the TCP port " + str(tcpport) + " of host " + target +
+                  reason)
+    if errors > 0:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "TCP port " + str(tcpport) + " is not reachable and free " +
+                 "between all hosts")
+    print(GREEN + "OK: " + NOCOLOR + "TCP port " + str(tcpport) +
+          " is reachable and free between all hosts")
+
+
 def check_tcp_port_free(hosts_dictionary, tcpport):
     errors = 0
-    # Checks certain port is not in use
+    # Checks certain port is not in use, all hosts probed at once
+    probe_results = probe_tcp_ports(list(hosts_dictionary.keys()), tcpport,
+                                    TCP_PROBE_DEADLINE)
     for host in hosts_dictionary.keys():
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        openit = sock.connect_ex((host, tcpport))
-        if openit == 0:  # I can connect so it is NOT free
+        if probe_results[host] == "open":  # I can connect so it is NOT free
             errors = errors + 1
             print(RED +
                   "ERROR: " +
@@ -567,7 +1265,9 @@ def check_tcp_port_free(hosts_dictionary, tcpport):
                 str(host) +
                 " TCP port " +
                 str(tcpport) +
-                " seems to be free")
+                " seems to be free (" +
+                probe_results[host] +
+                ")")
 
     if errors > 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
@@ -609,11 +1309,16 @@ def check_permission_files():
     return fatal_error
 
 
-def host_packages_check(hosts_dictionary, packages_dictionary):
+def host_packages_check(hosts_dictionary, packages_dictionary,
+                        check="packages"):
     # Checks if packages from JSON are installed or not based on the input
     # data ont eh JSON
     errors = 0
+    check_input = json.dumps(packages_dictionary, sort_keys=True)
     for host in hosts_dictionary.keys():
+        if preflight_cached(host, check, check_input) is not None:
+            continue
+        host_errors = errors
         for rpm_package in packages_dictionary.keys():
             if rpm_package != "json_version":
                 current_package_rc = ssh_rpm_is_installed(host, rpm_package)
@@ -639,6 +1344,8 @@ def host_packages_check(hosts_dictionary, packages_dictionary):
                         rpm_package +
                         " installation status is *NOT* as expected")
                     errors = errors + 1
+        if errors == host_errors:
+            preflight_store(host, check, check_input, True)
     if errors > 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "Fix the packages before running this tool again.\n")
@@ -647,16 +1354,16 @@ def host_packages_check(hosts_dictionary, packages_dictionary):
 def ssh_file_exists(host, fileurl):
     # returns the RC of ssh+ls of a file or quits if any error
     try:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'which',
-                                       fileurl],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'which',
+                                         fileurl],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
     except Exception:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "cannot run ls over ssh on host " + host)
@@ -666,21 +1373,21 @@ def ssh_file_exists(host, fileurl):
 def ssh_rdma_ports_are_up(host, rdma_ports_list):
     errors = 0
     for port in rdma_ports_list:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'ibdev2netdev',
-                                       '|',
-                                       'grep',
-                                       port,
-                                       '|',
-                                       'grep',
-                                       '"(Up)"'],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'ibdev2netdev',
+                                         '|',
+                                         'grep',
+                                         port,
+                                         '|',
+                                         'grep',
+                                         '"(Up)"'],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
         if return_code == 0:
             print(
                 GREEN +
@@ -718,9 +1425,10 @@ def check_rdma_port_mode(hosts_ports_dict):
         for port in hosts_ports_dict[host].keys():
             card_str = str(hosts_ports_dict[host][port].split('/')[0])
             try:
-                raw_out = os.popen(
+                raw_out = traced_read(
+                                host,
                                 ssh_command + '/usr/sbin/ibstat ' +
-                                card_str).read()
+                                card_str)
             except BaseException:
                 sys.exit(RED + "QUIT: " + NOCOLOR +
                          "There was an issue to query rdma ports on "
@@ -744,15 +1452,18 @@ def map_ib_to_mlx(host, rdma_ports_list):
     ssh_command = ('ssh -o StrictHostKeyChecking=no ' +
                    '-o LogLevel=error ' + host + ' ')
     try:
-        raw_os = os.popen(
+        raw_os = traced_read(
+                        host,
                         ssh_command +
-                        "ibdev2netdev|awk '{print$5}'").read()
-        raw_mlx = os.popen(
+                        "ibdev2netdev|awk '{print$5}'")
+        raw_mlx = traced_read(
+                        host,
                         ssh_command +
-                        "ibdev2netdev|awk '{print$1}'").read()
-        raw_port = os.popen(
+                        "ibdev2netdev|awk '{print$1}'")
+        raw_port = traced_read(
+                        host,
                         ssh_command +
-                        "ibdev2netdev|awk '{print$3}'").read()
+                        "ibdev2netdev|awk '{print$3}'")
     except BaseException:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "There was an issue to query rdma cards on " + host + "\n")
@@ -781,16 +1492,16 @@ def map_ib_to_mlx(host, rdma_ports_list):
 def check_rdma_ports_OS(host, port):
     # Lets check we have the tool we need
     try:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'ifconfig',
-                                       port],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'ifconfig',
+                                         port],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
     except Exception:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "cannot check port over ssh on host " + host)
@@ -853,12 +1564,22 @@ def create_mlx_csv(hosts_ports_dict, rdma_ports_list):
 def check_rdma_ports(hosts_dictionary, rdma_ports_list):
     errors_tool = 0
     fatal_error = False
+    # Hosts with a cached port mapping are not checked again
+    check_input = ",".join(rdma_ports_list)
+    cached_ports_dict = {}
+    for host in hosts_dictionary.keys():
+        cached_ports = preflight_cached(host, "RDMA ports", check_input)
+        if cached_ports is not None:
+            cached_ports_dict[host] = cached_ports
+    hosts_dictionary = {host: hosts_dictionary[host]
+                        for host in hosts_dictionary.keys()
+                        if host not in cached_ports_dict}
     for host in hosts_dictionary.keys():
         ibdev2netdev_filepath = "ibdev2netdev"
         error_tool_ibdev = check_rdma_tools(host, ibdev2netdev_filepath)
         ibstat_filepath = "ibstat"
         error_tool_ibstat = check_rdma_tools(host, ibstat_filepath)
-    errors_tool = error_tool_ibdev + error_tool_ibstat
+        errors_tool = errors_tool + error_tool_ibdev + error_tool_ibstat
     if errors_tool > 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "Fix the missing files before running this tool again.\n")
@@ -882,14 +1603,19 @@ def check_rdma_ports(hosts_dictionary, rdma_ports_list):
     hosts_ports_dict = {}
     for host in hosts_dictionary.keys():
         hosts_ports_dict[host] = map_ib_to_mlx(host, rdma_ports_list)
-    # Create list of mlx ports
-    rdma_ports_csv_mlx = create_mlx_csv(hosts_ports_dict, rdma_ports_list)
     # Check Ethernet mode and status UP
     errors_port_mode = check_rdma_port_mode(hosts_ports_dict)
     if errors_port_mode > 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
                  "Fix the port mode or disconnect the link " +
                  "before running this tool again.\n")
+    if not fatal_error:
+        for host in hosts_ports_dict.keys():
+            preflight_store(host, "RDMA ports", check_input,
+                            hosts_ports_dict[host])
+    hosts_ports_dict.update(cached_ports_dict)
+    # Create list of mlx ports
+    rdma_ports_csv_mlx = create_mlx_csv(hosts_ports_dict, rdma_ports_list)
     return fatal_error, rdma_ports_csv_mlx
 
 
@@ -953,17 +1679,17 @@ def create_log_dir(hosts_dictionary, log_dir_timestamp):
         'log',
         log_dir_timestamp)
     for host in hosts_dictionary:
-        return_code = subprocess.call(['ssh',
-                                       '-o',
-                                       'StrictHostKeyChecking=no',
-                                       '-o',
-                                       'LogLevel=error',
-                                       host,
-                                       'mkdir',
-                                       '-p',
-                                       logdir],
-                                      stdout=DEVNULL,
-                                      stderr=DEVNULL)
+        return_code = traced_call(host, ['ssh',
+                                         '-o',
+                                         'StrictHostKeyChecking=no',
+                                         '-o',
+                                         'LogLevel=error',
+                                         host,
+                                         'mkdir',
+                                         '-p',
+                                         logdir],
+                                  stdout=DEVNULL,
+                                  stderr=DEVNULL)
         if return_code == 0:
             print(
                 GREEN +
@@ -1006,65 +1732,286 @@ def latency_test(hosts_dictionary, logdir, fping_count):
         fileurl = os.path.join(logdir, "lat_" + srchost + "_" + "all")
         command = "ssh -o StrictHostKeyChecking=no -o LogLevel=error " + \
             srchost + " fping -C " + fping_count_str + " -q -A " + hosts_fping
+        span = span_start("fping", srchost, command)
+        # fping -C sends one ping per second to each host
+        deadline = fping_count + OPERATION_DEADLINES["fping"]
         with open(fileurl, 'wb', 0) as logfping:
             runfping = subprocess.Popen(shlex.split(
                 command), stderr=subprocess.STDOUT, stdout=logfping)
-            runfping.wait()
+            try:
+                runfping.wait(timeout=deadline)
+            except subprocess.TimeoutExpired:
+                runfping.kill()
+                runfping.wait()
+                operation_timeout(srchost, "fping", deadline)
             logfping.close()
+        span_end(span, runfping.returncode)
         print("Ping run from " + srchost + " to all nodes completed")
 
 
-def throughput_test_os(command, nsd_logfile, client):
+def host_link_info(host):
+    # Speed in Mb/s of the device that holds the IP address of host, from
+    # sysfs or else ethtool, and its net.core.rmem_max and wmem_max, with a
+    # single ssh. Values that cannot be read are None
+    ssh_command = ('ssh -o StrictHostKeyChecking=no ' +
+                   '-o LogLevel=error ' + host + ' ')
+    remote_command = (
+        "dev=$(ip -o -f inet addr show | awk -v ip=" + host +
+        " '{split($4, a, \"/\"); if (a[1] == ip) print $2}' | head -1); " +
+        "echo dev=$dev; " +
+        "echo speed=$(cat /sys/class/net/$dev/speed 2>/dev/null); " +
+        "echo ethtool=$(ethtool $dev 2>/dev/null | " +
+        "awk '/Speed:/ {print $2}'); " +
+        "echo rmem_max=$(sysctl -n net.core.rmem_max); " +
+        "echo wmem_max=$(sysctl -n net.core.wmem_max)")
     try:
-        runperf = subprocess.Popen(shlex.split(command), stdout=nsd_logfile)
-        runperf.wait()
-        # Extra wait here it might be not needed now that we added it on
-        # nsdperTool.py startup, but we keep it.
-        time.sleep(5)
+        raw_out = traced_read(host, ssh_command + 'sh -c ' +
+                              shlex.quote(shlex.quote(remote_command)))
     except BaseException:
-        sys.exit(RED + "QUIT: " + NOCOLOR +
-                 "Throughput run " + client + "failed unexpectedly " +
-                 " when calling: " + str(command) + "\n")
+        raw_out = ""
+    items = {}
+    for line in raw_out.splitlines():
+        if "=" in line:
+            item, value = line.split("=", 1)
+            items[item] = value.strip()
+    # Virtual devices and links that are down have no speed
+    speed = None
+    for value in [items.get('speed', ""),
+                  items.get('ethtool', "").replace("Mb/s", "")]:
+        if value.isdigit() and int(value) > 0:
+            speed = int(value)
+            break
+    link_info = {'dev': items.get('dev') or None, 'speed': speed}
+    for item in ['rmem_max', 'wmem_max']:
+        value = items.get(item, "")
+        link_info[item] = int(value) if value.isdigit() else None
+    return link_info
+
+
+def auto_socksize(logdir, hosts_dictionary):
+    # Sets the nsdperf socket buffer size to the bandwidth delay product of
+    # the slowest link and the highest average RTT of the ICMP test. The
+    # inputs are saved on socksize.json
+    all_fping_dictionary = load_multiple_fping(logdir, hosts_dictionary)[0]
+    max_rtt = max(all_fping_dictionary.values())
+    links = {}
+    for host in sorted(hosts_dictionary.keys()):
+        links[host] = host_link_info(host)
+    speeds = [link['speed'] for link in links.values()
+              if link['speed'] is not None]
+    print("")
+    if len(speeds) < len(links):
+        print(YELLOW + "WARNING: " + NOCOLOR + "cannot read the link " +
+              "speed of " + ", ".join(sorted(
+                  host for host in links if links[host]['speed'] is None)) +
+              ". Socket buffer size stays on " + NSDPERF_SETTINGS['socksize'] +
+              " bytes")
+        socksize = None
+    else:
+        # Mb/s times msec is bits per 1000
+        bdp = int(min(speeds) * 1000 * max_rtt) // 8
+        socksize = int(ceil(bdp / float(SOCKSIZE_ROUND))) * SOCKSIZE_ROUND
+        socksize = min(max(socksize, MIN_AUTO_SOCKSIZE), MAX_SOCKSIZE)
+        NSDPERF_SETTINGS['socksize'] = str(socksize)
+        print(GREEN + "INFO: " + NOCOLOR + "socket buffer size set to " +
+              str(socksize) + " bytes from a bandwidth delay product of " +
+              str(bdp) + " bytes, " + str(min(speeds)) + " Mb/s slowest " +
+              "link and " + str(max_rtt) + " msec highest average RTT")
+        for host in sorted(links):
+            for item in ['rmem_max', 'wmem_max']:
+                limit = links[host][item]
+                if limit is not None and limit < socksize:
+                    print(YELLOW + "WARNING: " + NOCOLOR + host +
+                          " net.core." + item + " is " + str(limit) +
+                          " bytes, the kernel limits the socket buffers " +
+                          "below " + str(socksize) + " bytes")
+    socksize_info = {'socksize': int(NSDPERF_SETTINGS['socksize']),
+                     'auto': socksize is not None,
+                     'max_avg_rtt(msec)': float(max_rtt),
+                     'links': links}
+    with open(os.path.join(logdir, "socksize.json"), 'w') as json_file:
+        json.dump(socksize_info, json_file, indent=4)
+
+
+def throughput_test_os(session, options, client):
+    # Runs nsdperf in this process on the session shared by all the
+    # throughput tests of the run. Returns the results, one per test type,
+    # or an empty list if the run failed
+    import nsdperfTool
+    span = span_start("nsdperfTool", client, json.dumps(options))
+    try:
+        session.configure(**options)
+        results = session.run()
+        span_end(span)
+    except nsdperfTool.NsdperfError as error:
+        span_end(span, 1)
+        print(RED + "ERROR: " + NOCOLOR + "Throughput run " + client +
+              " failed: " + str(error))
+        results = []
+    # Extra wait here it might be not needed now that we added it on
+    # nsdperTool.py startup, but we keep it.
+    span = span_start("sleep", client)
+    time.sleep(5)
+    span_end(span)
+    return results
+
+
+def nsdperf_options(nodes_options, tests_list, perf_runtime, rdma_test,
+                    rdma_ports_csv_mlx):
+    # Settings of the nsdperf session. nodes_options selects the servers
+    # and clients, or the nodes and pattern
+    options = dict(nodes_options)
+    options.update({'test': tests_list,
+                    'socksize': NSDPERF_SETTINGS['socksize'],
+                    'buffsize': "4194304", 'ttime': str(perf_runtime)})
+    if rdma_test:
+        options.update({'receiverThr': "32", 'workerThr': "32",
+                        'testerThr': "32", 'rdmaPorts': rdma_ports_csv_mlx})
+    else:
+        options.update({'receiverThr': "256", 'workerThr': "256",
+                        'testerThr': "256"})
+    return options
+
+
+def save_nsd_results(fileurl, nsd_results):
+    # Same format nsdperfTool.py writes, one JSON object per line
+    try:
+        with open(fileurl, 'w') as json_file:
+            for nsd_result in nsd_results:
+                json_file.write(json.dumps(nsd_result) + "\n")
+    except BaseException:
+        print(YELLOW + "WARNING: " + NOCOLOR +
+              "cannot write result JSON file " + fileurl)
+
+
+def session_stragglers(session):
+    # Hosts with nsdperf commands cancelled on their deadline, left out of
+    # the next throughput runs. Test timeouts are counted on the local node
+    # and do not say which host was late
+    return [node for node in session.timeouts.keys()
+            if node != session.localNode and
+            [op for op in session.timeouts[node] if op != "test"]]
 
 
-def throughput_test(hosts_dictionary,
+def healthy_hosts(session, hosts_dictionary, test_name):
+    # hosts_dictionary without the session stragglers
+    healthy_hosts_dictionary = dict(hosts_dictionary)
+    for host in session_stragglers(session):
+        if host in healthy_hosts_dictionary:
+            print(YELLOW + "WARNING: " + NOCOLOR + "host " + host +
+                  " is left out of the " + test_name + ", it did not " +
+                  "complete an operation on time")
+            del healthy_hosts_dictionary[host]
+    return healthy_hosts_dictionary
+
+
+def throughput_test(session,
+                    hosts_dictionary,
                     logdir,
                     perf_runtime,
                     rdma_test,
-                    rdma_ports_csv_mlx):
-    throughput_json_files_list = []
+                    rdma_ports_csv_mlx,
+                    tests_list,
+                    loaded_latency):
+    # All test types run one after the other on the same nsdperf session
     print("")
     print("Starting throughput tests. Please be patient.")
     for client in hosts_dictionary.keys():
         print("")
+        stragglers = session_stragglers(session)
+        if client in stragglers:
+            print(YELLOW + "WARNING: " + NOCOLOR + "skipping throughput run " +
+                  "from " + client + ", it did not complete an operation " +
+                  "on time")
+            continue
         print("Starting throughput run from " + client + " to all nodes")
         server_hosts_dictionary = dict(hosts_dictionary)
         del server_hosts_dictionary[client]
-        server_csv_str = (",".join(server_hosts_dictionary.keys()))
-        # Craft the call of nsdperf exec/wrapper
-        if rdma_test:
-            command = "./nsdperfTool.py -t read -k 4194304 -b 4194304 " \
-                      "-R 32 -W 32 -T 32 -d " + logdir + " -s " + \
-                      server_csv_str + " -c " + client + " -l " + \
-                      str(perf_runtime) + " -p " + rdma_ports_csv_mlx
-        else:
-            command = "./nsdperfTool.py -t read -k 4194304 -b 4194304 " \
-                "-R 256 -W 256 -T 256 -d " + logdir + " -s " + \
-                server_csv_str + " -c " + client + " -l " + str(perf_runtime)
-        nsd_logfile = open(logdir + "/nsdperfTool_log", "a")
-        throughput_test_os(command, nsd_logfile, client)
-        nsd_logfile.close()
-        # Copy the file to avoid overwrite it
-        try:
-            copyfile(logdir + "/nsdperfResult.json", logdir + "/nsd_" +
-                     client + ".json")
-        except BaseException:
-            print(YELLOW + "WARNING: " + NOCOLOR +
-                  "cannot copy result JSON file")
+        for host in stragglers:
+            server_hosts_dictionary.pop(host, None)
+        if not server_hosts_dictionary:
+            print(RED + "ERROR: " + NOCOLOR + "not enough hosts left to " +
+                  "run the throughput run from " + client)
+            continue
+        options = nsdperf_options(
+            {'server': list(server_hosts_dictionary.keys()),
+             'client': [client]},
+            tests_list, perf_runtime, rdma_test, rdma_ports_csv_mlx)
+        nsd_results = throughput_test_os(session, options, client)
+        if nsd_results:
+            save_nsd_results(logdir + "/nsd_" + client + ".json",
+                             nsd_results)
         print("Completed throughput run from " + client + " to all nodes")
     print("")
     print("Starting many to many nodes throughput test")
     # We run a mess run to catch few more issues
+    clients_nodes_d, servers_nodes_d = split_hosts(
+        healthy_hosts(session, hosts_dictionary, "many to many test"))
+    if not clients_nodes_d or not servers_nodes_d:
+        print(RED + "ERROR: " + NOCOLOR + "not enough hosts left to run " +
+              "the many to many test")
+        return clients_nodes_d, servers_nodes_d
+    options = nsdperf_options({'server': list(servers_nodes_d.keys()),
+                               'client': list(clients_nodes_d.keys())},
+                              tests_list, perf_runtime, rdma_test,
+                              rdma_ports_csv_mlx)
+    if loaded_latency:
+        fping_runs = start_loaded_latency(
+            clients_nodes_d, servers_nodes_d, logdir,
+            perf_runtime * len(tests_list) + LOADED_FPING_MARGIN)
+    nsd_results = throughput_test_os(session, options, "many to many")
+    if loaded_latency:
+        wait_loaded_latency(fping_runs)
+    if nsd_results:
+        save_nsd_results(logdir + "/nsd_mess.json", nsd_results)
+    print("Completed many to many nodes throughput test")
+    return clients_nodes_d, servers_nodes_d
+
+
+def start_loaded_latency(clients_nodes_d, servers_nodes_d, logdir,
+                         duration):
+    # Each client of the many to many test pings all the servers while the
+    # test runs. fping -D timestamps every sample so it can be aligned with
+    # the nsdperf test windows later
+    fping_runs = []
+    servers_fping = " ".join(sorted(servers_nodes_d.keys()))
+    for srchost in sorted(clients_nodes_d.keys()):
+        print("Starting loaded ping run from " + srchost + " to servers")
+        fileurl = os.path.join(logdir, "loaded_lat_" + srchost)
+        command = "ssh -o StrictHostKeyChecking=no -o LogLevel=error " + \
+            srchost + " timeout " + str(duration) + " fping -D -l -p " + \
+            str(LOADED_FPING_PERIOD) + " " + servers_fping
+        logfping = open(fileurl, 'wb', 0)
+        span = span_start("loaded fping", srchost, command)
+        try:
+            runfping = subprocess.Popen(shlex.split(command),
+                                        stderr=subprocess.STDOUT,
+                                        stdout=logfping)
+        except BaseException:
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     "Loaded ping run from " + srchost + " failed " +
+                     "unexpectedly when calling: " + command + "\n")
+        fping_runs.append((srchost, runfping, logfping, span,
+                           duration + OPERATION_DEADLINES["loaded fping"]))
+    return fping_runs
+
+
+def wait_loaded_latency(fping_runs):
+    for srchost, runfping, logfping, span, deadline in fping_runs:
+        try:
+            runfping.wait(timeout=max(
+                span['start'] + deadline - time.time(), 0))
+        except subprocess.TimeoutExpired:
+            runfping.kill()
+            runfping.wait()
+            operation_timeout(srchost, "loaded fping", deadline)
+        logfping.close()
+        span_end(span, runfping.returncode)
+        print("Loaded ping run from " + srchost + " to servers completed")
+
+
+def split_hosts(hosts_dictionary):
+    # Second half of the hosts are clients, first half servers
     middle_index = int(len(hosts_dictionary)/2)
     if PYTHON3:
         clients_nodes_d = dict(list(hosts_dictionary.items())[middle_index:])
@@ -1072,29 +2019,133 @@ def throughput_test(hosts_dictionary,
     else:
         clients_nodes_d = dict(hosts_dictionary.items()[middle_index:])
         servers_nodes_d = dict(hosts_dictionary.items()[:middle_index])
-    clients_csv = (",".join(clients_nodes_d.keys()))
-    servers_csv = (",".join(servers_nodes_d.keys()))
-    if rdma_test:
-        command = "./nsdperfTool.py -t read -k 4194304 -b 4194304 " \
-            "-R 32 -W 32 -T 32 -d " + logdir + " -s " + \
-            servers_csv + " -c " + clients_csv + " -l " + \
-            str(perf_runtime) + " -p " + rdma_ports_csv_mlx
-    else:
-        command = "./nsdperfTool.py -t read -k 4194304 -b 4194304 " \
-            "-R 256 -W 256 -T 256 -d " + logdir + " -s " + \
-            servers_csv + " -c " + clients_csv + " -l " + str(perf_runtime)
-    nsd_logfile = open(logdir + "/nsdperfTool_log", "a")
-    throughput_test_os(command, nsd_logfile, client)
-    nsd_logfile.close()
-    # Copy the file to avoid overwrite it
-    try:
-        copyfile(logdir + "/nsdperfResult.json", logdir +
-                 "/nsd_mess" + ".json")
-    except BaseException:
-        print(YELLOW + "WARNING: " + NOCOLOR +
-              "cannot copy result JSON file")
-    print("Completed many to many nodes throughput test")
-    return clients_nodes_d
+    return clients_nodes_d, servers_nodes_d
+
+
+def size_test(session,
+              hosts_dictionary,
+              logdir,
+              perf_runtime,
+              rdma_test,
+              rdma_ports_csv_mlx,
+              tests_list,
+              buffsizes_list):
+    # All buffer sizes run on the same nsdperf session, on the same many to
+    # many split of hosts
+    print("")
+    print("Starting message size sweep throughput test")
+    clients_nodes_d, servers_nodes_d = split_hosts(
+        healthy_hosts(session, hosts_dictionary, "message size sweep"))
+    if not clients_nodes_d or not servers_nodes_d:
+        print(RED + "ERROR: " + NOCOLOR + "not enough hosts left to run " +
+              "the message size sweep")
+        return
+    options = nsdperf_options({'server': list(servers_nodes_d.keys()),
+                               'client': list(clients_nodes_d.keys()),
+                               'sizes': buffsizes_list},
+                              tests_list, perf_runtime, rdma_test,
+                              rdma_ports_csv_mlx)
+    throughput_test_os(session, options, "message size sweep")
+    if session.sweepSummary is not None:
+        try:
+            with open(logdir + "/nsd_sizes.json", 'w') as json_file:
+                json.dump(session.sweepSummary, json_file)
+        except BaseException:
+            print(YELLOW + "WARNING: " + NOCOLOR +
+                  "cannot write message size sweep JSON file")
+    print("Completed message size sweep throughput test")
+
+
+def multirail_test(session,
+                   hosts_dictionary,
+                   logdir,
+                   perf_runtime,
+                   rdma_ports_csv_mlx,
+                   tests_list):
+    # Every RDMA port alone and then 1 to N ports run on the same nsdperf
+    # session, on the same many to many split of hosts
+    print("")
+    print("Starting multi-rail RDMA throughput test")
+    clients_nodes_d, servers_nodes_d = split_hosts(
+        healthy_hosts(session, hosts_dictionary, "multi-rail"))
+    if not clients_nodes_d or not servers_nodes_d:
+        print(RED + "ERROR: " + NOCOLOR + "not enough hosts left to run " +
+              "the multi-rail test")
+        return
+    options = nsdperf_options({'server': list(servers_nodes_d.keys()),
+                               'client': list(clients_nodes_d.keys()),
+                               'multirail': True},
+                              tests_list, perf_runtime, True,
+                              rdma_ports_csv_mlx)
+    throughput_test_os(session, options, "multi-rail")
+    if session.multiRailSummary is not None:
+        try:
+            with open(logdir + "/nsd_multirail.json", 'w') as json_file:
+                json.dump(session.multiRailSummary, json_file)
+        except BaseException:
+            print(YELLOW + "WARNING: " + NOCOLOR +
+                  "cannot write multi-rail JSON file")
+    print("Completed multi-rail RDMA throughput test")
+
+
+def rdma_modes_test(session,
+                    hosts_dictionary,
+                    logdir,
+                    perf_runtime,
+                    rdma_ports_csv_mlx,
+                    tests_list,
+                    rdma_modes_list):
+    # The RDMA modes run on the same nsdperf session, restarted only when
+    # the path MTU or service level changes, on the same many to many split
+    # of hosts
+    print("")
+    print("Starting RDMA mode matrix throughput test")
+    clients_nodes_d, servers_nodes_d = split_hosts(
+        healthy_hosts(session, hosts_dictionary, "RDMA mode matrix"))
+    if not clients_nodes_d or not servers_nodes_d:
+        print(RED + "ERROR: " + NOCOLOR + "not enough hosts left to run " +
+              "the RDMA mode matrix test")
+        return
+    options = nsdperf_options({'server': list(servers_nodes_d.keys()),
+                               'client': list(clients_nodes_d.keys()),
+                               'rdmaMatrix': rdma_modes_list},
+                              tests_list, perf_runtime, True,
+                              rdma_ports_csv_mlx)
+    throughput_test_os(session, options, "RDMA mode matrix")
+    if session.rdmaMatrixSummary is not None:
+        try:
+            with open(logdir + "/nsd_rdma_modes.json", 'w') as json_file:
+                json.dump(session.rdmaMatrixSummary, json_file)
+        except BaseException:
+            print(YELLOW + "WARNING: " + NOCOLOR +
+                  "cannot write RDMA mode matrix JSON file")
+    print("Completed RDMA mode matrix throughput test")
+
+
+def pattern_test(session,
+                 hosts_dictionary,
+                 logdir,
+                 perf_runtime,
+                 rdma_test,
+                 rdma_ports_csv_mlx,
+                 patterns_list):
+    # incast and fanout use the first host as the single server, the rest
+    # of patterns use all hosts as both client and server
+    for pattern in patterns_list:
+        print("")
+        print("Starting " + pattern + " traffic pattern throughput test")
+        pattern_hosts_dictionary = healthy_hosts(
+            session, hosts_dictionary, pattern + " pattern test")
+        options = nsdperf_options(
+            {'pattern': pattern,
+             'nodes': list(pattern_hosts_dictionary.keys())},
+            [TRAFFIC_PATTERNS[pattern]], perf_runtime, rdma_test,
+            rdma_ports_csv_mlx)
+        nsd_results = throughput_test_os(session, options, pattern)
+        if nsd_results:
+            save_nsd_results(logdir + "/nsd_pattern_" + pattern + ".json",
+                             nsd_results)
+        print("Completed " + pattern + " traffic pattern throughput test")
 
 
 def mean_list(list):
@@ -1143,6 +2194,7 @@ def stddev_list(list, mean):
     list = [lat.replace('-', '1000.00') for lat in list]
     list = [float(lat) for lat in list]
     if PYTHON3:
+        import statistics
         try:
             stddev_lat = statistics.stdev(list)
         except statistics.StatisticsError:
@@ -1184,19 +2236,149 @@ def file_exists(fileurl):
                  fileurl)
 
 
-def load_json_files_into_dictionary(json_files_list):
-    all_json_dict = {}
+def file_sha256(fileurl):
+    sha256 = hashlib.sha256()
+    with open(fileurl, 'rb') as raw_file:
+        for chunk in iter(lambda: raw_file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def cached_parse(fileurl, parser):
+    # Returns parser(fileurl), reused from the analysis cache while the file
+    # keeps its size and mtime or, if those changed, its content hash. The
+    # result is shared, callers must not modify it
     try:
-        for json_file in json_files_list:
-            json_file_name = open(json_file, 'r')
-            all_json_dict[json_file] = json.load(json_file_name)
-        return all_json_dict
-    except BaseException:
-        sys.exit(RED + "QUIT: " + NOCOLOR +
-                 " cannot load JSON file: " + json_file)
+        file_stat = os.stat(fileurl)
+    except OSError:
+        return parser(fileurl)
+    key = parser.__name__ + ":" + os.path.abspath(fileurl)
+    entry = ANALYSIS_CACHE['entries'].get(key)
+    if entry and entry['size'] == file_stat.st_size and \
+            entry['mtime'] == file_stat.st_mtime_ns:
+        ANALYSIS_CACHE['hits'] = ANALYSIS_CACHE['hits'] + 1
+        return entry['data']
+    sha256 = file_sha256(fileurl)
+    if entry and entry['sha256'] == sha256:
+        entry['size'] = file_stat.st_size
+        entry['mtime'] = file_stat.st_mtime_ns
+        ANALYSIS_CACHE['hits'] = ANALYSIS_CACHE['hits'] + 1
+        return entry['data']
+    data = parser(fileurl)
+    ANALYSIS_CACHE['entries'][key] = {'size': file_stat.st_size,
+                                      'mtime': file_stat.st_mtime_ns,
+                                      'sha256': sha256, 'data': data}
+    ANALYSIS_CACHE['parsed'] = ANALYSIS_CACHE['parsed'] + 1
+    return data
+
+
+def load_analysis_cache(logdir):
+    # Adds the cache saved on logdir, if any, to the analysis cache. Entries
+    # already in memory are newer and kept
+    logdir = os.path.abspath(logdir)
+    try:
+        with open(os.path.join(logdir, ANALYSIS_CACHE_FILE), 'r') as \
+                cache_file:
+            entries = json.load(cache_file)
+    except (IOError, ValueError):
+        return
+    for key, entry in entries.items():
+        parser_name, file_name = key.split(":", 1)
+        ANALYSIS_CACHE['entries'].setdefault(
+            parser_name + ":" + os.path.join(logdir, file_name), entry)
+
+
+def save_analysis_cache(logdir):
+    # Saves the cache entries of the files on logdir, keyed by file name so
+    # the log directory can be moved
+    logdir = os.path.abspath(logdir)
+    entries = {}
+    for key, entry in ANALYSIS_CACHE['entries'].items():
+        parser_name, fileurl = key.split(":", 1)
+        if os.path.dirname(fileurl) == logdir:
+            entries[parser_name + ":" + os.path.basename(fileurl)] = entry
+    fileurl = os.path.join(logdir, ANALYSIS_CACHE_FILE)
+    tmp_fileurl = fileurl + ".tmp"
+    try:
+        with open(tmp_fileurl, 'w') as cache_file:
+            json.dump(entries, cache_file)
+        os.rename(tmp_fileurl, fileurl)
+    except (IOError, OSError):
+        print(YELLOW + "WARNING: " + NOCOLOR +
+              "cannot save the analysis cache on " + fileurl)
+        return
+    print(GREEN + "INFO: " + NOCOLOR + "analysis cache " +
+          str(ANALYSIS_CACHE['hits']) + " file[s] reused, " +
+          str(ANALYSIS_CACHE['parsed']) + " parsed, saved on " + fileurl)
+
+
+def parse_nsd_results(fileurl):
+    # nsdperfTool.py writes one JSON object per line, one per test type run
+    # on the session
+    nsd_results = {}
+    with open(fileurl, "r") as json_file:
+        for json_line in json_file:
+            if json_line.strip() == "":
+                continue
+            nsd_result = json.loads(json_line)
+            nsd_results[nsd_result['test']] = nsd_result
+    return nsd_results
 
 
-def load_throughput_tests(logdir, hosts_dictionary, many2many_clients):
+def parse_fping_file(fileurl):
+    # [[target, [latency, ...]], ...] of a fping -C output, lost packets
+    # are '-'
+    targets = []
+    with open(fileurl, 'r') as logfping:
+        for rawfping in logfping:
+            if ':' not in rawfping:
+                continue
+            targets.append([rawfping.split(':')[0].strip(),
+                            rawfping.split(':')[1].split()])
+    return targets
+
+
+def parse_loaded_fping_file(fileurl):
+    # [[time, target, seq, latency], ...] of a fping -D -l output
+    fping_re = re.compile(r'^\[(?P<time>[\d\.]+)\]\s+(?P<host>\S+)\s*:\s*' +
+                          r'\[(?P<seq>\d+)\],\s+\d+ bytes,\s+' +
+                          r'(?P<lat>[\d\.]+) ms')
+    samples = []
+    with open(fileurl, 'r') as logfping:
+        for rawfping in logfping:
+            sample = fping_re.match(rawfping)
+            if sample:
+                samples.append([float(sample.group('time')),
+                                sample.group('host'),
+                                int(sample.group('seq')),
+                                sample.group('lat')])
+    return samples
+
+
+def load_nsd_results(json_file_str):
+    # Returns a dictionary with the results of a nsdperfTool.py run keyed by
+    # test type, empty if the file cannot be loaded
+    try:
+        nsd_results = cached_parse(json_file_str, parse_nsd_results)
+    except Exception:
+        nsd_results = {}
+    return nsd_results
+
+
+def load_json_files_into_dictionary(json_files_list, test_type):
+    all_json_dict = {}
+    for json_file in json_files_list:
+        nsd_results = load_nsd_results(json_file)
+        if test_type not in nsd_results:
+            sys.exit(RED + "QUIT: " + NOCOLOR +
+                     " cannot load " + test_type + " JSON file: " +
+                     json_file)
+        all_json_dict[json_file] = nsd_results[test_type]
+    return all_json_dict
+
+
+def load_throughput_tests(logdir, hosts_dictionary, many2many_clients,
+                          test_type):
     throughput_dict = {}
     nsd_lat_dict = {}
     nsd_std_dict = {}
@@ -1211,8 +2393,8 @@ def load_throughput_tests(logdir, hosts_dictionary, many2many_clients):
     for host in hosts_dictionary.keys():
         fileurl = logdir + "/nsd_" + host + ".json"
         file_exists(fileurl)
-        # Lets do a load to check it is a proper file
-        json_loads = json_file_loads(fileurl)
+        # Lets do a load to check it is a proper file with this test
+        json_loads = test_type in load_nsd_results(fileurl)
         if json_loads:
             throughput_json_files_list.append(fileurl)
             file_host_dict.update({fileurl: host})
@@ -1220,13 +2402,15 @@ def load_throughput_tests(logdir, hosts_dictionary, many2many_clients):
             print(RED +
                   "ERROR: " +
                   NOCOLOR +
-                  "cannot load JSON for host " +
+                  "cannot load " +
+                  test_type +
+                  " JSON for host " +
                   host +
                   ". We are going to ignore this host on the results")
     # We append the mess run
     mess_file_url = logdir + "/nsd_mess.json"
-    # Lets do a load to check it is a proper file
-    json_loads = json_file_loads(mess_file_url)
+    # Lets do a load to check it is a proper file with this test
+    json_loads = test_type in load_nsd_results(mess_file_url)
     if json_loads:
             throughput_json_files_list.append(mess_file_url)
             file_host_dict.update({mess_file_url: "all at the same time"})
@@ -1234,13 +2418,15 @@ def load_throughput_tests(logdir, hosts_dictionary, many2many_clients):
         print(RED +
               "ERROR: " +
               NOCOLOR +
-              "cannot load JSON for all at the same time " +
+              "cannot load " + test_type +
+              " JSON for all at the same time " +
               ". We are going to ignore this test on the results")
     # If the list is empty is that failed to load all JSON, no point to go
     if len(throughput_json_files_list) == 0:
         sys.exit(RED + "QUIT: " + NOCOLOR +
-                 " cannot load any throughput JSON file")
-    nsd_json = load_json_files_into_dictionary(throughput_json_files_list)
+                 " cannot load any " + test_type + " throughput JSON file")
+    nsd_json = load_json_files_into_dictionary(throughput_json_files_list,
+                                               test_type)
     for file in throughput_json_files_list:
         # here we add the metrics we will proces later
         host_key = file_host_dict[file]
@@ -1283,6 +2469,191 @@ def load_throughput_tests(logdir, hosts_dictionary, many2many_clients):
             nsd_txe_dict, nsd_txe_m2m_d, nsd_rtr_dict, nsd_rtr_m2m_d)
 
 
+def jain_fairness(values):
+    # Jain's fairness index, 1 when all values are equal down to 1/n when
+    # one of them takes everything. None without values
+    squares = sum(value * value for value in values)
+    if not values or squares == 0:
+        return None
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def load_server_throughput(logdir, hosts_dictionary, test_type):
+    # Returns {run: {server: MB/sec}} of the 1:n runs and the many to many
+    # run. Results of nsdperf before 1.33 have no per server throughput and
+    # are left out
+    runs = [(host, os.path.join(logdir, "nsd_" + host + ".json"))
+            for host in sorted(hosts_dictionary.keys())]
+    runs.append(("all at the same time",
+                 os.path.join(logdir, "nsd_mess.json")))
+    server_dict = {}
+    for run, fileurl in runs:
+        nsd_result = load_nsd_results(fileurl).get(test_type, {})
+        servers = nsd_result.get('serverThroughput', {})
+        if servers:
+            server_dict[run] = dict(
+                (server, float(values['throughput(MB/sec)']))
+                for server, values in servers.items())
+    return server_dict
+
+
+def load_pattern_tests(logdir, patterns_list):
+    # Returns per pattern the aggregated throughput, the number of clients
+    # and the throughput the KPI is applied to. On incast and fanout the
+    # single server link is the bottleneck so the aggregate is used, on the
+    # rest the aggregate is shared by all the nodes
+    pattern_dict = {}
+    for pattern in patterns_list:
+        fileurl = os.path.join(logdir, "nsd_pattern_" + pattern + ".json")
+        nsd_results = load_nsd_results(fileurl)
+        if TRAFFIC_PATTERNS[pattern] not in nsd_results:
+            print(RED +
+                  "ERROR: " +
+                  NOCOLOR +
+                  "cannot load JSON for " +
+                  pattern +
+                  " traffic pattern. We are going to ignore this test " +
+                  "on the results")
+            continue
+        nsd_json = nsd_results[TRAFFIC_PATTERNS[pattern]]
+        throughput_v = Decimal(nsd_json['throughput(MB/sec)'])
+        n_clients = len(nsd_json['client(s)'])
+        if pattern in ["incast", "fanout"]:
+            kpi_throughput_v = throughput_v
+        else:
+            kpi_throughput_v = round(throughput_v / n_clients, 2)
+        pattern_dict[pattern] = {'throughput': throughput_v,
+                                 'clients': n_clients,
+                                 'kpi_throughput': kpi_throughput_v}
+    return pattern_dict
+
+
+def load_size_test(logdir):
+    # Returns the list of results per buffer size, empty if not loaded
+    fileurl = os.path.join(logdir, "nsd_sizes.json")
+    try:
+        with open(fileurl, "r") as json_file:
+            size_results = json.load(json_file)['results']
+    except Exception:
+        print(RED +
+              "ERROR: " +
+              NOCOLOR +
+              "cannot load JSON for message size sweep. We are going to " +
+              "ignore this test on the results")
+        return []
+    return sorted(size_results, key=lambda r: int(r['config']['buffsize']))
+
+
+def load_multirail_test(logdir):
+    # Returns the per port and per number of ports results of every test
+    # type, empty if not loaded
+    fileurl = os.path.join(logdir, "nsd_multirail.json")
+    try:
+        with open(fileurl, "r") as json_file:
+            multirail_results = json.load(json_file)
+    except Exception:
+        print(RED +
+              "ERROR: " +
+              NOCOLOR +
+              "cannot load JSON for multi-rail test. We are going to " +
+              "ignore this test on the results")
+        return {}
+    return multirail_results
+
+
+def load_rdma_modes_test(logdir):
+    # Returns the RDMA mode matrix summary, empty if not loaded
+    fileurl = os.path.join(logdir, "nsd_rdma_modes.json")
+    try:
+        with open(fileurl, "r") as json_file:
+            rdma_modes_results = json.load(json_file)
+    except Exception:
+        print(RED +
+              "ERROR: " +
+              NOCOLOR +
+              "cannot load JSON for RDMA mode matrix. We are going to " +
+              "ignore this test on the results")
+        return {}
+    return rdma_modes_results
+
+
+def load_loaded_latency(logdir, clients_nodes_d, servers_nodes_d):
+    # Returns per client the idle latency to the servers, from the 1:n ICMP
+    # test, and the latency measured while the many to many tests were
+    # running. All samples are saved on a CSV with their offset to the start
+    # of the first test and the test running at that time, if any
+    loaded_dict = {}
+    windows = []
+    for test_type, nsd_result in load_nsd_results(
+            os.path.join(logdir, "nsd_mess.json")).items():
+        if 'startTime' in nsd_result:
+            windows.append((nsd_result['startTime'], nsd_result['endTime'],
+                            test_type))
+    if not windows:
+        print(RED + "ERROR: " + NOCOLOR +
+              "cannot load the test times of the many to many test. " +
+              "We are going to ignore the loaded latency test on the results")
+        return loaded_dict
+    first_start = min(window[0] for window in windows)
+    csv_rows = []
+    for srchost in sorted(clients_nodes_d.keys()):
+        # idle latency to the same servers
+        idle_latencies = []
+        fileurl = os.path.join(logdir, "lat_" + srchost + "_all")
+        try:
+            for hostIP, latencies in cached_parse(fileurl, parse_fping_file):
+                if hostIP not in servers_nodes_d:
+                    continue
+                idle_latencies.extend([lat for lat in latencies
+                                       if lat != '-'])
+        except BaseException:
+            pass
+        loaded_latencies = []
+        sent = {}
+        fileurl = os.path.join(logdir, "loaded_lat_" + srchost)
+        try:
+            for sample_time, host, seq, lat in cached_parse(
+                    fileurl, parse_loaded_fping_file):
+                sent[host] = max(sent.get(host, 0), seq + 1)
+                test_running = "idle"
+                for start, end, test_type in windows:
+                    if start <= sample_time <= end:
+                        test_running = test_type
+                        loaded_latencies.append(lat)
+                        break
+                csv_rows.append([round(sample_time - first_start, 3),
+                                 srchost, host, lat, test_running])
+        except BaseException:
+            pass
+        if not idle_latencies or not loaded_latencies:
+            print(RED + "ERROR: " + NOCOLOR +
+                  "cannot load idle or loaded latency samples for host " +
+                  srchost + ". We are going to ignore this host on the " +
+                  "loaded latency results")
+            continue
+        received = len([row for row in csv_rows if row[1] == srchost])
+        idle_mean = round(Decimal(mean_list(idle_latencies)), 2)
+        loaded_mean = round(Decimal(mean_list(loaded_latencies)), 2)
+        loaded_dict[srchost] = {
+            'idle': idle_mean,
+            'loaded': loaded_mean,
+            'max': round(Decimal(max_list(loaded_latencies)), 2),
+            'inflation': loaded_mean - idle_mean,
+            'samples': len(loaded_latencies),
+            'lost': sum(sent.values()) - received}
+    fileurl = os.path.join(logdir, "loaded_latency.csv")
+    try:
+        with open(fileurl, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(["Seconds from test start", "Source",
+                                 "Target", "Latency msec", "Test"])
+            for row in sorted(csv_rows):
+                csv_writer.writerow(row)
+    except BaseException:
+        print(RED + "ERROR: " + NOCOLOR + "Cannot write " + fileurl)
+    return loaded_dict
+
+
 def load_multiple_fping(logdir, hosts_dictionary):
     all_fping_dictionary = {}
     all_fping_dictionary_max = {}
@@ -1295,16 +2666,10 @@ def load_multiple_fping(logdir, hosts_dictionary):
     for srchost in hosts_dictionary.keys():
         fileurl = os.path.join(logdir, "lat_" + srchost + "_all")
         file_exists(fileurl)
-        logfping = open(fileurl, 'r')
-        for rawfping in logfping:
-            hostIP = rawfping.split(':')[0]
-            hostIP = hostIP.rstrip(' ')
+        for hostIP, latencies_list in cached_parse(fileurl,
+                                                   parse_fping_file):
             if srchost == hostIP:  # we ignore ourselves
                 continue
-            latencies = rawfping.split(':')[1]
-            latencies = latencies.lstrip(' ')  # Clean up first space
-            latencies = latencies.rstrip('\n')  # Clean up new line character
-            latencies_list = latencies.split(' ')
             # our mean calculation expect strings. Need to change this when
             # optimizing
             mean_all.append(str(mean_list(latencies_list)))
@@ -1324,9 +2689,12 @@ def load_multiple_fping(logdir, hosts_dictionary):
             all_fping_dictionary_min, all_fping_dictionary_stddev)
 
 
-def save_throughput_to_csv(logdir, throughput_dict):
-    # We save per node and all to all
-    fileurl = os.path.join(logdir, "throughput.csv")
+def save_throughput_to_csv(logdir, throughput_dict, test_type):
+    # We save per node and all to all. read keeps the historical file name
+    if test_type == "read":
+        fileurl = os.path.join(logdir, "throughput.csv")
+    else:
+        fileurl = os.path.join(logdir, "throughput_" + test_type + ".csv")
     try:
         with open(fileurl, 'w') as csv_file:
             csv_writer = csv.writer(csv_file)
@@ -1347,9 +2715,1040 @@ def save_throughput_to_csv(logdir, throughput_dict):
             RED +
             "ERROR: " +
             NOCOLOR +
-            "Cannot write throughput.csv file on " + 
-            logdir
+            "Cannot write " +
+            fileurl
+            )
+        sys.exit(1)
+
+
+def size_report(logdir, size_results, tests_list):
+    # Informational only, and saved on CSV
+    percentiles = ["p50", "p90", "p99"]
+    print("Results for message size sweep throughput test")
+    print("The following metrics are not part of the KPI and " +
+          "are shown for informational purposes only")
+    for test_type in tests_list:
+        for size_result in size_results:
+            summary = size_result['tests'][test_type]
+            print(GREEN +
+                  "INFO: " +
+                  NOCOLOR +
+                  "The " +
+                  test_type +
+                  " throughput with buffer size " +
+                  str(size_result['config']['buffsize']) +
+                  " is " +
+                  str(summary['throughput(MB/sec)']) +
+                  " MB/sec, NSD latency average " +
+                  str(summary['average']) +
+                  " msec, " +
+                  ", ".join(pct + " " + str(summary[pct])
+                            for pct in percentiles) +
+                  " msec")
+    fileurl = os.path.join(logdir, "size_sweep.csv")
+    try:
+        with open(fileurl, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(["Test", "Buffsize", "Throughput MB/sec",
+                                 "Throughput msg/sec", "Average msec"] +
+                                [pct + " msec" for pct in percentiles])
+            for test_type in tests_list:
+                for size_result in size_results:
+                    summary = size_result['tests'][test_type]
+                    csv_writer.writerow(
+                        [test_type, size_result['config']['buffsize'],
+                         summary['throughput(MB/sec)'],
+                         summary['throughput(msg/sec)'],
+                         summary['average']] +
+                        [summary[pct] for pct in percentiles])
+        print(
+            GREEN +
+            "INFO: " +
+            NOCOLOR +
+            "CSV file with message size sweep information can be found at " +
+            fileurl
+        )
+    except BaseException:
+        print(
+            RED +
+            "ERROR: " +
+            NOCOLOR +
+            "Cannot write " +
+            fileurl
+            )
+    print("")
+
+
+def multirail_report(logdir, multirail_results, tests_list):
+    # Informational only, and saved on CSV. Ports are numbered as nsdperf
+    # sorts them, N ports are the first N of them
+    print("Results for multi-rail RDMA throughput test")
+    print("The following metrics are not part of the KPI and " +
+          "are shown for informational purposes only")
+    for test_type in tests_list:
+        if test_type not in multirail_results:
+            continue
+        rails = multirail_results[test_type]['rails']
+        ports = multirail_results[test_type]['ports']
+        print("")
+        print("Throughput of " + test_type + " per RDMA port")
+        print_text_table(
+            ["Port", "MB/sec", "% of mean port", "Client ports"],
+            [[rail['rail'], rail['throughput(MB/sec)'], rail['share(%)'],
+              ", ".join(host + " " + port for host, port in
+                        sorted(rail['ports'].items()))]
+             for rail in rails])
+        print("")
+        print("Throughput of " + test_type + " per number of RDMA ports")
+        print_text_table(
+            ["Ports", "MB/sec", "Speedup", "Efficiency %"],
+            [[entry['ports'], entry['throughput(MB/sec)'], entry['speedup'],
+              entry['efficiency(%)']] for entry in ports])
+        for rail in rails:
+            if rail['share(%)'] is not None and \
+                    rail['share(%)'] < FAIR_SHARE_MIN:
+                print(YELLOW + "WARNING: " + NOCOLOR + "the " + test_type +
+                      " throughput over RDMA port " + str(rail['rail']) +
+                      " is " + str(rail['throughput(MB/sec)']) +
+                      " MB/sec. Which is less than " + str(FAIR_SHARE_MIN) +
+                      "% of the mean port")
+        if ports:
+            print(GREEN + "INFO: " + NOCOLOR + "The " + test_type +
+                  " throughput over " + str(ports[-1]['ports']) +
+                  " RDMA ports is " +
+                  str(ports[-1]['throughput(MB/sec)']) + " MB/sec, " +
+                  str(ports[-1]['efficiency(%)']) + "% of the sum of " +
+                  "the ports alone")
+    fileurl = os.path.join(logdir, "multirail.csv")
+    try:
+        with open(fileurl, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(["Test", "Run", "Port(s)", "Throughput MB/sec",
+                                 "% of mean port", "Speedup",
+                                 "Efficiency %"])
+            for test_type in tests_list:
+                if test_type not in multirail_results:
+                    continue
+                for rail in multirail_results[test_type]['rails']:
+                    csv_writer.writerow(
+                        [test_type, "port", rail['rail'],
+                         rail['throughput(MB/sec)'], rail['share(%)'], "",
+                         ""])
+                for entry in multirail_results[test_type]['ports']:
+                    csv_writer.writerow(
+                        [test_type, "ports", entry['ports'],
+                         entry['throughput(MB/sec)'], "", entry['speedup'],
+                         entry['efficiency(%)']])
+        print(
+            GREEN +
+            "INFO: " +
+            NOCOLOR +
+            "CSV file with multi-rail information can be found at " +
+            fileurl
+        )
+    except BaseException:
+        print(
+            RED +
+            "ERROR: " +
+            NOCOLOR +
+            "Cannot write " +
+            fileurl
+            )
+    print("")
+
+
+def rdma_modes_report(logdir, rdma_modes_results, tests_list):
+    # Informational only, and saved on CSV
+    percentiles = ["p50", "p90", "p99"]
+    modes = rdma_modes_results['modes']
+    results = rdma_modes_results['results']
+    print("Results for RDMA mode matrix throughput test")
+    print("The following metrics are not part of the KPI and " +
+          "are shown for informational purposes only")
+    for rdma_mode in modes:
+        if results.get(rdma_mode) is None:
+            print(YELLOW + "WARNING: " + NOCOLOR + "the tests with RDMA " +
+                  "mode " + rdma_mode + " failed, see nsdperfTool_log")
+    for test_type in tests_list:
+        rows = []
+        for rdma_mode in modes:
+            summary = (results.get(rdma_mode) or {}).get(test_type)
+            if summary is None:
+                continue
+            rows.append([rdma_mode, summary['throughput(MB/sec)'],
+                         summary['average']] +
+                        [summary[pct] for pct in percentiles] +
+                        [summary['cli%'], summary['srv%']])
+        if not rows:
+            continue
+        print("")
+        print("Throughput of " + test_type + " per RDMA mode")
+        print_text_table(["Mode", "MB/sec", "Average msec"] +
+                         [pct + " msec" for pct in percentiles] +
+                         ["Client CPU %", "Server CPU %"], rows)
+        best = max(rows, key=lambda row: row[1])
+        print(GREEN + "INFO: " + NOCOLOR + "The fastest RDMA mode for " +
+              test_type + " is " + best[0] + " with " + str(best[1]) +
+              " MB/sec")
+    fileurl = os.path.join(logdir, "rdma_modes.csv")
+    try:
+        with open(fileurl, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(["Test", "Mode", "Throughput MB/sec",
+                                 "Throughput msg/sec", "Average msec"] +
+                                [pct + " msec" for pct in percentiles] +
+                                ["Client CPU %", "Server CPU %"])
+            for test_type in tests_list:
+                for rdma_mode in modes:
+                    summary = (results.get(rdma_mode) or {}).get(test_type)
+                    if summary is None:
+                        continue
+                    csv_writer.writerow(
+                        [test_type, rdma_mode, summary['throughput(MB/sec)'],
+                         summary['throughput(msg/sec)'],
+                         summary['average']] +
+                        [summary[pct] for pct in percentiles] +
+                        [summary['cli%'], summary['srv%']])
+        print(
+            GREEN +
+            "INFO: " +
+            NOCOLOR +
+            "CSV file with RDMA mode matrix information can be found at " +
+            fileurl
+        )
+    except BaseException:
+        print(
+            RED +
+            "ERROR: " +
+            NOCOLOR +
+            "Cannot write " +
+            fileurl
             )
+    print("")
+
+
+def socket_buffers_report(logdir, hosts_dictionary, patterns_list):
+    # Warns about the nodes that got smaller socket buffers than the
+    # nsdperf runs asked for, the kernel limits them to net.core.rmem_max
+    # and wmem_max. nsdperf 1.38 and later report them. Not part of the KPI
+    limited = {}
+    checked = set()
+    for pattern, client, fileurl in nsd_result_files(logdir, hosts_dictionary,
+                                                     patterns_list):
+        for nsd_result in load_nsd_results(fileurl).values():
+            socksize = int(nsd_result.get('socksize') or 0)
+            buffers = nsd_result.get('socketBuffers', {})
+            for host in buffers:
+                checked.add(host)
+                for item, limit in [('rcvbuf', 'rmemMax'),
+                                    ('sndbuf', 'wmemMax')]:
+                    if buffers[host][item] < socksize:
+                        limited.setdefault((host, item), (
+                            buffers[host][item], socksize,
+                            buffers[host][limit]))
+    if not checked:
+        return
+    print("")
+    for host, item in sorted(limited):
+        size, socksize, limit = limited[(host, item)]
+        sysctl = "net.core.rmem_max" if item == "rcvbuf" else \
+            "net.core.wmem_max"
+        print(YELLOW + "WARNING: " + NOCOLOR + host + " " + item + " is " +
+              str(size) + " bytes instead of " + str(socksize) +
+              (", limited by " + sysctl + " " + str(limit)
+               if limit is not None else ""))
+    if not limited:
+        print(GREEN + "OK: " + NOCOLOR + "all nodes got the socket buffer " +
+              "size the throughput tests asked for")
+
+
+def loaded_latency_KPI(max_inflation, loaded_dict):
+    errors = 0
+    print("Results for loaded latency test")
+    for host in sorted(loaded_dict.keys()):
+        inflation = loaded_dict[host]['inflation']
+        if inflation > max_inflation:
+            errors = errors + 1
+            print(RED +
+                  "ERROR: " +
+                  NOCOLOR +
+                  "on host " +
+                  host +
+                  " the ICMP latency under load grows " +
+                  str(inflation) +
+                  " msec over idle. Which is more than the KPI of " +
+                  str(max_inflation) +
+                  " msec")
+        else:
+            print(GREEN +
+                  "OK: " +
+                  NOCOLOR +
+                  "on host " +
+                  host +
+                  " the ICMP latency under load grows " +
+                  str(inflation) +
+                  " msec over idle. Which is lower than the KPI of " +
+                  str(max_inflation) +
+                  " msec")
+        print(GREEN +
+              "INFO: " +
+              NOCOLOR +
+              "The ICMP latency for " +
+              host +
+              " is " +
+              str(loaded_dict[host]['idle']) +
+              " msec idle and " +
+              str(loaded_dict[host]['loaded']) +
+              " msec under load, with a maximum of " +
+              str(loaded_dict[host]['max']) +
+              " msec, " +
+              str(loaded_dict[host]['samples']) +
+              " samples and " +
+              str(loaded_dict[host]['lost']) +
+              " lost")
+    print("")
+    return errors
+
+
+def histogram_percentile(histogram, pct):
+    # Smallest nsdperf histogram bucket (msec) holding pct percent of events
+    total = sum(int(n) for n in histogram.values())
+    if not total:
+        return None
+    count = 0
+    for msec in sorted(histogram.keys(), key=float):
+        count = count + int(histogram[msec])
+        if count * 100.0 >= total * pct:
+            return float(msec)
+
+
+def delay_percentile(delay, pct):
+    # Percentile nsdperf printed for the client, from its histogram if it
+    # is an nsdperf older than 1.30
+    percentiles = delay.get('percentiles', {})
+    if "p%g" % pct in percentiles:
+        return float(percentiles["p%g" % pct])
+    return histogram_percentile(delay['histogram'], pct)
+
+
+def metric_labels(labels):
+    # OpenMetrics label set, values escaped
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        escaped.append(name + '="' + value + '"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def nsd_result_files(logdir, hosts_dictionary, patterns_list):
+    # Returns [(pattern, client, fileurl), ...] of the nsdperf results of a run
+    nsd_files = [("1:n", host, os.path.join(logdir, "nsd_" + host + ".json"))
+                 for host in hosts_dictionary.keys()]
+    nsd_files.append(("many_to_many", "all",
+                      os.path.join(logdir, "nsd_mess.json")))
+    for pattern in patterns_list:
+        nsd_files.append((pattern, "all", os.path.join(
+            logdir, "nsd_pattern_" + pattern + ".json")))
+    return nsd_files
+
+
+def load_pair_latencies(logdir, hosts_dictionary):
+    # Returns [(source, target, latencies, received), ...] from the 1:n fping
+    # files of a run, lost packets are '-' on latencies and not on received
+    pairs = []
+    for srchost in sorted(hosts_dictionary.keys()):
+        fileurl = os.path.join(logdir, "lat_" + srchost + "_all")
+        if not os.path.isfile(fileurl):
+            continue
+        for target, latencies in cached_parse(fileurl, parse_fping_file):
+            if target == srchost:
+                continue
+            received = [lat for lat in latencies if lat != '-']
+            pairs.append((srchost, target, latencies, received))
+    return pairs
+
+
+def collect_metrics(logdir, hosts_dictionary, patterns_list):
+    # Returns {metric: (help, [(labels, value), ...])} from the files of the
+    # run on logdir so it does not depend on what the KPI functions kept
+    metrics = {}
+
+    def add(name, help_str, labels, value):
+        if value is None:
+            return
+        metrics.setdefault(name, (help_str, []))[1].append((labels, value))
+
+    for pattern, client, fileurl in nsd_result_files(logdir, hosts_dictionary,
+                                                     patterns_list):
+        nsd_results = load_nsd_results(fileurl)
+        for test_type, nsd_result in nsd_results.items():
+            labels = [('pattern', pattern), ('client', client),
+                      ('test', test_type)]
+            add('koet_nsd_throughput_mbytes_per_second',
+                'nsdperf throughput in MB/sec', labels,
+                float(nsd_result['throughput(MB/sec)']))
+            for delay in nsd_result['networkDelay']:
+                delay_labels = [('pattern', pattern),
+                                ('client', delay['client']),
+                                ('test', test_type)]
+                add('koet_nsd_latency_average_milliseconds',
+                    'nsdperf network delay average in msec', delay_labels,
+                    float(delay['average']))
+                add('koet_nsd_latency_stddev_milliseconds',
+                    'nsdperf network delay standard deviation in msec',
+                    delay_labels, float(delay['standardDeviation']))
+                for pct in [50, 90, 99, 99.9]:
+                    add('koet_nsd_latency_milliseconds',
+                        'nsdperf network delay percentiles in msec',
+                        delay_labels + [('percentile', pct)],
+                        delay_percentile(delay, pct))
+            servers = nsd_result.get('serverThroughput', {})
+            for server, values in sorted(servers.items()):
+                add('koet_nsd_server_throughput_mbytes_per_second',
+                    'nsdperf throughput per server in MB/sec',
+                    labels + [('server', server)],
+                    float(values['throughput(MB/sec)']))
+            add('koet_nsd_server_fairness_index',
+                'Jain\'s fairness index of the nsdperf server throughput',
+                labels, jain_fairness([float(values['throughput(MB/sec)'])
+                                       for values in servers.values()]))
+            for host, net_data in sorted(nsd_result['netData'].items()):
+                counter_labels = [('pattern', pattern), ('host', host),
+                                  ('test', test_type)]
+                add('koet_nsd_rx_errors',
+                    'Rx errors during the nsdperf test', counter_labels,
+                    int(net_data['rxErrors']))
+                add('koet_nsd_tx_errors',
+                    'Tx errors during the nsdperf test', counter_labels,
+                    int(net_data['txErrors']))
+                add('koet_nsd_retransmits',
+                    'TCP retransmitted segments during the nsdperf test',
+                    counter_labels, int(net_data['retransmit']))
+
+    for srchost, target, latencies, received in \
+            load_pair_latencies(logdir, hosts_dictionary):
+        labels = [('source', srchost), ('target', target)]
+        add('koet_icmp_packets_sent', 'ICMP packets sent', labels,
+            len(latencies))
+        add('koet_icmp_packets_lost', 'ICMP packets lost', labels,
+            len(latencies) - len(received))
+        if received:
+            add('koet_icmp_latency_average_milliseconds',
+                'ICMP latency average in msec', labels,
+                round(mean_list(received), 3))
+            add('koet_icmp_latency_max_milliseconds',
+                'ICMP latency maximum in msec', labels,
+                max_list(received))
+
+    # Phases are the koet spans not tied to a host
+    fileurl = os.path.join(logdir, "koet_spans.json")
+    if os.path.isfile(fileurl):
+        with open(fileurl, 'r') as spans_file:
+            for span_line in spans_file:
+                if span_line.strip() == "":
+                    continue
+                span = json.loads(span_line)
+                if span['host'] == "":
+                    add('koet_phase_duration_seconds',
+                        'Wall time of the koet run phases',
+                        [('phase', span['name'])], span['duration'])
+    return metrics
+
+
+def write_metrics(logdir, metrics_dir, hosts_dictionary, patterns_list):
+    # OpenMetrics text file on the log dir and, if given, on metrics_dir for
+    # the node_exporter textfile collector. Written to a temporary file and
+    # renamed so readers never see it half written
+    metrics = collect_metrics(logdir, hosts_dictionary, patterns_list)
+    lines = []
+    lines.append('# HELP koet_info koet version of the run')
+    lines.append('# TYPE koet_info gauge')
+    lines.append('koet_info' + metric_labels([('version', KOET_VERSION)]) +
+                 ' 1')
+    lines.append('# HELP koet_run_timestamp_seconds Time the run ended')
+    lines.append('# TYPE koet_run_timestamp_seconds gauge')
+    lines.append('koet_run_timestamp_seconds ' + str(round(time.time(), 3)))
+    for name in sorted(metrics.keys()):
+        help_str, samples = metrics[name]
+        lines.append('# HELP ' + name + ' ' + help_str)
+        lines.append('# TYPE ' + name + ' gauge')
+        for labels, value in samples:
+            lines.append(name + metric_labels(labels) + ' ' + str(value))
+    lines.append('# EOF')
+    content = '\n'.join(lines) + '\n'
+    fileurls = [os.path.join(logdir, "metrics.prom")]
+    if metrics_dir:
+        fileurls.append(os.path.join(metrics_dir, "koet.prom"))
+    for fileurl in fileurls:
+        tmp_fileurl = os.path.join(os.path.dirname(fileurl),
+                                   "." + os.path.basename(fileurl) + ".tmp")
+        try:
+            with open(tmp_fileurl, 'w') as metrics_file:
+                metrics_file.write(content)
+                metrics_file.flush()
+                os.fsync(metrics_file.fileno())
+            os.rename(tmp_fileurl, fileurl)
+            print(GREEN + "INFO: " + NOCOLOR +
+                  "OpenMetrics file with the results can be found at " +
+                  fileurl)
+        except BaseException:
+            print(RED + "ERROR: " + NOCOLOR + "Cannot write " + fileurl)
+
+
+def open_results_db(db_file):
+    # Opens the results store creating its tables and indexes if needed
+    import sqlite3
+    db = sqlite3.connect(db_file)
+    # Stores of older versions have no test column on the counters
+    columns = [row[1] for row in db.execute("PRAGMA table_info(counters)")]
+    if columns and 'test' not in columns:
+        db.execute("ALTER TABLE counters ADD COLUMN test TEXT")
+    db.executescript(RESULTS_SCHEMA)
+    return db
+
+
+def store_results(db_file, logdir, run_info, fping_stats, hosts_dictionary,
+                  patterns_list):
+    # Appends the run on logdir to the results store. run_info has the
+    # columns of the runs table and fping_stats the 1:n ICMP dictionaries
+    # (average, max, min, stddev) per host as the KPI saw them
+    import sqlite3
+    import statistics
+    try:
+        db = open_results_db(db_file)
+        with db:
+            cursor = db.execute(
+                "INSERT INTO runs (run_time, logdir, version, hosts, tests, "
+                "patterns, rdma, fping_count, perf_runtime, min_throughput, "
+                "max_avg_latency, return_code) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_info['run_time'], logdir, KOET_VERSION,
+                 ",".join(sorted(hosts_dictionary.keys())),
+                 ",".join(run_info['tests']), ",".join(patterns_list),
+                 int(run_info['rdma']), run_info['fping_count'],
+                 run_info['perf_runtime'], run_info['min_throughput'],
+                 run_info['max_avg_latency'], run_info['return_code']))
+            run_id = cursor.lastrowid
+            fping_avg, fping_max, fping_min, fping_stddev = fping_stats
+            db.executemany(
+                "INSERT INTO host_latency VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, host, float(fping_avg[host]),
+                  float(fping_max[host]), float(fping_min[host]),
+                  float(fping_stddev[host]))
+                 for host in sorted(fping_avg.keys())])
+            for srchost, target, latencies, received in \
+                    load_pair_latencies(logdir, hosts_dictionary):
+                average = None
+                maximum = None
+                if received:
+                    average = round(mean_list(received), 3)
+                    maximum = max_list(received)
+                db.execute(
+                    "INSERT INTO pair_latency VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, srchost, target, len(latencies),
+                     len(latencies) - len(received), average, maximum))
+            for pattern, client, fileurl in nsd_result_files(
+                    logdir, hosts_dictionary, patterns_list):
+                nsd_results = load_nsd_results(fileurl)
+                for test_type, nsd_result in sorted(nsd_results.items()):
+                    delays = nsd_result['networkDelay']
+                    latency_average = None
+                    latency_stddev = None
+                    if delays:
+                        latency_average = round(statistics.mean(
+                            [float(delay['average']) for delay in delays]), 3)
+                        latency_stddev = round(statistics.mean(
+                            [float(delay['standardDeviation'])
+                             for delay in delays]), 3)
+                    db.execute(
+                        "INSERT INTO throughput VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, pattern, client, test_type,
+                         float(nsd_result['throughput(MB/sec)']),
+                         latency_average, latency_stddev))
+                    for host, net_data in sorted(
+                            nsd_result['netData'].items()):
+                        db.execute(
+                            "INSERT INTO counters (run_id, pattern, host, "
+                            "test, rx_errors, tx_errors, retransmits) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (run_id, pattern, host, test_type,
+                             int(net_data['rxErrors']),
+                             int(net_data['txErrors']),
+                             int(net_data['retransmit'])))
+        db.close()
+        print(GREEN + "INFO: " + NOCOLOR +
+              "results of this run appended to the results store " + db_file)
+    except (sqlite3.Error, KeyError, ValueError) as error:
+        print(RED + "ERROR: " + NOCOLOR +
+              "cannot append this run to the results store " + db_file +
+              ": " + str(error))
+
+
+def parse_history_arguments(history_args):
+    parser = argparse.ArgumentParser(
+        prog='koet.py history',
+        description='Shows the results of previous runs from the results ' +
+                    'store')
+    parser.add_argument(
+        '--host',
+        action='store',
+        dest='host',
+        help='show only this host. On throughput it is the 1:n client',
+        metavar='HOST',
+        type=str,
+        default=None)
+    parser.add_argument(
+        '-t',
+        '--test',
+        action='store',
+        dest='test',
+        help='show only this nsdperf test type, or ICMP latency with ' +
+             '"latency"',
+        metavar='TEST',
+        type=str,
+        default=None)
+    parser.add_argument(
+        '--pattern',
+        action='store',
+        dest='pattern',
+        help='show only this throughput pattern: 1:n, many_to_many or a ' +
+             'traffic pattern. Defaults to all',
+        metavar='PATTERN',
+        type=str,
+        default=None)
+    parser.add_argument(
+        '--last',
+        action='store',
+        dest='last',
+        help='show the last LAST runs with results that match the ' +
+             'filters. Defaults to 30',
+        metavar='LAST',
+        type=int,
+        default=30)
+    parser.add_argument(
+        '--db',
+        action='store',
+        dest='db_file',
+        help='results store to read. Defaults to ' +
+             os.path.join('log', RESULTS_DB),
+        metavar='DB_FILE',
+        type=str,
+        default=os.path.join(os.getcwd(), 'log', RESULTS_DB))
+    args = parser.parse_args(history_args)
+    if args.last < 1:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "the number of runs to show must be 1 or more\n")
+    if args.test is not None and args.test != "latency" and \
+            args.test not in NSD_TESTS:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "test " + args.test +
+                 " is not latency nor one of " + ", ".join(NSD_TESTS) + "\n")
+    if not os.path.isfile(args.db_file):
+        sys.exit(RED + "QUIT: " + NOCOLOR + "results store " + args.db_file +
+                 " does not exist\n")
+    return args.host, args.test, args.pattern, args.last, args.db_file
+
+
+def print_text_table(header, rows):
+    # Left aligned columns as wide as their widest value
+    rows = [["-" if value is None else str(value) for value in row]
+            for row in rows]
+    widths = [max([len(header[col])] + [len(row[col]) for row in rows])
+              for col in range(len(header))]
+    print("  ".join(header[col].ljust(widths[col])
+                    for col in range(len(header))).rstrip())
+    for row in rows:
+        print("  ".join(row[col].ljust(widths[col])
+                        for col in range(len(header))).rstrip())
+
+
+def history(history_args):
+    host, test_type, pattern, last, db_file = parse_history_arguments(
+        history_args)
+    import sqlite3
+    try:
+        db = open_results_db(db_file)
+        if test_type == "latency":
+            table = "host_latency"
+            columns = ("host_latency.host, host_latency.average, "
+                       "host_latency.maximum, host_latency.minimum, "
+                       "host_latency.stddev")
+            filters = [("host_latency.host", host)]
+            header = ["Run time", "Host", "Avg msec", "Max msec", "Min msec",
+                      "Stddev msec"]
+            order = "runs.run_time, host_latency.host"
+        else:
+            table = "throughput"
+            columns = ("throughput.pattern, throughput.client, "
+                       "throughput.test, throughput.throughput, "
+                       "throughput.latency_average, "
+                       "throughput.latency_stddev")
+            filters = [("throughput.client", host),
+                       ("throughput.test", test_type),
+                       ("throughput.pattern", pattern)]
+            header = ["Run time", "Pattern", "Client", "Test", "MB/sec",
+                      "NSD avg msec", "NSD stddev msec"]
+            order = ("runs.run_time, throughput.pattern, throughput.client, "
+                     "throughput.test")
+        # The filters go on the last runs too, so --last counts the runs
+        # that have matching results and not every run on the store
+        where = " AND ".join(["1"] + [column + " = ?"
+                                      for column, value in filters
+                                      if value is not None])
+        filter_params = [value for column, value in filters
+                         if value is not None]
+        source = (" FROM " + table + " JOIN runs ON runs.id = " + table +
+                  ".run_id WHERE " + where)
+        last_runs = ("SELECT runs.id" + source + " GROUP BY runs.id "
+                     "ORDER BY runs.run_time DESC, runs.id DESC LIMIT ?")
+        query = ("SELECT runs.run_time, " + columns + source +
+                 " AND runs.id IN (" + last_runs + ") ORDER BY " + order)
+        params = filter_params + filter_params + [last]
+        rows = db.execute(query, params).fetchall()
+        db.close()
+    except sqlite3.Error as error:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "cannot read results store " +
+                 db_file + ": " + str(error) + "\n")
+    if not rows:
+        print(YELLOW + "WARNING: " + NOCOLOR +
+              "no results on " + db_file + " match the given filters")
+        return 0
+    print_text_table(header, rows)
+    return 0
+
+
+def parse_compare_arguments(compare_args):
+    parser = argparse.ArgumentParser(
+        prog='koet.py compare',
+        description='Compares a run against a baseline run and flags ' +
+                    'regressions. Exits with the number of regressions')
+    parser.add_argument(
+        'baseline',
+        help='log directory or results store id of the baseline run',
+        metavar='BASELINE')
+    parser.add_argument(
+        'current',
+        help='log directory or results store id of the run to check',
+        metavar='CURRENT')
+    parser.add_argument(
+        '--throughput_drop',
+        action='store',
+        dest='throughput_drop',
+        help='throughput drop in percent that is a regression. ' +
+             'Defaults to ' + str(COMPARE_THROUGHPUT_DROP),
+        metavar='PCT',
+        type=float,
+        default=COMPARE_THROUGHPUT_DROP)
+    parser.add_argument(
+        '--latency_rise',
+        action='store',
+        dest='latency_rise',
+        help='ICMP and NSD latency rise in percent that is a regression ' +
+             'if significant. Defaults to ' + str(COMPARE_LATENCY_RISE),
+        metavar='PCT',
+        type=float,
+        default=COMPARE_LATENCY_RISE)
+    parser.add_argument(
+        '--loss_rise',
+        action='store',
+        dest='loss_rise',
+        help='ICMP loss rise in percentage points that is a regression. ' +
+             'Defaults to ' + str(COMPARE_LOSS_RISE),
+        metavar='PCT',
+        type=float,
+        default=COMPARE_LOSS_RISE)
+    parser.add_argument(
+        '--retransmits_rise',
+        action='store',
+        dest='retransmits_rise',
+        help='rise of TCP retransmitted segments or Rx/Tx errors that is a ' +
+             'regression. Defaults to ' + str(COMPARE_RETRANSMITS_RISE),
+        metavar='COUNT',
+        type=int,
+        default=COMPARE_RETRANSMITS_RISE)
+    parser.add_argument(
+        '--alpha',
+        action='store',
+        dest='alpha',
+        help='significance level of the latency differences. Defaults to ' +
+             str(COMPARE_ALPHA),
+        metavar='ALPHA',
+        type=float,
+        default=COMPARE_ALPHA)
+    parser.add_argument(
+        '--db',
+        action='store',
+        dest='db_file',
+        help='results store to resolve run ids. Defaults to ' +
+             os.path.join('log', RESULTS_DB),
+        metavar='DB_FILE',
+        type=str,
+        default=os.path.join(os.getcwd(), 'log', RESULTS_DB))
+    args = parser.parse_args(compare_args)
+    if args.throughput_drop < 0 or args.latency_rise < 0 or \
+            args.loss_rise < 0 or args.retransmits_rise < 0:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "regression thresholds cannot be negative\n")
+    if args.alpha <= 0 or args.alpha >= 1:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "the significance level must be between 0 and 1\n")
+    thresholds = {'throughput_drop': args.throughput_drop,
+                  'latency_rise': args.latency_rise,
+                  'loss_rise': args.loss_rise,
+                  'retransmits_rise': args.retransmits_rise,
+                  'alpha': args.alpha}
+    return (resolve_run(args.baseline, args.db_file),
+            resolve_run(args.current, args.db_file), thresholds)
+
+
+def resolve_run(run_ref, db_file):
+    # A run is given by its log directory or by its results store id
+    if os.path.isdir(run_ref):
+        return os.path.abspath(run_ref)
+    if not run_ref.isdigit():
+        sys.exit(RED + "QUIT: " + NOCOLOR + run_ref +
+                 " is not a log directory nor a results store id\n")
+    import sqlite3
+    if not os.path.isfile(db_file):
+        sys.exit(RED + "QUIT: " + NOCOLOR + "results store " + db_file +
+                 " does not exist\n")
+    try:
+        db = open_results_db(db_file)
+        row = db.execute("SELECT logdir FROM runs WHERE id = ?",
+                         (int(run_ref),)).fetchone()
+        db.close()
+    except sqlite3.Error as error:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "cannot read results store " +
+                 db_file + ": " + str(error) + "\n")
+    if row is None:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "run " + run_ref +
+                 " is not on results store " + db_file + "\n")
+    if not os.path.isdir(row[0]):
+        sys.exit(RED + "QUIT: " + NOCOLOR + "log directory " + row[0] +
+                 " of run " + run_ref + " does not exist anymore\n")
+    return row[0]
+
+
+def sample_stats(samples):
+    # (count, mean, variance) of a list of floats
+    import statistics
+    if len(samples) < 2:
+        return None
+    return (len(samples), statistics.mean(samples),
+            statistics.variance(samples))
+
+
+def histogram_stats(histogram):
+    # (count, mean, variance) of an nsdperf histogram of msec buckets
+    values = [(float(msec), int(n)) for msec, n in histogram.items()]
+    total = sum(n for msec, n in values)
+    if total < 2:
+        return None
+    mean = sum(msec * n for msec, n in values) / float(total)
+    variance = sum(n * (msec - mean) ** 2 for msec, n in values) / \
+        float(total - 1)
+    return (total, mean, variance)
+
+
+def difference_p_value(baseline_stats, current_stats):
+    # Two sided p-value of the difference of means (Welch, normal
+    # approximation as fping and nsdperf give hundreds of samples)
+    if baseline_stats is None or current_stats is None:
+        return None
+    n_a, mean_a, var_a = baseline_stats
+    n_b, mean_b, var_b = current_stats
+    std_error = sqrt(var_a / n_a + var_b / n_b)
+    if std_error == 0:
+        if mean_a == mean_b:
+            return 1.0
+        return 0.0
+    return erfc(abs(mean_b - mean_a) / std_error / sqrt(2))
+
+
+def sample_percentile(samples, pct):
+    # Nearest rank percentile of a list of floats
+    ordered = sorted(samples)
+    rank = int(ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def run_hosts_patterns(logdir):
+    # Hosts and traffic patterns of the run on logdir, taken from the file
+    # names so any koet run can be loaded
+    hosts_dictionary = {}
+    patterns_list = []
+    for file_name in sorted(os.listdir(logdir)):
+        if file_name.startswith("lat_") and file_name.endswith("_all"):
+            hosts_dictionary[file_name[len("lat_"):-len("_all")]] = None
+        elif file_name.startswith("nsd_pattern_") and \
+                file_name.endswith(".json"):
+            patterns_list.append(
+                file_name[len("nsd_pattern_"):-len(".json")])
+    if not hosts_dictionary:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "there are no koet results on " +
+                 logdir + "\n")
+    return hosts_dictionary, patterns_list
+
+
+def load_run_results(logdir):
+    # Everything compare needs from the files of a run on logdir
+    hosts_dictionary, patterns_list = run_hosts_patterns(logdir)
+    load_analysis_cache(logdir)
+    run = {'pairs': {}, 'hosts': {}, 'throughput': {}, 'nsd_latency': {},
+           'counters': {}}
+    for srchost, target, latencies, received in \
+            load_pair_latencies(logdir, hosts_dictionary):
+        samples = [float(lat) for lat in received]
+        run['pairs'][(srchost, target)] = (len(latencies), samples)
+        sent, host_samples = run['hosts'].get(srchost, (0, []))
+        run['hosts'][srchost] = (sent + len(latencies),
+                                 host_samples + samples)
+    for pattern, client, fileurl in nsd_result_files(logdir, hosts_dictionary,
+                                                     patterns_list):
+        nsd_results = load_nsd_results(fileurl)
+        for test_type, nsd_result in nsd_results.items():
+            run['throughput'][(pattern, client, test_type)] = float(
+                nsd_result['throughput(MB/sec)'])
+            for delay in nsd_result['networkDelay']:
+                run['nsd_latency'][(pattern, delay['client'], test_type)] = \
+                    delay['histogram']
+            for host, net_data in nsd_result['netData'].items():
+                run['counters'][(pattern, host, test_type)] = (
+                    int(net_data['rxErrors']), int(net_data['txErrors']),
+                    int(net_data['retransmit']))
+    return run
+
+
+def delta_pct(baseline, current):
+    if baseline is None or current is None or baseline == 0:
+        return None
+    return round((current - baseline) * 100.0 / baseline, 2)
+
+
+def compare_latency(rows, scope, key, base_samples, cur_samples,
+                    p_value, thresholds):
+    # Average and percentiles of two latency distributions. A rise is a
+    # regression only if the distributions differ significantly
+    significant = p_value is None or p_value < thresholds['alpha']
+    for metric, pct in [("latency avg", None), ("latency p50", 50),
+                        ("latency p90", 90), ("latency p99", 99)]:
+        if pct is None:
+            base_value = round(base_samples[1], 3)
+            cur_value = round(cur_samples[1], 3)
+        else:
+            base_value = base_samples[0](pct)
+            cur_value = cur_samples[0](pct)
+        change = delta_pct(base_value, cur_value)
+        regression = change is not None and significant and \
+            change > thresholds['latency_rise']
+        rows.append((scope, key, metric, base_value, cur_value, change,
+                     p_value, regression))
+
+
+def compare_runs(baseline, current, thresholds):
+    # Returns [(scope, key, metric, baseline, current, delta %, p-value,
+    # regression), ...] of everything both runs have
+    rows = []
+    for scope, key_name in [('host', 'hosts'), ('pair', 'pairs')]:
+        for key in sorted(set(baseline[key_name]) & set(current[key_name])):
+            base_sent, base_samples = baseline[key_name][key]
+            cur_sent, cur_samples = current[key_name][key]
+            key_str = key if scope == 'host' else key[0] + "->" + key[1]
+            base_loss = round(
+                (base_sent - len(base_samples)) * 100.0 / base_sent, 2)
+            cur_loss = round(
+                (cur_sent - len(cur_samples)) * 100.0 / cur_sent, 2)
+            rows.append((scope, key_str, "loss %", base_loss, cur_loss,
+                         round(cur_loss - base_loss, 2), None,
+                         cur_loss - base_loss > thresholds['loss_rise']))
+            base_stats = sample_stats(base_samples)
+            cur_stats = sample_stats(cur_samples)
+            if base_stats is None or cur_stats is None:
+                continue
+            compare_latency(
+                rows, scope, key_str,
+                (lambda pct: sample_percentile(base_samples, pct),
+                 base_stats[1]),
+                (lambda pct: sample_percentile(cur_samples, pct),
+                 cur_stats[1]),
+                difference_p_value(base_stats, cur_stats), thresholds)
+    for key in sorted(set(baseline['throughput']) &
+                      set(current['throughput'])):
+        base_value = baseline['throughput'][key]
+        cur_value = current['throughput'][key]
+        change = delta_pct(base_value, cur_value)
+        rows.append(("throughput", "/".join(key), "MB/sec", base_value,
+                     cur_value, change, None,
+                     change is not None and
+                     -change > thresholds['throughput_drop']))
+    for key in sorted(set(baseline['nsd_latency']) &
+                      set(current['nsd_latency'])):
+        base_hist = baseline['nsd_latency'][key]
+        cur_hist = current['nsd_latency'][key]
+        base_stats = histogram_stats(base_hist)
+        cur_stats = histogram_stats(cur_hist)
+        if base_stats is None or cur_stats is None:
+            continue
+        compare_latency(
+            rows, "nsd", "/".join(key),
+            (lambda pct: histogram_percentile(base_hist, pct), base_stats[1]),
+            (lambda pct: histogram_percentile(cur_hist, pct), cur_stats[1]),
+            difference_p_value(base_stats, cur_stats), thresholds)
+    for key in sorted(set(baseline['counters']) & set(current['counters'])):
+        for index, metric in enumerate(["rx errors", "tx errors",
+                                        "retransmits"]):
+            base_value = baseline['counters'][key][index]
+            cur_value = current['counters'][key][index]
+            rows.append(("counters", "/".join(key), metric, base_value,
+                         cur_value, delta_pct(base_value, cur_value), None,
+                         cur_value - base_value >
+                         thresholds['retransmits_rise']))
+    return rows
+
+
+def compare(compare_args):
+    baseline_dir, current_dir, thresholds = parse_compare_arguments(
+        compare_args)
+    print("Comparing run " + current_dir + " against baseline " +
+          baseline_dir)
+    print("")
+    rows = compare_runs(load_run_results(baseline_dir),
+                        load_run_results(current_dir), thresholds)
+    if not rows:
+        sys.exit(RED + "QUIT: " + NOCOLOR +
+                 "the runs have no results in common to compare\n")
+    header = ["Scope", "Key", "Metric", "Baseline", "Current", "Delta %",
+              "p-value", "Result"]
+    print_text_table(header, [
+        list(row[:6]) + [None if row[6] is None else "%.3g" % row[6],
+                         "REGRESSION" if row[7] else "ok"]
+        for row in rows])
+    print("")
+    fileurl = os.path.join(current_dir, "compare.csv")
+    try:
+        with open(fileurl, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(header)
+            for row in rows:
+                csv_writer.writerow(list(row[:7]) + [int(row[7])])
+        print(GREEN + "INFO: " + NOCOLOR +
+              "CSV file with the comparison can be found at " + fileurl)
+    except BaseException:
+        print(RED + "ERROR: " + NOCOLOR + "Cannot write " + fileurl)
+    regressions = [row for row in rows if row[7]]
+    for scope, key, metric, base_value, cur_value, change, p_value, \
+            regression in regressions:
+        print(RED + "ERROR: " + NOCOLOR + scope + " " + key + " " + metric +
+              " went from " + str(base_value) + " to " + str(cur_value))
+    if regressions:
+        print(RED + "ERROR: " + NOCOLOR + str(len(regressions)) +
+              " regression[s] against the baseline")
+    else:
+        print(GREEN + "OK: " + NOCOLOR +
+              "no regressions against the baseline")
+    print("")
+    # A regression fails the command, so it can gate a change window
+    if regressions:
         sys.exit(1)
 
 
@@ -1367,9 +3766,10 @@ def nsd_KPI(min_nsd_throughput,
             nsd_txe_dict,
             nsd_txe_m2m_d,
             nsd_rtr_dict,
-            nsd_rtr_m2m_d):
+            nsd_rtr_m2m_d,
+            test_type):
     errors = 0
-    print("Results for throughput test ")
+    print("Results for " + test_type + " throughput test ")
     for host in throughput_dict.keys():
         if throughput_dict[host] < min_nsd_throughput:
             errors = errors + 1
@@ -1378,7 +3778,9 @@ def nsd_KPI(min_nsd_throughput,
                   NOCOLOR +
                   "on host " +
                   host +
-                  " the throughput test result is " +
+                  " the " +
+                  test_type +
+                  " throughput test result is " +
                   str(throughput_dict[host]) +
                   " MB/sec. Which is less than the KPI of " +
                   str(min_nsd_throughput) +
@@ -1389,7 +3791,9 @@ def nsd_KPI(min_nsd_throughput,
                   NOCOLOR +
                   "on host " +
                   host +
-                  " the throughput test result is " +
+                  " the " +
+                  test_type +
+                  " throughput test result is " +
                   str(throughput_dict[host]) +
                   " MB/sec. Which is higher than the KPI of " +
                   str(min_nsd_throughput) +
@@ -1508,6 +3912,92 @@ def nsd_KPI(min_nsd_throughput,
     return errors
 
 
+def server_fairness_KPI(server_dict, test_type):
+    # Per server throughput table and Jain's fairness index of every run.
+    # Servers under FAIR_SHARE_MIN percent of their fair share are warnings,
+    # they do not fail the run
+    warnings = 0
+    print("Results for " + test_type + " throughput per server")
+    if not server_dict:
+        print(YELLOW + "WARNING: " + NOCOLOR + "there is no per server " +
+              "throughput on the results, it needs nsdperf 1.33 or newer")
+        return warnings
+    rows = []
+    for run, servers in server_dict.items():
+        fair_share = sum(servers.values()) / len(servers)
+        for server in sorted(servers.keys()):
+            share = None
+            if fair_share > 0:
+                share = round(servers[server] * 100 / fair_share, 1)
+            rows.append([run, server, servers[server], share])
+    print_text_table(["Run from", "Server", "MB/sec", "% of fair share"],
+                     rows)
+    for run, servers in server_dict.items():
+        fair_share = sum(servers.values()) / len(servers)
+        for server in sorted(servers.keys()):
+            if servers[server] < fair_share * FAIR_SHARE_MIN / 100:
+                warnings = warnings + 1
+                print(YELLOW + "WARNING: " + NOCOLOR + "on the run from " +
+                      run + " the server " + server + " delivered " +
+                      str(servers[server]) + " MB/sec. Which is less than " +
+                      str(FAIR_SHARE_MIN) + "% of its fair share of " +
+                      str(round(fair_share, 2)) + " MB/sec")
+        print(GREEN + "INFO: " + NOCOLOR + "the Jain's fairness index of " +
+              "the servers on the run from " + run + " is " +
+              str(round(jain_fairness(list(servers.values())) or 0, 3)))
+    return warnings
+
+
+def pattern_KPI(min_nsd_throughput, pattern_dict):
+    errors = 0
+    print("Results for traffic pattern throughput test")
+    for pattern in pattern_dict.keys():
+        if pattern in ["incast", "fanout"]:
+            kpi_str = " aggregated throughput "
+        else:
+            kpi_str = " per node throughput "
+        kpi_throughput_v = pattern_dict[pattern]['kpi_throughput']
+        if kpi_throughput_v < min_nsd_throughput:
+            errors = errors + 1
+            print(RED +
+                  "ERROR: " +
+                  NOCOLOR +
+                  "on " +
+                  pattern +
+                  " traffic pattern the" +
+                  kpi_str +
+                  "is " +
+                  str(kpi_throughput_v) +
+                  " MB/sec. Which is less than the KPI of " +
+                  str(min_nsd_throughput) +
+                  " MB/sec")
+        else:
+            print(GREEN +
+                  "OK: " +
+                  NOCOLOR +
+                  "on " +
+                  pattern +
+                  " traffic pattern the" +
+                  kpi_str +
+                  "is " +
+                  str(kpi_throughput_v) +
+                  " MB/sec. Which is higher than the KPI of " +
+                  str(min_nsd_throughput) +
+                  " MB/sec")
+        print(GREEN +
+              "INFO: " +
+              NOCOLOR +
+              "The " +
+              pattern +
+              " traffic pattern total throughput with " +
+              str(pattern_dict[pattern]['clients']) +
+              " clients is " +
+              str(pattern_dict[pattern]['throughput']) +
+              " MB/sec")
+    print("")
+    return errors
+
+
 def fping_KPI(
         fping_dictionary,
         fping_dictionary_max,
@@ -1716,15 +4206,15 @@ def fping_KPI(
 def test_ssh(hosts_dictionary):
     for host in hosts_dictionary.keys():
         try:
-            ssh_return_code = subprocess.call(['ssh',
-                                               '-o StrictHostKeyChecking=no',
-                                               '-o BatchMode=yes',
-                                               '-o ConnectTimeout=5',
-                                               '-o LogLevel=error',
-                                               host,
-                                               'uname'],
-                                              stdout=DEVNULL,
-                                              stderr=DEVNULL)
+            ssh_return_code = traced_call(host, ['ssh',
+                                                 '-o StrictHostKeyChecking=no',
+                                                 '-o BatchMode=yes',
+                                                 '-o ConnectTimeout=5',
+                                                 '-o LogLevel=error',
+                                                 host,
+                                                 'uname'],
+                                          stdout=DEVNULL,
+                                          stderr=DEVNULL)
             if ssh_return_code == 0:
                 print(GREEN + "OK: " + NOCOLOR +
                       "SSH with node " + host + " works")
@@ -1747,15 +4237,15 @@ def test_ssh(hosts_dictionary):
 
         # Now lets see if the host keys are OK
         try:
-            ssh_return_code = subprocess.call(['ssh',
-                                               '-o StrictHostKeyChecking=yes',
-                                               '-o BatchMode=yes',
-                                               '-o ConnectTimeout=5',
-                                               '-o LogLevel=error',
-                                               host,
-                                               'uname'],
-                                              stdout=DEVNULL,
-                                              stderr=DEVNULL)
+            ssh_return_code = traced_call(host, ['ssh',
+                                                 '-o StrictHostKeyChecking=yes',
+                                                 '-o BatchMode=yes',
+                                                 '-o ConnectTimeout=5',
+                                                 '-o LogLevel=error',
+                                                 host,
+                                                 'uname'],
+                                          stdout=DEVNULL,
+                                          stderr=DEVNULL)
             if ssh_return_code == 0:
                 print(GREEN + "OK: " + NOCOLOR +
                       "SSH with node " + host + " works with strict host key checks")
@@ -1780,14 +4270,23 @@ def test_ssh(hosts_dictionary):
     print("")
 
 
-def print_end_summary(a_avg_fp_err, a_nsd_err, lat_kpi_ok,
-                      fping_kpi_ok, perf_kpi_ok, perf_rt_ok):
+def print_end_summary(a_avg_fp_err, a_nsd_err, a_pattern_err, a_loaded_err,
+                      a_fairness_warn, lat_kpi_ok, fping_kpi_ok, perf_kpi_ok,
+                      perf_rt_ok):
     # End summary and say goodbye
     passed = True
     print("")
     print("The summary of this run:")
     print("")
 
+    # Hosts that did not complete remote operations on their deadline
+    for host in sorted(HOST_TIMEOUTS.keys()):
+        print(RED + "\tOn host " + host + " " +
+              str(len(HOST_TIMEOUTS[host])) + " remote operation[s] " +
+              "timed out: " + ", ".join(unique_items_list(
+                  HOST_TIMEOUTS[host])) + NOCOLOR)
+        passed = False
+
     if a_avg_fp_err > 0:
         print(RED + "\tThe 1:n ICMP latency test failed " +
               str(a_avg_fp_err) + " time[s]" + NOCOLOR)
@@ -1807,6 +4306,22 @@ def print_end_summary(a_avg_fp_err, a_nsd_err, lat_kpi_ok,
             GREEN +
             "\tThe 1:n throughput test was successful in all nodes" +
             NOCOLOR)
+
+    if a_pattern_err > 0:
+        print(RED + "\tThe traffic pattern throughput test failed " +
+              str(a_pattern_err) + " time[s]" + NOCOLOR)
+        passed = False
+
+    if a_loaded_err > 0:
+        print(RED + "\tThe loaded ICMP latency test failed " +
+              str(a_loaded_err) + " time[s]" + NOCOLOR)
+        passed = False
+
+    # Unfair servers are shown but do not fail the run
+    if a_fairness_warn > 0:
+        print(YELLOW + "\t" + str(a_fairness_warn) + " time[s] a server " +
+              "delivered less than " + str(FAIR_SHARE_MIN) + "% of its " +
+              "fair share of the throughput" + NOCOLOR)
     print("")
 
     if passed:
@@ -1844,22 +4359,199 @@ def print_end_summary(a_avg_fp_err, a_nsd_err, lat_kpi_ok,
             NOCOLOR)
         valid_test = 5
     print("")
-    return (a_avg_fp_err + a_nsd_err + valid_test)
+    return (a_avg_fp_err + a_nsd_err + a_pattern_err + a_loaded_err +
+            valid_test)
+
+
+def analyze_results(logdir, hosts_dictionary, tests_list, patterns_list,
+                    many2many_clients, many2many_servers, size_test_run,
+                    multirail_run, rdma_modes_run, max_avg_latency,
+                    min_nsd_throughput, max_latency_inflation, rdma_test):
+    # Loads the results of the run on logdir and checks them against the
+    # KPIs. Returns the errors of the 1:n latency, throughput, pattern and
+    # loaded latency tests, the server fairness warnings and the 1:n ICMP
+    # dictionaries. The caller loads the analysis cache of logdir
+    max_max_latency = max_avg_latency * 2
+    max_stddev_latency = max_avg_latency / 3
+    all_fping_dictionary, all_fping_dictionary_max, all_fping_dictionary_min, \
+        all_fping_dictionary_stddev = load_multiple_fping(logdir,
+                                                          hosts_dictionary)
+    pattern_dict = load_pattern_tests(logdir, patterns_list)
+    loaded_dict = {}
+    if max_latency_inflation is not None:
+        loaded_dict = load_loaded_latency(logdir, many2many_clients,
+                                          many2many_servers)
+    size_results = []
+    if size_test_run:
+        size_results = load_size_test(logdir)
+    multirail_results = {}
+    if multirail_run:
+        multirail_results = load_multirail_test(logdir)
+    rdma_modes_results = {}
+    if rdma_modes_run:
+        rdma_modes_results = load_rdma_modes_test(logdir)
+
+    # Compare againsts KPIs
+    print("")
+    all_avg_fping_errors = fping_KPI(
+        all_fping_dictionary,
+        all_fping_dictionary_max,
+        all_fping_dictionary_min,
+        all_fping_dictionary_stddev,
+        "1:n",
+        max_avg_latency,
+        max_max_latency,
+        max_stddev_latency,
+        rdma_test)
+    # One throughput table, KPI and CSV per test type
+    all_nsd_errors = 0
+    all_fairness_warnings = 0
+    throughput_dicts = {}
+    for test_type in tests_list:
+        throughput_dict, nsd_lat_dict, nsd_std_dict, pc_diff_bw, max_bw, \
+            min_bw, mean_bw, stddev_bw, nsd_rxe_dict, nsd_rxe_m2m_d, \
+            nsd_txe_dict, nsd_txe_m2m_d, nsd_rtr_dict, \
+            nsd_rtr_m2m_d = load_throughput_tests(logdir,
+                                                  hosts_dictionary,
+                                                  many2many_clients,
+                                                  test_type)
+        if throughput_dicts:
+            print("")
+        throughput_dicts[test_type] = throughput_dict
+        all_nsd_errors = all_nsd_errors + nsd_KPI(
+            min_nsd_throughput, throughput_dict, nsd_lat_dict, nsd_std_dict,
+            pc_diff_bw, max_bw, min_bw, mean_bw, stddev_bw, nsd_rxe_dict,
+            nsd_rxe_m2m_d, nsd_txe_dict, nsd_txe_m2m_d, nsd_rtr_dict,
+            nsd_rtr_m2m_d, test_type)
+        print("")
+        all_fairness_warnings = all_fairness_warnings + server_fairness_KPI(
+            load_server_throughput(logdir, hosts_dictionary, test_type),
+            test_type)
+    all_pattern_errors = 0
+    if patterns_list:
+        print("")
+        all_pattern_errors = pattern_KPI(min_nsd_throughput, pattern_dict)
+        # A pattern that could not be loaded counts as failed
+        all_pattern_errors = all_pattern_errors + \
+            len(patterns_list) - len(pattern_dict)
+
+    all_loaded_errors = 0
+    if max_latency_inflation is not None:
+        print("")
+        all_loaded_errors = loaded_latency_KPI(max_latency_inflation,
+                                               loaded_dict)
+        # A client that could not be loaded counts as failed
+        all_loaded_errors = all_loaded_errors + \
+            len(many2many_clients) - len(loaded_dict)
+    if size_results:
+        print("")
+        size_report(logdir, size_results, tests_list)
+    if multirail_results:
+        print("")
+        multirail_report(logdir, multirail_results, tests_list)
+    if rdma_modes_results:
+        print("")
+        rdma_modes_report(logdir, rdma_modes_results, tests_list)
+    socket_buffers_report(logdir, hosts_dictionary, patterns_list)
+    for test_type in tests_list:
+        save_throughput_to_csv(
+            logdir,
+            throughput_dicts[test_type],
+            test_type
+        )
+    save_analysis_cache(logdir)
+    return (all_avg_fping_errors, all_nsd_errors, all_pattern_errors,
+            all_loaded_errors, all_fairness_warnings,
+            (all_fping_dictionary, all_fping_dictionary_max,
+             all_fping_dictionary_min, all_fping_dictionary_stddev))
+
+
+def analyze_logdir(logdir, max_avg_latency, min_nsd_throughput,
+                   max_latency_inflation, rdma_test):
+    # Analysis only entry point, everything about the run is taken from the
+    # files on logdir. Nothing runs on the hosts
+    start_time = time.time()
+    load_analysis_cache(logdir)
+    hosts_dictionary, patterns_list = run_hosts_patterns(logdir)
+    mess_results = load_nsd_results(os.path.join(logdir, "nsd_mess.json"))
+    if not mess_results:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "cannot load the many to many " +
+                 "throughput results on " + logdir + "\n")
+    tests_list = list(mess_results.keys())
+    mess_result = mess_results[tests_list[0]]
+    many2many_clients = dict.fromkeys(mess_result['client(s)'], None)
+    many2many_servers = dict.fromkeys(mess_result['server(s)'], None)
+    perf_runtime = int(mess_result['testTime'])
+    with open(os.path.join(logdir, "lat_" + sorted(hosts_dictionary)[0] +
+                           "_all"), 'r') as logfping:
+        fping_count = len(logfping.readline().split(':')[1].split())
+    if max_latency_inflation is None and any(
+            file_name.startswith("loaded_lat_")
+            for file_name in os.listdir(logdir)):
+        max_latency_inflation = MAX_AVG_LATENCY
+    if not rdma_test:
+        # The last nsdperf session commands tell if it was a RDMA run
+        try:
+            with open(os.path.join(logdir, "nsdperfCmd"), 'r') as cmd_file:
+                rdma_test = RDMA_CMD_PATT.search(cmd_file.read()) is not None
+        except IOError:
+            pass
+    print("Analyzing the results on " + logdir)
+    print("")
+    all_avg_fping_errors, all_nsd_errors, all_pattern_errors, \
+        all_loaded_errors, all_fairness_warnings, \
+        fping_stats = analyze_results(
+            logdir, hosts_dictionary, tests_list, patterns_list,
+            many2many_clients, many2many_servers,
+            os.path.isfile(os.path.join(logdir, "nsd_sizes.json")),
+            os.path.isfile(os.path.join(logdir, "nsd_multirail.json")),
+            os.path.isfile(os.path.join(logdir, "nsd_rdma_modes.json")),
+            max_avg_latency, min_nsd_throughput, max_latency_inflation,
+            rdma_test)
+    lat_kpi_ok, fping_kpi_ok, perf_kpi_ok, perf_rt_ok = check_kpi_is_ok(
+        max_avg_latency, fping_count, min_nsd_throughput, perf_runtime)
+    print(GREEN + "INFO: " + NOCOLOR + "analysis took " +
+          str(round(time.time() - start_time, 2)) + " seconds")
+    return_code = print_end_summary(
+        all_avg_fping_errors,
+        all_nsd_errors,
+        all_pattern_errors,
+        all_loaded_errors,
+        all_fairness_warnings,
+        lat_kpi_ok,
+        fping_kpi_ok,
+        perf_kpi_ok,
+        perf_rt_ok)
+    print("")
+    return return_code
 
 
 def main():
+    # Results of previous runs do not need any of the run checks
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        return history(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        return compare(sys.argv[2:])
+
+    # Parsing input
+    run_span = span_start("koet run")
+    max_avg_latency, fping_count, perf_runtime, min_nsd_throughput, \
+         cli_hosts, hosts_dictionary, rdma_test, rdma_ports_list, \
+         no_rpm_check, save_hosts, tests_list, \
+         patterns_list, buffsizes_list, \
+         max_latency_inflation, metrics_dir, analyze_dir, \
+         no_preflight_cache, preflight_ttl, port_matrix, \
+         multirail, rdma_modes_list, socksize = parse_arguments()
+    if analyze_dir:
+        return analyze_logdir(analyze_dir, max_avg_latency,
+                              min_nsd_throughput, max_latency_inflation,
+                              rdma_test)
+
     #Check files permissions
     fatal_error = check_permission_files()
     if fatal_error:
         sys.exit(RED + "QUIT: " + NOCOLOR + "there are files with "+
                  "unexpected permissions or non existing\n")
-
-    # Parsing input
-    max_avg_latency, fping_count, perf_runtime, min_nsd_throughput, \
-         cli_hosts, hosts_dictionary, rdma_test, rdma_ports_list, \
-         no_rpm_check, save_hosts = parse_arguments()
-    max_max_latency = max_avg_latency * 2
-    max_stddev_latency = max_avg_latency / 3
     rdma_ports_csv_mlx = []
 
     # JSON loads
@@ -1893,7 +4585,10 @@ def main():
                                     packages_dictionary,
                                     packages_rdma_dictionary)
     estimated_runtime_str = str(
-        estimate_runtime(hosts_dictionary, fping_count, perf_runtime))
+        estimate_runtime(hosts_dictionary, fping_count, perf_runtime,
+                         tests_list, patterns_list, buffsizes_list,
+                         len(rdma_ports_list) if multirail else 0,
+                         rdma_modes_list))
     show_header(KOET_VERSION, json_version, estimated_runtime_str,
                 max_avg_latency, fping_count, min_nsd_throughput, perf_runtime)
 
@@ -1905,11 +4600,26 @@ def main():
     # Check local node is included on the test
     check_localnode_is_in(hosts_dictionary)
 
+    # The log dir is there before the checks on the hosts, the spans and
+    # trace of the run are saved on it however the run ends
+    log_dir_timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    logdir = create_local_log_dir(log_dir_timestamp)
+    atexit.register(save_trace, logdir, run_span)
+
     # Check SSH
+    span = span_start("ssh check")
     test_ssh(hosts_dictionary)
+    span_end(span)
+
+    # Checks that passed before on an unchanged host are not run again
+    span = span_start("pre-flight cache")
+    load_preflight_cache(hosts_dictionary, not no_preflight_cache,
+                         preflight_ttl)
+    span_end(span)
 
     # Check packages are installed
     print("Pre-flight generic checks:")
+    span = span_start("pre-flight checks")
     if no_rpm_check:
         print(YELLOW + "WARNING: " + NOCOLOR +
               "you have disabled RPM checks, things might break")
@@ -1919,18 +4629,24 @@ def main():
     #Check firewalld is down
     firewalld_check(hosts_dictionary)
     # Check TCP port 6668 is not in use. Limited from view of this host
-    check_tcp_port_free(hosts_dictionary, 6668)
+    # unless the matrix from every host is asked for
+    check_tcp_port_free(hosts_dictionary, NSDPERF_PORT)
+    if port_matrix:
+        tcp_port_matrix(hosts_dictionary, NSDPERF_PORT, TCP_PROBE_DEADLINE)
+    span_end(span)
     print("")
 
     # If RDMA lets get the ports on a dictionary
     if rdma_test:
         # Lets check that we have the RDMA needed SW
         print("Pre-flight RDMA checks:")
+        span = span_start("pre-flight RDMA checks")
         if no_rpm_check:
             print(YELLOW + "WARNING: " + NOCOLOR +
                   "you have disabled RPM checks, things might break")
         else:
-            host_packages_check(hosts_dictionary, packages_rdma_dictionary)
+            host_packages_check(hosts_dictionary, packages_rdma_dictionary,
+                                "RDMA packages")
         rdma_port_error, rdma_ports_csv_mlx = check_rdma_ports(
                                                             hosts_dictionary,
                                                             rdma_ports_list)
@@ -1940,63 +4656,126 @@ def main():
         else:
             sys.exit(RED + "QUIT: " + NOCOLOR +
                      "not all RDMA ports are up on all nodes\n")
+        span_end(span)
         print("")
+    save_preflight_cache()
 
     # Run
-    log_dir_timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    logdir = create_local_log_dir(log_dir_timestamp)
+    span = span_start("log dir")
     create_log_dir(hosts_dictionary, log_dir_timestamp)
+    span_end(span)
+    span = span_start("latency test")
     latency_test(hosts_dictionary, logdir, fping_count)
-    many2many_clients = throughput_test(hosts_dictionary,
+    span_end(span)
+    if socksize == "auto":
+        span = span_start("auto socksize")
+        auto_socksize(logdir, hosts_dictionary)
+        span_end(span)
+    else:
+        NSDPERF_SETTINGS['socksize'] = socksize
+    # One nsdperf session for all the throughput tests, the nodes are
+    # discovered and nsdperf is built once
+    import nsdperfTool
+    nsd_logfile = open(logdir + "/nsdperfTool_log", "a")
+    session = nsdperfTool.NsdperfSession(directory=logdir,
+                                         logFile=nsd_logfile)
+    span = span_start("throughput test")
+    many2many_clients, many2many_servers = throughput_test(session,
+                                        hosts_dictionary,
                                         logdir,
                                         perf_runtime,
                                         rdma_test,
-                                        rdma_ports_csv_mlx)
+                                        rdma_ports_csv_mlx,
+                                        tests_list,
+                                        max_latency_inflation is not None)
+    span_end(span)
+    if patterns_list:
+        span = span_start("pattern test")
+        pattern_test(session,
+                     hosts_dictionary,
+                     logdir,
+                     perf_runtime,
+                     rdma_test,
+                     rdma_ports_csv_mlx,
+                     patterns_list)
+        span_end(span)
+    if buffsizes_list:
+        span = span_start("size test")
+        size_test(session,
+                  hosts_dictionary,
+                  logdir,
+                  perf_runtime,
+                  rdma_test,
+                  rdma_ports_csv_mlx,
+                  tests_list,
+                  buffsizes_list)
+        span_end(span)
+    if multirail:
+        span = span_start("multi-rail test")
+        multirail_test(session,
+                       hosts_dictionary,
+                       logdir,
+                       perf_runtime,
+                       rdma_ports_csv_mlx,
+                       tests_list)
+        span_end(span)
+    if rdma_modes_list:
+        span = span_start("RDMA mode test")
+        rdma_modes_test(session,
+                        hosts_dictionary,
+                        logdir,
+                        perf_runtime,
+                        rdma_ports_csv_mlx,
+                        tests_list,
+                        rdma_modes_list)
+        span_end(span)
+    nsd_logfile.close()
+    for node in session.timeouts.keys():
+        HOST_TIMEOUTS.setdefault(node, []).extend(
+            ["nsdperf " + op for op in session.timeouts[node]])
 
     # Load results
-    all_fping_dictionary, all_fping_dictionary_max, all_fping_dictionary_min, \
-        all_fping_dictionary_stddev = load_multiple_fping(logdir,
-                                                          hosts_dictionary)
-    throughput_dict, nsd_lat_dict, nsd_std_dict, pc_diff_bw, max_bw, min_bw, \
-        mean_bw, stddev_bw, nsd_rxe_dict, nsd_rxe_m2m_d, nsd_txe_dict, \
-        nsd_txe_m2m_d, nsd_rtr_dict, nsd_rtr_m2m_d = load_throughput_tests(
-                                                        logdir,
-                                                        hosts_dictionary,
-                                                        many2many_clients)
-
-    # Compare againsts KPIs
-    print("")
-    all_avg_fping_errors = fping_KPI(
-        all_fping_dictionary,
-        all_fping_dictionary_max,
-        all_fping_dictionary_min,
-        all_fping_dictionary_stddev,
-        "1:n",
-        max_avg_latency,
-        max_max_latency,
-        max_stddev_latency,
-        rdma_test)
-    all_nsd_errors = nsd_KPI(min_nsd_throughput, throughput_dict, nsd_lat_dict,
-                             nsd_std_dict, pc_diff_bw, max_bw, min_bw,
-                             mean_bw, stddev_bw, nsd_rxe_dict, nsd_rxe_m2m_d,
-                             nsd_txe_dict, nsd_txe_m2m_d, nsd_rtr_dict,
-                             nsd_rtr_m2m_d)
+    span = span_start("analysis")
+    load_analysis_cache(logdir)
+    all_avg_fping_errors, all_nsd_errors, all_pattern_errors, \
+        all_loaded_errors, all_fairness_warnings, \
+        fping_stats = analyze_results(
+            logdir, hosts_dictionary, tests_list, patterns_list,
+            many2many_clients, many2many_servers, bool(buffsizes_list),
+            multirail, bool(rdma_modes_list), max_avg_latency,
+            min_nsd_throughput, max_latency_inflation, rdma_test)
 
     # Exit protocol
     lat_kpi_ok, fping_kpi_ok, perf_kpi_ok, perf_rt_ok = check_kpi_is_ok(
         max_avg_latency, fping_count, min_nsd_throughput, perf_runtime)
-    save_throughput_to_csv(
-        logdir,
-        throughput_dict
-    )
-    DEVNULL.close()
+    span_end(span)
+    span_end(run_span)
+    # The metrics take the phases from the saved spans
+    atexit.unregister(save_trace)
+    save_trace(logdir, run_span)
+    write_metrics(logdir, metrics_dir, hosts_dictionary, patterns_list)
     return_code = print_end_summary(
         all_avg_fping_errors,
         all_nsd_errors,
+        all_pattern_errors,
+        all_loaded_errors,
+        all_fairness_warnings,
         lat_kpi_ok,
         fping_kpi_ok,
         perf_kpi_ok,
         perf_rt_ok)
+    run_info = {'run_time': datetime.datetime.strptime(
+                    log_dir_timestamp,
+                    '%Y-%m-%d_%H-%M-%S').strftime('%Y-%m-%d %H:%M:%S'),
+                'tests': tests_list,
+                'rdma': rdma_test,
+                'fping_count': fping_count,
+                'perf_runtime': perf_runtime,
+                'min_throughput': min_nsd_throughput,
+                'max_avg_latency': max_avg_latency,
+                'return_code': return_code}
+    store_results(os.path.join(os.getcwd(), 'log', RESULTS_DB), logdir,
+                  run_info, fping_stats, hosts_dictionary, patterns_list)
     print("")
     return return_code
 
@@ -6,6 +6,7 @@ import getopt
 import json
 import math
 import re
+import select
 import threading
 import subprocess
 
@@ -18,282 +19,1601 @@ toolPath = os.path.split(os.path.realpath(__file__))[0]
 sshOption = "-o StrictHostKeyChecking=no -o LogLevel=error"
 ssh = "ssh %s" % (sshOption)
 scp = "scp %s" % (sshOption)
-LOG_LOCK = threading.Lock()
 timerWindow = 1200
 
+# Seconds each kind of command can run before it is cancelled: node probes
+# and settings, copies, nsdperf builds and nsdperf test sessions, that also
+# get the test time of every test they run
+opDeadlines = {"probe": 60, "copy": 300, "build": 600, "test": timerWindow}
+
+# nsdperf buffer size limits
+MIN_BUFFSIZE = 4 * 1024
+MAX_BUFFSIZE = 16 * 1024 * 1024
+
+# Test time of nsdperf in seconds when ttime is not given
+NSDPERF_TTIME = 10
+
+# Network delay percentiles reported by the sweep
+delayPercentiles = [50, 90, 99]
+
+# Sweep parameters, the nsdperf command that changes each one on a running
+# session (None if it is a process option) and the matching option here
+sweepCmds = {"buffsize": "buffsize", "socksize": "socksize",
+             "testerThr": "threads", "parallel": "parallel",
+             "receiverThr": None, "workerThr": None}
+sweepOpts = {"buffsize": "-b", "socksize": "-k", "testerThr": "-T",
+             "parallel": "--parallel", "receiverThr": "-R",
+             "workerThr": "-W"}
+
+# Test settings of a session and their default values
+defaultConf = {'server': '', 'client': '', 'test': '', 'ttime': '',
+               'buffsize': '', 'socksize': '', 'receiverThr': '',
+               'workerThr': '', 'testerThr': '', 'rebuild': '',
+               'rdmaPorts': '', 'debugLevel': '', 'pattern': '', 'nodes': '',
+               'parallel': '', 'sweep': [], 'search': '', 'sizes': '',
+               'sharedQueue': '', 'interval': '', 'numa': '',
+               'hugepages': '', 'zerocopy': '', 'multirail': '',
+               'rdmaMode': '', 'sinline': '', 'usecm': '', 'pathMtu': '',
+               'serviceLevel': '', 'rdmaMatrix': []}
+
+# Interval report line of nsdperf 1.32 and later
+INTERVALPATT = re.compile(
+    r'interval ([\d\.]+)-([\d\.]+) sec (\S+) -> (\S+) ([\d\.e\+]+) MB/sec '
+    r'\(([\d\.e\+]+) msg/sec\) (\d+) bytes (\d+) msgs')
+
+# Server throughput line of nsdperf 1.33 and later
+SERVERPATT = re.compile(
+    r'(\S+) server throughput ([\d\.e\+]+) MB/sec \(([\d\.e\+]+) msg/sec\) '
+    r'(\d+) bytes (\d+) msgs')
+
+# Buffer pool line of nsdperf 1.35 and later, printed per node before the
+# first result of each test command
+POOLPATT = re.compile(
+    r'(\S+) buffer pool ([\d\.e\+]+) MB on (\S+) pages'
+    r'( \(no \S+ huge pages free\))?'
+    r'(?:, registered in ([\d\.e\+]+) msec)?')
+
+# Rail line of nsdperf 1.37 and later, printed per client before the first
+# result of each test command while a rail is selected
+RAILPATT = re.compile(r'(\S+) rail (\d+) port (\S+)')
+
+# Socket buffer line of nsdperf 1.38 and later, printed per node before the
+# first result of each test command while socksize is set
+SOCKPATT = re.compile(
+    r'(\S+) socket buffers rcv (\d+) snd (\d+) bytes on (\d+) connection\(s\)'
+    r'(?:, rcv limited by net.core.rmem_max (\d+))?'
+    r'(?:, snd limited by net.core.wmem_max (\d+))?')
+
+# Huge page sizes for the buffer pools, compare runs the tests with normal
+# pages and every size
+hugePageSizes = ["2M", "1G"]
+
+# Zerocopy modes of nsdperf 1.36 for the test data, compare runs the tests
+# with every mode and without
+zeroCopyModes = ["send", "recv", "on"]
+
+# RDMA modes of nsdperf for the test data: on sends the data messages and
+# replies with RDMA, all sends every message with RDMA and inline also puts
+# small data inline. Path MTUs -m accepts and highest -L service level
+rdmaModes = ["on", "all", "inline"]
+pathMtus = ["256", "512", "1024", "2048", "4096", "8192"]
+MAX_SERVICE_LEVEL = 15
+
+# Run modes that each drive their own sequence of nsdperf runs, only one of
+# them can be used at a time. Option, conf key and the value that selects
+# it, or None for any value
+exclusiveModes = [("--sweep/--sizes", "sweep", None),
+                  ("--numa compare", "numa", "compare"),
+                  ("--hugepages compare", "hugepages", "compare"),
+                  ("--zerocopy compare", "zerocopy", "compare"),
+                  ("--multirail", "multirail", None),
+                  ("--rdmaMatrix", "rdmaMatrix", None)]
+
+# RDMA modes the matrix runs if none are given, the ones that work with any
+# buffer size. sinline needs buffers that fit in the inline data
+defaultRdmaMatrix = ["on", "all", "inline", "on+usecm", "all+usecm",
+                     "inline+usecm"]
+
+# NUMA placement modes: bind nsdperf to the NUMA node of the test NIC, to
+# another node, or run the tests with both to compare them
+numaModes = ["local", "remote", "compare"]
+
 # Regular expressions for IP
 IPPATT = re.compile(r'inet\s+(?P<ip>\d+[\.]\d+[\.]\d+[\.]\d+)')
 
-# Subroutines
 
+class NsdperfError(Exception):
+    # A step of the session failed, the message says which. It has been
+    # logged already
+    pass
 
-def processArgs():
-    if (not conf["server"] or not conf["client"]):
-        halt("Error: you have to provide both --client and --server")
-    dupNodes = [i for i in conf["server"] if i in conf["client"]]
-    if (dupNodes):
-        halt("Error: %s cannot be server and client at the same time, there "
-             "shouldn't be duplicated nodes in servers and clients" % dupNodes)
-    allowedTests = ["write", "read", "nwrite", "swrite", "sread", "rw"]
-    for test in conf["test"]:
-        if (test not in allowedTests):
-            halt("Error: unknown test <%s>, please choose from <%s>"
-                 % (test, allowedTests))
-    if (not conf["test"]):
-        conf["test"] = ["read", "nwrite"]
-
-
-def createExecutable(node):
-    rc = runcmd("%s %s \"test -d %s\"" % (ssh, node, nsdperfPath))[0]
-    if (rc):
-        chkcmd("%s %s \"mkdir -p %s\"" % (ssh, node, nsdperfPath))
-    else:
-        rc = runcmd("%s %s \"test -x %s_%s\"" %
-                    (ssh, node, nsdperfexe, node))[0]
-    cmd = ""
-    if (rc or conf["rebuild"]):
-        if (conf["rebuild"]):
-            log("Force rebuild nsdperfexe on node %s as -r is specified" %
-                (node))
-        chkcmd("%s %s/nsdperf.C %s/makefile %s:%s/"
-               % (scp, toolPath, toolPath, node, nsdperfPath))
-        uname = chkcmd("%s %s \"uname -a\"" % (ssh, node))
-        if (re.search("linux", uname, re.I)):
-            verbsh = runcmd(
-                "%s %s \"test -e /usr/include/infiniband/verbs.h\"" %
-                (ssh, node))[0]
-            rdmacmh = runcmd("%s %s \"test -e /usr/include/rdma/rdma_cma.h\"" %
-                             (ssh, node))[0]
-            if (verbsh or rdmacmh):
-                log("INFO: verbs.h or rdma_cma.h could not be found. "
-                    "nsdperf could not support RDMA on node %s." % (node))
-                log("Excluding RDMA in compilation.")
-                cmd = "cd %s; g++ -O2 -o nsdperfexe_%s -lpthread -lrt " \
-                    "nsdperf.C" % (nsdperfPath, node)
+
+class NsdperfSession(object):
+    # Builds and runs nsdperf on a set of nodes from this process:
+    #
+    #   session = NsdperfSession(directory="/tmp/nsdperf")
+    #   session.configure(server=["10.0.0.1"], client=["10.0.0.2"],
+    #                     test=["read"], ttime="30")
+    #   results = session.run()
+    #
+    # run() returns the parsed results, one dictionary per test, and also
+    # appends them to nsdperfResult.json on directory. A session can be
+    # configured and run again, the local node, the network devices and the
+    # executables of the nodes already seen are reused. Errors raise
+    # NsdperfError. Commands running longer than their opDeadlines are
+    # killed and counted per node on timeouts. Log lines go to logFile,
+    # stdout by default
+
+    def __init__(self, directory=nsdperfPath, logFile=None):
+        self.nsdperfPath = directory
+        self.nsdperfCmdFile = "%s/nsdperfCmd" % (directory)
+        self.nsdperfResultFile = "%s/nsdperfResult.json" % (directory)
+        self.nsdperfSweepFile = "%s/nsdperfSweep.json" % (directory)
+        self.nsdperfMultiRailFile = "%s/nsdperfMultiRail.json" % (directory)
+        self.nsdperfRdmaMatrixFile = "%s/nsdperfRdmaMatrix.json" % (directory)
+        self.nsdperfexe = "%s/nsdperfexe" % (directory)
+        self.logFile = logFile
+        self.logLock = threading.Lock()
+        self.spanLock = threading.Lock()
+        self.spans = []
+        self.conf = dict(defaultConf)
+        self.allNodes = []
+        self.localNode = None
+        self.netDev = {}
+        self.builtNodes = []
+        self.sweepSummary = None
+        self.multiRailSummary = None
+        self.rdmaMatrixSummary = None
+        self.timeouts = {}
+        self.numaInfo = {}
+        self.numaMode = None
+        self.hugePages = None
+        self.zeroCopy = None
+
+    def configure(self, **options):
+        # Replaces the test settings, see defaultConf for the accepted ones
+        for key in options.keys():
+            if (key not in defaultConf):
+                self.halt("Error: unknown setting <%s>, please choose from "
+                          "<%s>" % (key, sorted(defaultConf.keys())))
+        self.conf = dict(defaultConf)
+        self.conf["sweep"] = []
+        self.conf.update(options)
+        rdmaPorts = self.conf["rdmaPorts"]
+        if (rdmaPorts and not isinstance(rdmaPorts, dict)):
+            try:
+                self.conf["rdmaPorts"] = json.loads(str(rdmaPorts))
+            except Exception:
+                self.log("I get non-json format --rdmaPorts input: <%s>" %
+                         rdmaPorts)
+                self.log("Set it to be the RDMA ports for all nodes")
+                self.conf["rdmaPorts"] = str(rdmaPorts)
+        self.processArgs()
+        self.allNodes = uniqueNodes(self.conf["server"] + self.conf["client"])
+        # same RDMA ports for all nodes
+        if (self.conf["rdmaPorts"] and
+                not isinstance(self.conf["rdmaPorts"], dict)):
+            self.conf["rdmaPorts"] = dict(
+                (node, self.conf["rdmaPorts"]) for node in self.allNodes)
+        self.sweepSummary = None
+        self.multiRailSummary = None
+        self.rdmaMatrixSummary = None
+
+    def prepare(self):
+        # Local node, network devices and nsdperfexe of the nodes not seen
+        # on previous runs of this session
+        if (not self.allNodes):
+            self.halt("Error: the session has no nodes, configure it first")
+        if (self.localNode not in self.allNodes):
+            self.localNode = self.getLocalNode(self.allNodes)
+        newNodes = [node for node in self.allNodes
+                    if node not in self.netDev]
+        self.netDev.update(self.getNodeDev(newNodes))
+        if (self.conf["numa"]):
+            newNodes = [node for node in self.allNodes
+                        if node not in self.numaInfo]
+            self.numaInfo.update(self.getNumaInfo(newNodes))
+        if (self.conf["rebuild"]):
+            buildNodes = self.allNodes
+        else:
+            buildNodes = [node for node in self.allNodes
+                          if node not in self.builtNodes]
+        # create nsdperfexe executable on all nodes if needed
+        self.onNodes(self.createExecutable, buildNodes)
+        self.builtNodes = uniqueNodes(self.builtNodes + buildNodes)
+
+    def run(self):
+        # Runs the configured tests, or the sweep, and returns the results
+        try:
+            self.prepare()
+            # delete old result file before test
+            self.runcmd("rm -rf %s" % (self.nsdperfResultFile))
+            self.numaMode = self.conf["numa"] or None
+            self.hugePages = self.conf["hugepages"] or None
+            self.zeroCopy = self.conf["zerocopy"] or None
+            if (self.conf["sweep"]):
+                results = self.runSweep(self.conf["server"],
+                                        self.conf["client"])
+            elif (self.conf["numa"] == "compare"):
+                results = self.runNumaCompare(self.conf["server"],
+                                              self.conf["client"])
+            elif (self.conf["hugepages"] == "compare"):
+                results = self.runHugePageCompare(self.conf["server"],
+                                                  self.conf["client"])
+            elif (self.conf["zerocopy"] == "compare"):
+                results = self.runZeroCopyCompare(self.conf["server"],
+                                                  self.conf["client"])
+            elif (self.conf["multirail"]):
+                results = self.runMultiRail(self.conf["server"],
+                                            self.conf["client"])
+            elif (self.conf["rdmaMatrix"]):
+                results = self.runRdmaMatrix(self.conf["server"],
+                                             self.conf["client"])
             else:
-                cmd = "cd %s; g++ -O2 -DRDMA -o nsdperfexe_%s -lpthread " \
-                    "-lrt -libverbs -lrdmacm nsdperf.C" % (nsdperfPath, node)
-        # elif (re.search("AIX", uname, re.I)):
-        # TODO: support AIX?
+                results = self.runTest(self.conf["server"],
+                                       self.conf["client"])
+        finally:
+            self.writeSpans()
+        return results
+
+    def onNodes(self, target, nodes, *args):
+        # Runs target(node, *args) on one thread per node and raises the
+        # first error once all of them are done
+        errors = []
+
+        def nodeThr(node):
+            try:
+                target(node, *args)
+            except NsdperfError as e:
+                errors.append(e)
+
+        threads = []
+        for node in nodes:
+            thr = threading.Thread(target=nodeThr, args=(node,))
+            thr.start()
+            threads.append(thr)
+        for thr in threads:
+            thr.join()
+        if (errors):
+            raise errors[0]
+
+    def processArgs(self):
+        conf = self.conf
+        allowedPatterns = ["n:m", "all2all", "incast", "fanout", "ring"]
+        if (not conf["pattern"]):
+            conf["pattern"] = "n:m"
+        if (conf["pattern"] not in allowedPatterns):
+            self.halt("Error: unknown pattern <%s>, please choose from <%s>"
+                      % (conf["pattern"], allowedPatterns))
+        if (conf["pattern"] in ["all2all", "ring"]):
+            # Every node is both server and client
+            if (not conf["nodes"]):
+                conf["nodes"] = uniqueNodes(conf["server"] + conf["client"])
+            if (len(conf["nodes"]) < 2):
+                self.halt("Error: pattern %s needs at least 2 nodes in "
+                          "--nodes" % (conf["pattern"]))
+            conf["server"] = conf["nodes"]
+            conf["client"] = conf["nodes"]
         else:
-            halt("Error: cannot compile %s/nsdperf.C on node $node, "
-                 "OS is not supported." % (nsdperfPath))
-        log("INFO: building nsdperfexe on node %s" % (node))
-        chkcmd("%s %s \"%s\"" % (ssh, node, cmd))
-    else:
-        log("INFO: skip building nsdperfexe on node %s as %s_%s already "
-            "exists. Use -r if you want to force rebuild." %
-            (node, nsdperfexe, node))
-
-
-def runTest(server, client):
-    log("---------- Running nsdperf test with server %s client %s ----------"
-        % (server, client))
-    cliOptions = makeCmds(server, client)
-    allNodes = []
-    allNodes.extend(server)
-    allNodes.extend(client)
-    threads = []
-    for node in allNodes:
-        thr = threading.Thread(target=startServerThr, args=(node, cliOptions))
-        thr.start()
-        threads.append(thr)
-    for thr in threads:
-        thr.join()
-
-    log("Get retransmit and packet loss data before test")
-    netDataBefore = getNetData(client)
-    if (conf["rdmaPorts"]):
-        if (conf["rdmaPorts"][localNode]):
-            localOpts = cliOptions + "-r %s " % (conf["rdmaPorts"][localNode])
-    else:
+            if (conf["nodes"]):
+                # First node is the server, all others are clients
+                conf["server"] = conf["nodes"][:1]
+                conf["client"] = conf["nodes"][1:]
+            if (not conf["server"] or not conf["client"]):
+                self.halt("Error: you have to provide both --client and "
+                          "--server")
+            dupNodes = [i for i in conf["server"] if i in conf["client"]]
+            if (dupNodes):
+                self.halt("Error: %s cannot be server and client at the same "
+                          "time, there shouldn't be duplicated nodes in "
+                          "servers and clients, use --pattern all2all "
+                          "instead" % dupNodes)
+            if (conf["pattern"] in ["incast", "fanout"] and
+                    len(conf["server"]) != 1):
+                self.halt("Error: pattern %s needs exactly one server"
+                          % (conf["pattern"]))
+        allowedTests = ["write", "read", "nwrite", "swrite", "sread", "rw"]
+        for test in conf["test"]:
+            if (test not in allowedTests):
+                self.halt("Error: unknown test <%s>, please choose from <%s>"
+                          % (test, allowedTests))
+        if (conf["sizes"]):
+            # Message size sweep is a grid sweep over buffsize only
+            if (conf["sweep"] or conf["search"] not in ["", "grid"]):
+                self.halt("Error: --sizes cannot be used with --sweep or "
+                          "--search")
+            conf["sweep"] = [("buffsize", conf["sizes"])]
+        if (conf["numa"] and conf["numa"] not in numaModes):
+            self.halt("Error: unknown NUMA placement <%s>, please choose "
+                      "from <%s>" % (conf["numa"], numaModes))
+        if (conf["hugepages"] and
+                conf["hugepages"] not in hugePageSizes + ["compare"]):
+            self.halt("Error: unknown huge page size <%s>, please choose "
+                      "from <%s>" % (conf["hugepages"],
+                                     hugePageSizes + ["compare"]))
+        if (conf["zerocopy"] and
+                conf["zerocopy"] not in zeroCopyModes + ["compare"]):
+            self.halt("Error: unknown zerocopy mode <%s>, please choose "
+                      "from <%s>" % (conf["zerocopy"],
+                                     zeroCopyModes + ["compare"]))
+        if (conf["multirail"] and not conf["rdmaPorts"]):
+            self.halt("Error: --multirail needs the RDMA ports in "
+                      "--rdmaPorts")
+        rdmaSettings = [opt for opt, key in
+                        [("--rdmaMode", "rdmaMode"), ("--sinline", "sinline"),
+                         ("--usecm", "usecm"), ("--pathMtu", "pathMtu"),
+                         ("--serviceLevel", "serviceLevel"),
+                         ("--rdmaMatrix", "rdmaMatrix")]
+                        if conf[key] not in ["", []]]
+        if (rdmaSettings and not conf["rdmaPorts"]):
+            self.halt("Error: %s need the RDMA ports in --rdmaPorts"
+                      % (", ".join(rdmaSettings)))
+        if (conf["rdmaMode"] and conf["rdmaMode"] not in rdmaModes):
+            self.halt("Error: unknown RDMA mode <%s>, please choose from "
+                      "<%s>" % (conf["rdmaMode"], rdmaModes))
+        if (conf["pathMtu"] and str(conf["pathMtu"]) not in pathMtus):
+            self.halt("Error: path MTU <%s> is not one of <%s>"
+                      % (conf["pathMtu"], pathMtus))
+        if (conf["serviceLevel"] != "" and
+                (not str(conf["serviceLevel"]).isdigit() or
+                 int(conf["serviceLevel"]) > MAX_SERVICE_LEVEL)):
+            self.halt("Error: service level <%s> is not a number from 0 to "
+                      "%s" % (conf["serviceLevel"], MAX_SERVICE_LEVEL))
+        for spec in conf["rdmaMatrix"]:
+            if (parseRdmaMode(spec) is None):
+                self.halt("Error: unknown RDMA matrix mode <%s>, it is one of "
+                          "<%s> followed by +sinline, +usecm, +mtuN or +slN"
+                          % (spec, rdmaModes))
+        modes = [opt for opt, key, value in exclusiveModes
+                 if (conf[key] == value if value else conf[key])]
+        if (len(modes) > 1):
+            self.halt("Error: %s cannot be used together, choose one of them"
+                      % (" and ".join(modes)))
+        if (conf["ttime"] != "" and
+                (not str(conf["ttime"]).isdigit() or int(conf["ttime"]) < 1)):
+            self.halt("Error: test time <%s> is not a positive number of "
+                      "seconds" % (conf["ttime"]))
+        if (conf["interval"] != ""):
+            ttime = conf["ttime"] or NSDPERF_TTIME
+            if (not str(conf["interval"]).isdigit() or
+                    int(conf["interval"]) < 1 or
+                    int(conf["interval"]) > int(ttime)):
+                self.halt("Error: interval <%s> is not a number of seconds "
+                          "from 1 to the test time <%s>"
+                          % (conf["interval"], ttime))
+        allowedSearches = ["grid", "halving"]
+        if (not conf["search"]):
+            conf["search"] = "grid"
+        if (conf["search"] not in allowedSearches):
+            self.halt("Error: unknown search <%s>, please choose from <%s>"
+                      % (conf["search"], allowedSearches))
+        for param, values in conf["sweep"]:
+            if (param not in sweepCmds):
+                self.halt("Error: unknown sweep parameter <%s>, please "
+                          "choose from <%s>"
+                          % (param, sorted(sweepCmds.keys())))
+            for value in values:
+                if (not value.isdigit() or int(value) < 1):
+                    self.halt("Error: sweep value <%s> of <%s> is not a "
+                              "positive integer" % (value, param))
+                if (param == "buffsize" and
+                        not MIN_BUFFSIZE <= int(value) <= MAX_BUFFSIZE):
+                    self.halt("Error: sweep buffsize <%s> is out of range "
+                              "<%s-%s>" % (value, MIN_BUFFSIZE, MAX_BUFFSIZE))
+        if (not conf["test"]):
+            if (conf["pattern"] == "incast"):
+                # n:1, all clients write into the single server
+                conf["test"] = ["write"]
+            elif (conf["pattern"] == "fanout"):
+                # 1:n, the single server sends to all clients
+                conf["test"] = ["read"]
+            else:
+                conf["test"] = ["read", "nwrite"]
+
+    def createExecutable(self, node):
+        span = spanStart("build", node)
+        rc = self.runcmd("%s %s \"test -d %s\"" %
+                         (ssh, node, self.nsdperfPath))[0]
+        if (rc):
+            self.chkcmd("%s %s \"mkdir -p %s\"" %
+                        (ssh, node, self.nsdperfPath))
+        else:
+            rc = self.runcmd("%s %s \"test -x %s_%s\"" %
+                             (ssh, node, self.nsdperfexe, node))[0]
+        cmd = ""
+        if (rc or self.conf["rebuild"]):
+            if (self.conf["rebuild"]):
+                self.log("Force rebuild nsdperfexe on node %s as -r is "
+                         "specified" % (node))
+            self.chkcmd("%s %s/nsdperf.C %s/makefile %s:%s/"
+                        % (scp, toolPath, toolPath, node, self.nsdperfPath),
+                        "copy")
+            uname = self.chkcmd("%s %s \"uname -a\"" % (ssh, node))
+            if (re.search("linux", uname, re.I)):
+                verbsh = self.runcmd(
+                    "%s %s \"test -e /usr/include/infiniband/verbs.h\"" %
+                    (ssh, node))[0]
+                rdmacmh = self.runcmd(
+                    "%s %s \"test -e /usr/include/rdma/rdma_cma.h\"" %
+                    (ssh, node))[0]
+                if (verbsh or rdmacmh):
+                    self.log("INFO: verbs.h or rdma_cma.h could not be "
+                             "found. nsdperf could not support RDMA on node "
+                             "%s." % (node))
+                    self.log("Excluding RDMA in compilation.")
+                    cmd = "cd %s; g++ -O2 -o nsdperfexe_%s -lpthread -lrt " \
+                        "nsdperf.C" % (self.nsdperfPath, node)
+                else:
+                    cmd = "cd %s; g++ -O2 -DRDMA -o nsdperfexe_%s " \
+                        "-lpthread -lrt -libverbs -lrdmacm nsdperf.C" % \
+                        (self.nsdperfPath, node)
+            # elif (re.search("AIX", uname, re.I)):
+            # TODO: support AIX?
+            else:
+                self.halt("Error: cannot compile %s/nsdperf.C on node %s, "
+                          "OS is not supported." % (self.nsdperfPath, node))
+            self.log("INFO: building nsdperfexe on node %s" % (node))
+            self.chkcmd("%s %s \"%s\"" % (ssh, node, cmd), "build")
+        else:
+            self.log("INFO: skip building nsdperfexe on node %s as %s_%s "
+                     "already exists. Use -r if you want to force rebuild." %
+                     (node, self.nsdperfexe, node))
+        self.spanEnd(span)
+
+    def runTest(self, server, client):
+        self.log("---------- Running nsdperf test with server %s client %s "
+                 "----------" % (server, client))
+        cliOptions = self.makeCmds(server, client)
+        allNodes = uniqueNodes(server + client)
+        self.onNodes(self.startServerThr, allNodes, cliOptions)
+        admin = self.startAdmin(self.localOptions(cliOptions))
+        try:
+            results = self.adminTests(admin, server, client)
+        finally:
+            self.endAdmin(admin, allNodes)
+        # Detect nsdperf test errors
+        if (len(results) != len(self.conf["test"])):
+            self.halt("Error, nsdperf test seems failed, please check "
+                      "command output")
+        self.writeResults(results)
+        return results
+
+    def adminTests(self, admin, server, client, cmds="", ttime=None):
+        # Runs cmds and then the tests one by one on the resident admin
+        # session. Every result gets the network counters of its own test.
+        # ttime is the test time set on the session, if not the configured one
+        if (cmds):
+            self.adminRun(admin, cmds)
+        results = []
+        for test in self.conf["test"]:
+            self.log("Get retransmit and packet loss data before %s test" %
+                     (test))
+            netDataBefore = self.getNetData(client)
+            lineTimes = []
+            output = self.adminRun(admin, "test %s\n" % (test), lineTimes,
+                                   ttime)
+            self.log("Get retransmit and packet loss data after %s test" %
+                     (test))
+            netData = diffNetData(netDataBefore, self.getNetData(client))
+            results.extend(self.parseResults(server, client, output, netData,
+                                             lineTimes))
+        return results
+
+    def makeCmds(self, server, client):
+        conf = self.conf
+        cmdsInFile = ""
+        joinStr = " "
+        servers = joinStr.join(server)
+        clients = joinStr.join(client)
+        # File based options to nsdperf
+        cmdsInFile = "server %s\nclient %s\n" % (servers, clients)
+        if (conf["debugLevel"]):
+            cmdsInFile = cmdsInFile + "debug %s\n" % (conf["debugLevel"])
+        if (conf["ttime"]):
+            cmdsInFile = cmdsInFile + "ttime %s\n" % (conf["ttime"])
+        if (conf["testerThr"]):
+            cmdsInFile = cmdsInFile + "threads %s\n" % (conf["testerThr"])
+        if (conf["buffsize"]):
+            cmdsInFile = cmdsInFile + "buffsize %s\n" % (conf["buffsize"])
+        if (conf["socksize"]):
+            cmdsInFile = cmdsInFile + "socksize %s\n" % (conf["socksize"])
+        if (conf["parallel"]):
+            cmdsInFile = cmdsInFile + "parallel %s\n" % (conf["parallel"])
+        if (conf["rdmaPorts"]):
+            cmdsInFile = cmdsInFile + "rdma %s\n" % (conf["rdmaMode"] or "on")
+        if (conf["sinline"]):
+            cmdsInFile = cmdsInFile + "sinline on\n"
+        if (conf["usecm"]):
+            cmdsInFile = cmdsInFile + "usecm on\n"
+        if (conf["pattern"] == "ring"):
+            cmdsInFile = cmdsInFile + "ring on\n"
+        if (conf["interval"]):
+            cmdsInFile = cmdsInFile + "interval %s\n" % (conf["interval"])
+        if (self.hugePages):
+            cmdsInFile = cmdsInFile + "hugepages %s\n" % (self.hugePages)
+        if (self.zeroCopy):
+            cmdsInFile = cmdsInFile + "zerocopy %s\n" % (self.zeroCopy)
+        # The tests are fed to the admin session on stdin, see adminTests
+        cmdFile = open(self.nsdperfCmdFile, 'w')
+        cmdFile.write(cmdsInFile)
+        cmdFile.close()
+
+        return self.makeCliOptions(conf["receiverThr"], conf["workerThr"],
+                                   conf["pathMtu"], conf["serviceLevel"])
+
+    def makeCliOptions(self, receiverThr, workerThr, pathMtu, serviceLevel):
+        cliOptions = ""
+        if (self.conf["debugLevel"]):
+            cliOptions = cliOptions + "-d "
+        # Parameters based to nsdperf (except debugLevel)
+        if (receiverThr):
+            cliOptions = cliOptions + "-t %s " % (receiverThr)
+        if (workerThr):
+            cliOptions = cliOptions + "-w %s " % (workerThr)
+        if (self.conf["sharedQueue"]):
+            cliOptions = cliOptions + "-q "
+        if (pathMtu):
+            cliOptions = cliOptions + "-m %s " % (pathMtu)
+        if (serviceLevel != ""):
+            cliOptions = cliOptions + "-L %s " % (serviceLevel)
+
+        return cliOptions
+
+    def localOptions(self, cliOptions):
         localOpts = cliOptions
-    output = chkcmdLiveOutput(
-        "%s_%s -i %s %s" % (nsdperfexe, localNode, nsdperfCmdFile, localOpts))
-    log("Get retransmit and packet loss data after test")
-    netDataAfter = getNetData(client)
-    netData = {}
-    for node in netDataBefore.keys():
-        netData[node] = {}
-        for key in netDataBefore[node].keys():
-            netData[node][key] = int(netDataAfter[node][key]) - \
-                int(netDataBefore[node][key])
+        rdmaPorts = self.conf["rdmaPorts"]
+        if (rdmaPorts and rdmaPorts.get(self.localNode)):
+            localOpts = cliOptions + "-r %s " % (rdmaPorts[self.localNode])
+        return localOpts
 
-    parseOutput(server, client, output, netData)
-
-
-def makeCmds(server, client):
-    cmdsInFile = ""
-    cliOptions = ""
-    joinStr = " "
-    servers = joinStr.join(server)
-    clients = joinStr.join(client)
-    # File based options to nsdperf
-    cmdsInFile = "server %s\nclient %s\n" % (servers, clients)
-    if (conf["debugLevel"]):
-        cmdsInFile = cmdsInFile + "debug %s\n" % (conf["debugLevel"])
-        cliOptions = cliOptions + "-d "
-    if (conf["ttime"]):
-        cmdsInFile = cmdsInFile + "ttime %s\n" % (conf["ttime"])
-    if (conf["testerThr"]):
-        cmdsInFile = cmdsInFile + "threads %s\n" % (conf["testerThr"])
-    if (conf["buffsize"]):
-        cmdsInFile = cmdsInFile + "buffsize %s\n" % (conf["buffsize"])
-    if (conf["socksize"]):
-        cmdsInFile = cmdsInFile + "socksize %s\n" % (conf["socksize"])
-    if (conf["rdmaPorts"]):
-        cmdsInFile = cmdsInFile + "rdma on\n"
-    for test in conf["test"]:
-        cmdsInFile = cmdsInFile + "test %s\n" % (test)
-    cmdsInFile = cmdsInFile + "killall\nquit"
-    cmdFile = open(nsdperfCmdFile, 'w')
-    cmdFile.write(cmdsInFile)
-    cmdFile.close()
-    # Parameters based to nsdperf (except debugLevel)
-    if (conf["receiverThr"]):
-        cliOptions = cliOptions + "-t %s " % (conf["receiverThr"])
-    if (conf["workerThr"]):
-        cliOptions = cliOptions + "-w %s " % (conf["workerThr"])
-
-    return cliOptions
-
-
-def startServerThr(node, cliOptions):
-    killer(node, "nsdperfexe")
-    # Give some time to die
-    time.sleep(5)
-    if (conf["rdmaPorts"]):
-        nodeOpts = cliOptions + "-r %s " % (conf["rdmaPorts"][node])
-    else:
-        nodeOpts = cliOptions
-    chkcmd("%s %s \"%s_%s -s %s > %s/server_thread_log 2>&1 &\""
-           % (ssh, node, nsdperfexe, node, nodeOpts, nsdperfPath))
-    # Give some time to start
-    time.sleep(5)
-
-
-def parseOutput(server, client, output, netData):
-    resultFile = open(nsdperfResultFile, 'a')
-    pattern = r"(\d+)-(\d+) (\w+) ([\d\.]+) MB/sec \(([\d\.]+) msg/sec\), " \
-        r"cli (\d+\%) srv (\d+\%), time (\d+), buff (\d+)(.*)(\s*?(\S+ " \
-        r"network delay times[\S\s]*?msec  nevents\s*(\s*\d+ +\d+\s*)*\s+)+)"
-    resultSize = 0
-    for match in (re.finditer(pattern, output)):
-        result = {"server(s)": server, "client(s)": client}
-        result["nServer"] = match.group(1)
-        result["nClient"] = match.group(2)
-        result["test"] = match.group(3)
-        result["throughput(MB/sec)"] = match.group(4)
-        result["throughput(msg/sec)"] = match.group(5)
-        result["cli%"] = match.group(6)
-        result["srv%"] = match.group(7)
-        result["testTime"] = match.group(8)
-        result["buffsize"] = match.group(9)
-
-        sockThInfo = match.group(10)
-        sock = re.search(r"sock (\d+)", sockThInfo)
-        if (sock):
-            result["socksize"] = sock.group(1)
-        th = re.search(r"th (\d+)", sockThInfo)
-        if (th):
-            result["nTesterThread"] = th.group(1)
-
-        result["networkDelay"] = []
-        delay = {}
-        allDelayInfo = match.group(11)
-        oneDelayPattern = r"\S+ network delay times[\S\s]*?msec  nevents" \
-            r"\s*(\s*\d+ +\d+\s*)*"
-        for oneDelay in (re.finditer(oneDelayPattern, allDelayInfo)):
-            detailedDelayPattern = r"(\S+) network delay times \(average " \
-                r"([\d\.]+) msec, median ([\d\.]+) msec, std deviation " \
-                r"([\d\.]+) msec\)\s+msec  nevents\s*((\s*\d+ +\d+\s*)*)"
-            detailedDelay = re.search(detailedDelayPattern, oneDelay.group())
-            if (detailedDelay):
-                delay = {}
-                delay["client"] = detailedDelay.group(1)
-                delay["average"] = detailedDelay.group(2)
-                delay["median"] = detailedDelay.group(3)
-                delay["standardDeviation"] = detailedDelay.group(4)
-                delay["histogram"] = {}
-                allEvents = detailedDelay.group(5)
-                eventPattern = r"(\d+) +(\d+)"
-                for event in (re.finditer(eventPattern, allEvents)):
-                    delay["histogram"][event.group(1)] = event.group(2)
-                result["networkDelay"].append(delay)
+    def sweepConfigs(self):
+        # Cartesian product of all the swept values, in the order given
+        configs = [{}]
+        for param, values in self.conf["sweep"]:
+            configs = [dict(config, **{param: value})
+                       for config in configs for value in values]
+        return configs
+
+    def runSweep(self, server, client):
+        conf = self.conf
+        self.log("---------- Running nsdperf %s sweep with server %s client "
+                 "%s ----------" % (conf["search"], server, client))
+        configs = self.sweepConfigs()
+        ttime = int(conf["ttime"] or NSDPERF_TTIME)
+        roundNum = 0
+        sweepResults = []
+        allResults = []
+        while True:
+            self.log("Sweep round %s: %s configuration(s), test time %s "
+                     "seconds" % (roundNum, len(configs), ttime))
+            scores, details, results = self.runSweepRound(
+                server, client, configs, ttime, roundNum)
+            allResults.extend(results)
+            for config, score, detail in zip(configs, scores, details):
+                sweepResults.append({"round": roundNum, "testTime": ttime,
+                                     "config": config,
+                                     "throughput(MB/sec)": score,
+                                     "tests": detail})
+            ranked = sorted(zip(configs, scores), key=lambda cs: cs[1],
+                            reverse=True)
+            best, bestScore = ranked[0]
+            if (conf["search"] == "grid" or len(configs) <= 2):
+                break
+            # Successive halving, keep the best half and double the test time
+            configs = [config for config, score in
+                       ranked[:int(math.ceil(len(ranked) / 2.0))]]
+            ttime = ttime * 2
+            roundNum += 1
+
+        self.printSweepTable(sweepResults)
+        if (conf["sizes"]):
+            self.printSizeCurves(sweepResults)
+        self.log("Best configuration: %s with %s MB/sec" % (best, bestScore))
+        self.log("Best configuration as %s options: %s" %
+                 (os.path.basename(__file__), " ".join(
+                     "%s %s" % (sweepOpts[param], best[param])
+                     for param, values in conf["sweep"])))
+        self.sweepSummary = {"search": conf["search"], "test": conf["test"],
+                             "best": best, "throughput(MB/sec)": bestScore,
+                             "results": sweepResults}
+        sweepFile = open(self.nsdperfSweepFile, 'w')
+        sweepFile.write(json.dumps(self.sweepSummary))
+        sweepFile.close()
+        return allResults
+
+    def runSweepRound(self, server, client, configs, ttime, roundNum):
+        # receiverThr and workerThr are nsdperf process options, so the
+        # servers are started once per value pair and every other parameter
+        # is changed with commands on the same resident session
+        conf = self.conf
+        scores = [None] * len(configs)
+        details = [None] * len(configs)
+        allResults = []
+        groups = []
+        for idx, config in enumerate(configs):
+            key = (config.get("receiverThr", conf["receiverThr"]),
+                   config.get("workerThr", conf["workerThr"]))
+            for group in groups:
+                if (group[0] == key):
+                    group[1].append(idx)
+                    break
             else:
-                halt("Error, cannot match for network delay info")
-
-        result["netData"] = netData
-        outputJson = json.dumps(result)
-        resultSize += sys.getsizeof(outputJson)
-        resultFile.write(outputJson)
-    resultFile.close()
-    # Detect nsdperf test errors
-    if (not resultSize):
-        halt("Error, nsdperf test seems failed, please check command output")
-
-
-def getLocalNode(allNodes):
-    localNode = None
-    rc, ipaddr_output, ec = runcmd("ip addr show")
-    if (rc == 0):
-        # create a list of allip addresses for local node
-        iplist = IPPATT.findall(ipaddr_output)
-
-        # check for match with one of input ip addresses
-        for node in allNodes:
-            if node in iplist:
-                localNode = node
+                groups.append((key, [idx]))
+
+        allNodes = uniqueNodes(server + client)
+        for key, idxList in groups:
+            self.makeCmds(server, client)
+            cliOptions = self.makeCliOptions(key[0], key[1], conf["pathMtu"],
+                                             conf["serviceLevel"])
+            self.onNodes(self.startServerThr, allNodes, cliOptions)
+
+            admin = self.startAdmin(self.localOptions(cliOptions))
+            try:
+                self.adminRun(admin, "ttime %s\n" % (ttime))
+                for idx in idxList:
+                    config = configs[idx]
+                    self.log("Sweep round %s configuration %s" %
+                             (roundNum, config))
+                    cmds = ""
+                    for param, value in sorted(config.items()):
+                        if (sweepCmds[param]):
+                            cmds = cmds + "%s %s\n" % (sweepCmds[param],
+                                                       value)
+                    results = self.adminTests(admin, server, client, cmds,
+                                              ttime)
+                    if (len(results) != len(conf["test"])):
+                        self.halt("Error, nsdperf sweep test seems failed, "
+                                  "please check command output")
+                    throughput = 0.0
+                    details[idx] = {}
+                    for result in results:
+                        result["sweep"] = dict(config, round=roundNum)
+                        throughput += float(result["throughput(MB/sec)"])
+                        details[idx][result["test"]] = summarizeResult(result)
+                    self.writeResults(results)
+                    allResults.extend(results)
+                    scores[idx] = round(throughput / len(results), 2)
+            finally:
+                self.endAdmin(admin, allNodes)
+        return scores, details, allResults
+
+    def railCount(self, client):
+        # Rails every client has, ports are given per node comma separated
+        rdmaPorts = self.conf["rdmaPorts"]
+        counts = [len(rdmaPorts.get(node, "").split(",")) for node in client
+                  if rdmaPorts.get(node)]
+        if (not counts):
+            self.halt("Error: --multirail needs the RDMA ports of the "
+                      "clients in --rdmaPorts")
+        if (min(counts) != max(counts)):
+            self.log("INFO: clients have %s to %s RDMA ports, testing %s "
+                     "rail(s)" % (min(counts), max(counts), min(counts)))
+        return min(counts)
+
+    def runMultiRail(self, server, client):
+        # On one resident session, the tests over every RDMA port of the
+        # clients alone (rail N) and then over the first 1 to N ports
+        # (maxrdma N). Ports are numbered in the order nsdperf sorts them,
+        # so the first k rails are the ports maxrdma k uses
+        conf = self.conf
+        nRails = self.railCount(client)
+        self.log("---------- Running nsdperf multi-rail test over %s rail(s) "
+                 "with server %s client %s ----------" %
+                 (nRails, server, client))
+        steps = [("rail", rail, "rail %s\nmaxrdma 0\n" % (rail))
+                 for rail in range(nRails)] + \
+            [("ports", ports, "rail all\nmaxrdma %s\n" % (ports))
+             for ports in range(1, nRails + 1)]
+        cliOptions = self.makeCmds(server, client)
+        allNodes = uniqueNodes(server + client)
+        self.onNodes(self.startServerThr, allNodes, cliOptions)
+        admin = self.startAdmin(self.localOptions(cliOptions))
+        allResults = []
+        stepResults = []
+        try:
+            for kind, value, cmds in steps:
+                self.log("Multi-rail %s %s" % (kind, value))
+                results = self.adminTests(admin, server, client, cmds)
+                if (len(results) != len(conf["test"])):
+                    self.halt("Error, nsdperf multi-rail test seems failed, "
+                              "please check command output")
+                for result in results:
+                    result["multirail"] = {kind: value}
+                self.writeResults(results)
+                allResults.extend(results)
+                stepResults.append((kind, value, results))
+        finally:
+            self.endAdmin(admin, allNodes)
+
+        self.multiRailSummary = multiRailSummary(conf["test"], stepResults)
+        self.printMultiRailTables(self.multiRailSummary)
+        railFile = open(self.nsdperfMultiRailFile, 'w')
+        railFile.write(json.dumps(self.multiRailSummary))
+        railFile.close()
+        return allResults
+
+    def printMultiRailTables(self, summary):
+        for test in self.conf["test"]:
+            self.log("Throughput per RDMA rail for %s test:" % (test))
+            self.log("".join("%12s" % (col) for col in
+                             ["test", "rail", "MB/sec", "share %"]) +
+                     "  ports")
+            for rail in summary[test]["rails"]:
+                row = [test, rail["rail"], rail["throughput(MB/sec)"],
+                       rail["share(%)"]]
+                self.log("".join("%12s" % (col) for col in row) + "  " +
+                         ",".join("%s:%s" % (node, port) for node, port in
+                                  sorted(rail["ports"].items())))
+            self.log("Throughput per number of RDMA ports for %s test:" %
+                     (test))
+            self.log("".join("%12s" % (col) for col in
+                             ["test", "ports", "MB/sec", "speedup",
+                              "efficiency"]))
+            for ports in summary[test]["ports"]:
+                row = [test, ports["ports"], ports["throughput(MB/sec)"],
+                       ports["speedup"], ports["efficiency(%)"]]
+                self.log("".join("%12s" % (col) for col in row))
+
+    def runRdmaMatrix(self, server, client):
+        # Same tests with every RDMA mode of the matrix. Path MTU and
+        # service level are nsdperf process options, so the servers are
+        # started once per pair of them and the rest of the modes are
+        # changed with commands on the same resident session. A mode whose
+        # tests fail is reported and the matrix goes on
+        conf = self.conf
+        self.log("---------- Running nsdperf RDMA mode matrix %s with server "
+                 "%s client %s ----------" %
+                 (conf["rdmaMatrix"], server, client))
+        groups = []
+        for spec in conf["rdmaMatrix"]:
+            mode = parseRdmaMode(spec)
+            key = (mode["pathMtu"] or conf["pathMtu"],
+                   mode["serviceLevel"] if mode["serviceLevel"] != ""
+                   else conf["serviceLevel"])
+            for group in groups:
+                if (group[0] == key):
+                    group[1].append((spec, mode))
+                    break
+            else:
+                groups.append((key, [(spec, mode)]))
+
+        allResults = []
+        modeResults = {}
+        allNodes = uniqueNodes(server + client)
+        for key, modes in groups:
+            self.makeCmds(server, client)
+            cliOptions = self.makeCliOptions(conf["receiverThr"],
+                                             conf["workerThr"], key[0],
+                                             key[1])
+            self.onNodes(self.startServerThr, allNodes, cliOptions)
+            admin = self.startAdmin(self.localOptions(cliOptions))
+            try:
+                for spec, mode in modes:
+                    self.log("RDMA mode %s" % (spec))
+                    cmds = "rdma %s\nsinline %s\nusecm %s\n" % (
+                        mode["rdmaMode"], "on" if mode["sinline"] else "off",
+                        "on" if mode["usecm"] else "off")
+                    results = self.adminTests(admin, server, client, cmds)
+                    if (len(results) != len(conf["test"])):
+                        self.log("INFO: the tests of RDMA mode %s failed, "
+                                 "please check command output" % (spec))
+                        modeResults[spec] = None
+                        continue
+                    for result in results:
+                        result["rdmaMatrix"] = spec
+                    self.writeResults(results)
+                    allResults.extend(results)
+                    modeResults[spec] = dict(
+                        (result["test"], summarizeResult(result))
+                        for result in results)
+            finally:
+                self.endAdmin(admin, allNodes)
+        if (not allResults):
+            self.halt("Error, nsdperf tests of all RDMA modes failed, please "
+                      "check command output")
+
+        self.rdmaMatrixSummary = {"test": conf["test"],
+                                  "modes": conf["rdmaMatrix"],
+                                  "results": modeResults}
+        self.printRdmaMatrixTable(self.rdmaMatrixSummary)
+        matrixFile = open(self.nsdperfRdmaMatrixFile, 'w')
+        matrixFile.write(json.dumps(self.rdmaMatrixSummary))
+        matrixFile.close()
+        return allResults
+
+    def printRdmaMatrixTable(self, summary):
+        header = ["test", "mode", "MB/sec", "avg msec"] + \
+            ["p%s msec" % (pct) for pct in delayPercentiles] + \
+            ["cli%", "srv%"]
+        # Modes can be long, like inline+sinline+usecm+mtu4096
+        width = max([12] + [len(spec) + 2 for spec in summary["modes"]])
+
+        def rowFormat(row):
+            return "%12s%*s" % (row[0], width, row[1]) + \
+                "".join("%12s" % (col) for col in row[2:])
+        self.log("Throughput, network delay and CPU use by RDMA mode:")
+        self.log(rowFormat(header))
+        for test in summary["test"]:
+            for spec in summary["modes"]:
+                tests = summary["results"].get(spec)
+                if (tests is None):
+                    self.log(rowFormat([test, spec, "failed"]))
+                    continue
+                res = tests[test]
+                row = [test, spec, res["throughput(MB/sec)"],
+                       res["average"]] + \
+                    [res["p%s" % (pct)] for pct in delayPercentiles] + \
+                    [res["cli%"], res["srv%"]]
+                self.log(rowFormat(row))
+
+    def runNumaCompare(self, server, client):
+        # Same tests with nsdperf bound to the NUMA node of the test NIC
+        # and to another node
+        allResults = []
+        modeResults = {}
+        for mode in ["local", "remote"]:
+            if (all(self.numaBinding(node, mode) is None
+                    for node in self.allNodes)):
+                self.log("INFO: no node can be bound to a %s NUMA node, "
+                         "skipping the %s placement run" % (mode, mode))
+                continue
+            self.numaMode = mode
+            results = self.runTest(server, client)
+            modeResults[mode] = results
+            allResults.extend(results)
+        self.numaMode = "compare"
+        self.printNumaTable(modeResults)
+        return allResults
+
+    def runHugePageCompare(self, server, client):
+        # Same tests with the buffer pools on normal pages and on every
+        # huge page size
+        allResults = []
+        pageResults = {}
+        for pages in ["off"] + hugePageSizes:
+            self.hugePages = None if pages == "off" else pages
+            results = self.runTest(server, client)
+            pageResults[pages] = results
+            allResults.extend(results)
+        self.hugePages = "compare"
+        self.printHugePageTable(pageResults)
+        return allResults
+
+    def printHugePageTable(self, pageResults):
+        header = ["test", "pages", "MB/sec", "change %", "reg msec",
+                  "fallback"]
+        self.log("Throughput and pool registration time by page size:")
+        self.log("".join("%12s" % (col) for col in header))
+        for test in self.conf["test"]:
+            base = None
+            for pages in ["off"] + hugePageSizes:
+                result = ([result for result in pageResults.get(pages, [])
+                           if result["test"] == test] or [None])[0]
+                if (result is None):
+                    continue
+                rate = float(result["throughput(MB/sec)"])
+                if (base is None):
+                    base = rate
+                pool = result.get("bufferPool", {})
+                regTimes = [info["registration(msec)"]
+                            for info in pool.values()
+                            if info["registration(msec)"] is not None]
+                fallback = len([info for info in pool.values()
+                                if info["hugePagesFallback"]])
+                row = [test, pages, rate,
+                       round((rate - base) * 100 / base, 1) if base else "-",
+                       max(regTimes) if regTimes else "-",
+                       "%d node[s]" % (fallback) if fallback else "-"]
+                self.log("".join("%12s" % (col) for col in row))
+
+    def runZeroCopyCompare(self, server, client):
+        # Same tests with copied test data and every zerocopy mode, to see
+        # whether the copies use up the CPU
+        allResults = []
+        modeResults = {}
+        for mode in ["off"] + zeroCopyModes:
+            self.zeroCopy = None if mode == "off" else mode
+            results = self.runTest(server, client)
+            modeResults[mode] = results
+            allResults.extend(results)
+        self.zeroCopy = "compare"
+        self.printZeroCopyTable(modeResults)
+        return allResults
+
+    def printZeroCopyTable(self, modeResults):
+        header = ["test", "zerocopy", "MB/sec", "change %", "cli%", "srv%"]
+        self.log("Throughput and CPU use by zerocopy mode:")
+        self.log("".join("%12s" % (col) for col in header))
+        for test in self.conf["test"]:
+            base = None
+            for mode in ["off"] + zeroCopyModes:
+                result = ([result for result in modeResults.get(mode, [])
+                           if result["test"] == test] or [None])[0]
+                if (result is None):
+                    continue
+                rate = float(result["throughput(MB/sec)"])
+                if (base is None):
+                    base = rate
+                row = [test, mode, rate,
+                       round((rate - base) * 100 / base, 1) if base else "-",
+                       result["cli%"], result["srv%"]]
+                self.log("".join("%12s" % (col) for col in row))
+
+    def printNumaTable(self, modeResults):
+        header = ["test", "local MB/sec", "remote MB/sec", "remote %"]
+        self.log("Throughput by NUMA placement:")
+        self.log("".join("%16s" % (col) for col in header))
+        for test in self.conf["test"]:
+            row = [test]
+            for mode in ["local", "remote"]:
+                row.append(([result["throughput(MB/sec)"]
+                             for result in modeResults.get(mode, [])
+                             if result["test"] == test] or ["-"])[0])
+            try:
+                row.append(round(float(row[2]) * 100 / float(row[1]), 1))
+            except (ValueError, ZeroDivisionError):
+                row.append("-")
+            self.log("".join("%16s" % (col) for col in row))
+
+    def printSweepTable(self, sweepResults):
+        params = [param for param, values in self.conf["sweep"]]
+        header = ["round", "ttime"] + params + ["MB/sec"]
+        self.log("Sweep results:")
+        self.log("".join("%12s" % (col) for col in header))
+        for res in sweepResults:
+            row = [res["round"], res["testTime"]] + \
+                [res["config"][param] for param in params] + \
+                [res["throughput(MB/sec)"]]
+            self.log("".join("%12s" % (col) for col in row))
+
+    def printSizeCurves(self, sweepResults):
+        header = ["test", "buffsize", "MB/sec", "msg/sec", "avg msec"] + \
+            ["p%s msec" % (pct) for pct in delayPercentiles]
+        for test in self.conf["test"]:
+            self.log("Throughput and network delay versus buffer size for %s "
+                     "test:" % (test))
+            self.log("".join("%12s" % (col) for col in header))
+            for res in sorted(sweepResults,
+                              key=lambda r: int(r["config"]["buffsize"])):
+                summary = res["tests"][test]
+                row = [test, res["config"]["buffsize"],
+                       summary["throughput(MB/sec)"],
+                       summary["throughput(msg/sec)"], summary["average"]] + \
+                    [summary["p%s" % (pct)] for pct in delayPercentiles]
+                self.log("".join("%12s" % (col) for col in row))
+
+    def startAdmin(self, localOpts):
+        cmd = "%s_%s -i %s %s" % (self.nsdperfexe, self.localNode,
+                                  self.nsdperfCmdFile, localOpts)
+        self.log("CMD: %s" % (cmd))
+        return subprocess.Popen(
+            cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def adminRun(self, admin, cmds, lineTimes=None, ttime=None):
+        # Feed commands to the resident admin session and collect the output
+        # up to the echo marker that follows them. lineTimes gets the epoch
+        # time each output line was read, if given. ttime is the test time
+        # set on the session, if not the configured one
+        marker = "nsdperfTool commands done"
+        span = spanStart("nsdperf admin", self.localNode,
+                         cmds.strip().replace("\n", "; "))
+        admin.stdin.write(cmds + "echo %s\n" % (marker))
+        admin.stdin.flush()
+        # Every test of the commands gets the test deadline. The output is
+        # read from the pipe directly, so that select sees all of it
+        nTests = len(re.findall(r"^test ", cmds, re.M))
+        timeout = self.deadline("test", ttime) * max(nTests, 1)
+        endTime = time.time() + timeout
+        fd = admin.stdout.fileno()
+        pending = ""
+        lines = []
+        while True:
+            ready = select.select([fd], [], [], max(endTime - time.time(),
+                                                    0))[0]
+            if (not ready):
+                self.spanEnd(span, 1)
+                self.killProcess(admin, "test", self.localNode, timeout)
+                admin.wait()
+                self.halt("Error, nsdperf admin session did not complete "
+                          "<%s> within %s seconds" %
+                          (cmds.strip().replace("\n", "; "), timeout))
+            data = os.read(fd, 65536)
+            if (not data):
+                self.spanEnd(span, 1)
+                self.halt("Error, nsdperf admin session ended unexpectedly "
+                          "with rc = %s" % (admin.wait()))
+            pending = pending + data.decode("utf-8", "replace")
+            done = False
+            while ("\n" in pending):
+                line, pending = pending.split("\n", 1)
+                line = line.rstrip()
+                if (line == marker):
+                    done = True
+                    break
+                self.log(line)
+                lines.append(line)
+                if (lineTimes is not None):
+                    lineTimes.append(time.time())
+            if (done):
+                self.spanEnd(span)
                 break
-    if localNode is None:
-        halt("Error: cannot decide local node")
-    return localNode
+        return "\n".join(lines)
+
+    def stopAdmin(self, admin):
+        admin.stdin.write("quit\n")
+        admin.stdin.close()
+        timeout = self.deadline("probe")
+        timer = threading.Timer(timeout, self.killProcess,
+                                [admin, "probe", self.localNode, timeout])
+        try:
+            timer.start()
+            admin.stdout.read()
+            rc = admin.wait()
+        finally:
+            timer.cancel()
+        if (rc):
+            self.halt("Error, nsdperf admin session failed with rc = %s" %
+                      (rc))
+
+    def endAdmin(self, admin, nodes):
+        # Stops the servers and the admin session. It runs also when a test
+        # halted, then the session can be gone or stuck and the servers are
+        # killed on their nodes so the next run finds the port free
+        if (admin.poll() is None):
+            try:
+                self.adminRun(admin, "killall\n")
+                self.stopAdmin(admin)
+                return
+            except (NsdperfError, IOError):
+                if (admin.poll() is None):
+                    admin.kill()
+                    admin.wait()
+        self.onNodes(self.killer, nodes, "nsdperfexe")
+
+    def startServerThr(self, node, cliOptions):
+        span = spanStart("start server", node)
+        self.killer(node, "nsdperfexe")
+        # Give some time to die
+        sleepSpan = spanStart("sleep", node)
+        time.sleep(5)
+        self.spanEnd(sleepSpan)
+        nodeOpts = self.nodeOptions(node, cliOptions)
+        self.chkcmd("%s %s \"%s_%s -s %s > %s/server_thread_log 2>&1 &\""
+                    % (ssh, node, self.nsdperfexe, node, nodeOpts,
+                       self.nsdperfPath))
+        # Give some time to start
+        sleepSpan = spanStart("sleep", node)
+        time.sleep(5)
+        self.spanEnd(sleepSpan)
+        self.spanEnd(span)
+
+    def nodeOptions(self, node, cliOptions):
+        # nsdperf options of the server process of one node
+        nodeOpts = cliOptions
+        if (self.conf["rdmaPorts"]):
+            nodeOpts = nodeOpts + "-r %s " % (self.conf["rdmaPorts"][node])
+        numaNode = self.numaBinding(node, self.numaMode)
+        if (numaNode is not None):
+            nodeOpts = nodeOpts + "-N %s " % (numaNode)
+        return nodeOpts
+
+    def numaBinding(self, node, mode):
+        # NUMA node to bind nsdperf to on node, None to leave it unbound
+        info = self.numaInfo.get(node)
+        if (mode not in ["local", "remote"] or not info or
+                info["nicNumaNode"] is None):
+            return None
+        if (mode == "local"):
+            return info["nicNumaNode"]
+        remote = [numaNode for numaNode in sorted(info["numaNodes"])
+                  if numaNode != info["nicNumaNode"]]
+        return remote[0] if remote else None
+
+    def placement(self):
+        # Placement of the nsdperf server process of every node
+        placement = {}
+        for node in self.allNodes:
+            info = self.numaInfo.get(node, {})
+            placement[node] = {
+                "dev": self.netDev.get(node),
+                "nicNumaNode": info.get("nicNumaNode"),
+                "irqCpus": info.get("irqCpus", []),
+                "irqNumaNodes": info.get("irqNumaNodes", []),
+                "mode": self.numaMode,
+                "boundNumaNode": self.numaBinding(node, self.numaMode)}
+        return placement
+
+    def getNumaInfo(self, allNodes):
+        # NUMA node of the test NIC, CPUs of every NUMA node and CPUs the
+        # NIC interrupts are allowed on, read on all nodes at once
+        numaInfo = {}
+        self.onNodes(self.nodeNumaInfo, allNodes, numaInfo)
+        return numaInfo
+
+    def nodeNumaInfo(self, node, numaInfo):
+        # NUMA information of node from sysfs and procfs, into numaInfo
+        dev = self.netDev[node]
+        cmd = "cat /sys/class/net/%s/device/numa_node 2>/dev/null; " \
+            "echo --; for n in /sys/devices/system/node/node[0-9]*; " \
+            "do echo ${n##*node} $(cat $n/cpulist); done 2>/dev/null; " \
+            "echo --; for irq in $(ls /sys/class/net/%s/device/msi_irqs " \
+            "2>/dev/null); do cat /proc/irq/$irq/smp_affinity_list; " \
+            "done 2>/dev/null; true" % (dev, dev)
+        output = self.chkcmd("%s %s '%s'" % (ssh, node, cmd))
+        sections = (output + "\n--\n--").split("--")
+        nicNode = sections[0].strip()
+        nodeCpus = {}
+        for line in sections[1].strip().splitlines():
+            words = line.split()
+            if (len(words) == 2 and words[0].isdigit()):
+                nodeCpus[int(words[0])] = cpuListToInts(words[1])
+        irqCpus = sorted(set(
+            cpu for line in sections[2].split()
+            for cpu in cpuListToInts(line)))
+        info = {"numaNodes": sorted(nodeCpus.keys()),
+                "nicNumaNode": None, "irqCpus": irqCpus,
+                "irqNumaNodes": sorted(
+                    numaNode for numaNode, cpus in nodeCpus.items()
+                    if set(cpus) & set(irqCpus))}
+        if (nicNode.lstrip("-").isdigit() and int(nicNode) >= 0):
+            info["nicNumaNode"] = int(nicNode)
+            self.log("NUMA: %s on node %s is on NUMA node %s, its "
+                     "interrupts on NUMA node(s) %s" %
+                     (dev, node, nicNode, info["irqNumaNodes"]))
+        else:
+            self.log("WARNING: cannot find the NUMA node of %s on node "
+                     "%s, nsdperf will not be bound there" % (dev, node))
+        numaInfo[node] = info
+
+    def writeResults(self, results):
+        resultFile = open(self.nsdperfResultFile, 'a')
+        for result in results:
+            resultFile.write(json.dumps(result) + "\n")
+        resultFile.close()
+
+    def parseResults(self, server, client, output, netData, lineTimes=None):
+        # lineTimes holds the epoch time each output line was read, if given
+        # the test window of each result is added for timeline alignment
+        results = []
+        lastEnd = 0
+        matchEnds = []
+        pattern = r"(\d+)-(\d+) (\w+) ([\d\.]+) MB/sec \(([\d\.]+) " \
+            r"msg/sec\), cli (\d+\%) srv (\d+\%), time (\d+), buff (\d+)" \
+            r"(.*)(\s*?(\S+ network delay times[\S\s]*?msec  nevents\s*" \
+            r"(\s*[\d\.]+ +\d+\s*)*\s+)+)"
+        for match in (re.finditer(pattern, output)):
+            result = {"server(s)": server, "client(s)": client,
+                      "pattern": self.conf["pattern"]}
+            result["nServer"] = match.group(1)
+            result["nClient"] = match.group(2)
+            result["test"] = match.group(3)
+            result["throughput(MB/sec)"] = match.group(4)
+            result["throughput(msg/sec)"] = match.group(5)
+            result["cli%"] = match.group(6)
+            result["srv%"] = match.group(7)
+            result["testTime"] = match.group(8)
+            result["buffsize"] = match.group(9)
+
+            sockThInfo = match.group(10)
+            sock = re.search(r"sock (\d+)", sockThInfo)
+            if (sock):
+                result["socksize"] = sock.group(1)
+            th = re.search(r"th (\d+)", sockThInfo)
+            if (th):
+                result["nTesterThread"] = th.group(1)
+            hugePages = re.search(r"hugepages (\S+)", sockThInfo)
+            if (hugePages):
+                result["hugePages"] = hugePages.group(1)
+            zeroCopy = re.search(r"zerocopy (\w+)", sockThInfo)
+            if (zeroCopy):
+                result["zeroCopy"] = zeroCopy.group(1)
+            parallel = re.search(r"parallel (\d+)", sockThInfo)
+            if (parallel):
+                result["parallel"] = parallel.group(1)
+
+            result["networkDelay"] = []
+            delay = {}
+            allDelayInfo = match.group(11)
+            oneDelayPattern = r"\S+ network delay times[\S\s]*?msec  " \
+                r"nevents\s*(\s*[\d\.]+ +\d+\s*)*"
+            for oneDelay in (re.finditer(oneDelayPattern, allDelayInfo)):
+                # nsdperf 1.30 and later print the percentiles line and
+                # histogram buckets in usec resolution
+                detailedDelayPattern = r"(\S+) network delay times " \
+                    r"\(average ([\d\.e\-]+) msec, median ([\d\.e\-]+) " \
+                    r"msec, std deviation ([\d\.e\-]+) msec\)\s+" \
+                    r"(?:\S+ network delay percentiles \(([^)]*) msec\)\s+)?" \
+                    r"msec  nevents\s*((\s*[\d\.]+ +\d+\s*)*)"
+                detailedDelay = re.search(detailedDelayPattern,
+                                          oneDelay.group())
+                if (detailedDelay):
+                    delay = {}
+                    delay["client"] = detailedDelay.group(1)
+                    delay["average"] = detailedDelay.group(2)
+                    delay["median"] = detailedDelay.group(3)
+                    delay["standardDeviation"] = detailedDelay.group(4)
+                    if (detailedDelay.group(5)):
+                        words = detailedDelay.group(5).split()
+                        delay["percentiles"] = dict(zip(words[0::2],
+                                                        words[1::2]))
+                    delay["histogram"] = {}
+                    allEvents = detailedDelay.group(6)
+                    eventPattern = r"([\d\.]+) +(\d+)"
+                    for event in (re.finditer(eventPattern, allEvents)):
+                        delay["histogram"][event.group(1)] = event.group(2)
+                    result["networkDelay"].append(delay)
+                else:
+                    self.halt("Error, cannot match for network delay info")
+
+            result["netData"] = netData
+            if (self.numaMode):
+                result["placement"] = self.placement()
+            # Interval reports are printed during the test, before its
+            # summary line
+            intervals = self.parseIntervals(output, lastEnd, match.start(),
+                                            lineTimes)
+            if (intervals):
+                result["intervals"] = intervals
+            lastEnd = match.end()
+            if (lineTimes):
+                # The summary line is printed when the test ends
+                lineNum = output.count("\n", 0, match.start())
+                result["endTime"] = lineTimes[min(lineNum,
+                                                  len(lineTimes) - 1)]
+                result["startTime"] = result["endTime"] - \
+                    int(result["testTime"])
+            results.append(result)
+            matchEnds.append(match.end())
+        # Buffer pool lines are printed once per test command, before its
+        # first result
+        for match in POOLPATT.finditer(output):
+            owner = [idx for idx, end in enumerate(matchEnds)
+                     if end > match.start()]
+            if (not owner):
+                continue
+            result = results[owner[0]]
+            result.setdefault("bufferPool", {})[match.group(1)] = {
+                "MB": float(match.group(2)), "pageSize": match.group(3),
+                "hugePagesFallback": match.group(4) is not None,
+                "registration(msec)": float(match.group(5))
+                if match.group(5) else None}
+        # Rail lines are printed once per test command, before its first
+        # result
+        for match in RAILPATT.finditer(output):
+            owner = [idx for idx, end in enumerate(matchEnds)
+                     if end > match.start()]
+            if (not owner):
+                continue
+            result = results[owner[0]]
+            result.setdefault("railPorts", {})[match.group(1)] = \
+                match.group(3)
+        # Socket buffer lines are printed once per test command, before its
+        # first result
+        for match in SOCKPATT.finditer(output):
+            owner = [idx for idx, end in enumerate(matchEnds)
+                     if end > match.start()]
+            if (not owner):
+                continue
+            result = results[owner[0]]
+            result.setdefault("socketBuffers", {})[match.group(1)] = {
+                "rcvbuf": int(match.group(2)), "sndbuf": int(match.group(3)),
+                "connections": int(match.group(4)),
+                "rmemMax": int(match.group(5)) if match.group(5) else None,
+                "wmemMax": int(match.group(6)) if match.group(6) else None}
+        # Server throughput lines follow the network delay times of their
+        # test
+        for match in SERVERPATT.finditer(output):
+            owner = [idx for idx, end in enumerate(matchEnds)
+                     if end <= match.start()]
+            if (not owner):
+                continue
+            result = results[owner[-1]]
+            result.setdefault("serverThroughput", {})[match.group(1)] = {
+                "throughput(MB/sec)": match.group(2),
+                "throughput(msg/sec)": match.group(3),
+                "bytes": match.group(4), "msgs": match.group(5)}
+        return results
 
+    def parseIntervals(self, output, start, end, lineTimes=None):
+        # Time series of the interval report lines in output[start:end],
+        # seconds are relative to the start of the test
+        intervals = []
+        for match in INTERVALPATT.finditer(output, start, end):
+            interval = {"start": float(match.group(1)),
+                        "end": float(match.group(2)),
+                        "client": match.group(3),
+                        "server": match.group(4),
+                        "throughput(MB/sec)": float(match.group(5)),
+                        "throughput(msg/sec)": float(match.group(6)),
+                        "bytes": int(match.group(7)),
+                        "msgs": int(match.group(8))}
+            if (lineTimes):
+                lineNum = output.count("\n", 0, match.start())
+                interval["time"] = lineTimes[min(lineNum,
+                                                 len(lineTimes) - 1)]
+            intervals.append(interval)
+        return intervals
 
-def getNodeDev(allNodes):
-    # TODO: add support for hostname?
-    netDev = {}
-    for node in allNodes:
-        ipInfo = chkcmd("%s %s ip -f inet addr show" % (ssh, node))
-        ipPattern = r"[\S\s]*\d+: (\w+): [\S\s]*?inet %s" % (node)
+    def getLocalNode(self, allNodes):
+        localNode = None
+        rc, ipaddr_output, ec = self.runcmd("ip addr show")
+        if (rc == 0):
+            # create a list of allip addresses for local node
+            iplist = IPPATT.findall(ipaddr_output)
+
+            # check for match with one of input ip addresses
+            for node in allNodes:
+                if node in iplist:
+                    localNode = node
+                    break
+        if localNode is None:
+            self.halt("Error: cannot decide local node")
+        return localNode
+
+    def getNodeDev(self, allNodes):
+        # TODO: add support for hostname?
+        netDev = {}
+        for node in allNodes:
+            ipInfo = self.chkcmd("%s %s ip -f inet addr show" % (ssh, node))
+            ipPattern = r"[\S\s]*\d+: (\w+): [\S\s]*?inet %s" % (node)
+            try:
+                netDev[node] = re.search(ipPattern, ipInfo).group(1)
+                self.log("netDev: %s -> %s" % (node, netDev[node]))
+            except Exception:
+                self.halt("Error, cannot match for network device of node %s "
+                          "in \"ip addr show\" output" % (node))
+        return netDev
+
+    def getNetData(self, allNodes):
+        netData = {}
+        for node in allNodes:
+            span = spanStart("net data", node)
+            # TODO
+            netData[node] = {}
+            retransInfo = self.chkcmd(
+                "%s %s nstat -az TcpRetransSegs" % (ssh, node))
+            try:
+                netData[node]["retransmit"] = re.search(
+                    r"TcpRetransSegs *(\d+)", retransInfo).group(1)
+            except Exception:
+                self.halt("Error, cannot match for retransmit data in "
+                          "\"nstat -az TcpRetransSegs\" output on node %s" %
+                          (node))
+            ipLinkInfo = self.chkcmd(
+                "%s %s \"ip -s link show %s\"" %
+                (ssh, node, self.netDev[node]))
+            ipLinkFormat = r"RX:\s*bytes\s*packets\s*errors\s*dropped\s*missed\s*mcast\s+\d+\s+\d+\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+TX:\s*bytes\s*packets\s*errors\s*dropped\s*carrier\s*collsns\s+\d+\s+\d+\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)"
+
+            ipLink = re.search(ipLinkFormat, ipLinkInfo)
+            if (not ipLink):
+                self.halt("Error, cannot match for network related data in "
+                          "\"ip -s link\" output on node %s" % (node))
+            netData[node]["rxErrors"] = ipLink.group(1)
+            netData[node]["rxDropped"] = ipLink.group(2)
+            netData[node]["rxOverrun"] = ipLink.group(3)
+            netData[node]["rxMcast"] = ipLink.group(4)
+            netData[node]["txErrors"] = ipLink.group(5)
+            netData[node]["txDropped"] = ipLink.group(6)
+            netData[node]["txCarrier"] = ipLink.group(7)
+            netData[node]["txCollsns"] = ipLink.group(8)
+            self.spanEnd(span)
+        return netData
+
+    def log(self, msg):
+        self.logLock.acquire()
         try:
-            netDev[node] = re.search(ipPattern, ipInfo).group(1)
-            log("netDev: %s -> %s" % (node, netDev[node]))
-        except Exception:
-            halt("Error, cannot match for network device of node %s in "
-                 "\"ip addr show\" output" % (node))
-    return netDev
+            log(msg, self.logFile)
+        finally:
+            self.logLock.release()
+
+    def halt(self, msg):
+        self.log('\033[91m' + msg + '\033[0m')
+        self.writeSpans()
+        raise NsdperfError(msg)
+
+    def chkcmd(self, cmd, op="probe"):
+        [rc, out, err] = self.runcmd(cmd, op)
+        out = out.rstrip()
+        err = err.rstrip()
+        if (rc):
+            self.halt("Error, command <%s> get rc <%s> output <%s> error <%s>"
+                      % (cmd, rc, out, err))
+        return out
+
+    def deadline(self, op, ttime=None):
+        # Seconds a command of kind op can run, see opDeadlines. Tests get
+        # their test time on top, ttime if given or else the configured one
+        if (op == "test"):
+            return int(ttime or self.conf["ttime"] or NSDPERF_TTIME) + \
+                opDeadlines[op]
+        return opDeadlines[op]
+
+    def runcmd(self, cmd, op="probe"):
+        cmd.rstrip()
+        self.log("CMD: %s" % (cmd))
+        if (re.search("2>&1", str(cmd))):
+            cmd = cmd + " 2>&1"
+        span = spanStart(cmd.split()[0], cmdHost(cmd), cmd)
+        p = subprocess.Popen(
+            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timeout = self.deadline(op)
+        node = cmdHost(cmd) or self.localNode or "localhost"
+        if PYTHON3:
+            try:
+                [out, err] = p.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.killProcess(p, op, node, timeout)
+                [out, err] = p.communicate()
+            rc = p.wait()
+            self.spanEnd(span, rc)
+            strout = ''.join(chr(x) for x in out)
+            return [rc, strout, err]
+        else:
+            timer = threading.Timer(timeout, self.killProcess,
+                                    [p, op, node, timeout])
+            try:
+                timer.start()
+                [out, err] = p.communicate()
+            finally:
+                timer.cancel()
+            rc = p.wait()
+            self.spanEnd(span, rc)
+            return [rc, out, err]
+
+    def spanEnd(self, span, rc=0):
+        span["duration"] = round(time.time() - span["start"], 6)
+        span["rc"] = rc
+        self.spanLock.acquire()
+        self.spans.append(span)
+        self.spanLock.release()
+
+    def writeSpans(self):
+        # One JSON object per line, appended so several runs on the same
+        # directory keep all their spans
+        self.spanLock.acquire()
+        try:
+            if (self.spans and os.path.isdir(self.nsdperfPath)):
+                spanFile = open("%s/nsdperfTool_spans.json" %
+                                (self.nsdperfPath), 'a')
+                for span in self.spans:
+                    spanFile.write(json.dumps(span) + "\n")
+                spanFile.close()
+            del self.spans[:]
+        finally:
+            self.spanLock.release()
+
+    def killProcess(self, process, op, node, timeout):
+        # Cancels a straggler command and counts it on the node it ran on
+        self.log("Warning: %s command on node %s not completing within %s "
+                 "seconds, killing the subprocess" % (op, node, timeout))
+        self.logLock.acquire()
+        try:
+            self.timeouts.setdefault(node, []).append(op)
+        finally:
+            self.logLock.release()
+        process.kill()
+
+    def killer(self, node, string):
+        self.runcmd("%s %s killall -r .*%s.*" % (ssh, node, string))
+
+
+# Subroutines
+
 
+def uniqueNodes(nodes):
+    unique = []
+    for node in nodes:
+        if (node not in unique):
+            unique.append(node)
+    return unique
 
-def getNetData(allNodes):
+
+def cpuListToInts(cpuList):
+    # "0-3,8" as [0, 1, 2, 3, 8], the format of sysfs and procfs CPU lists
+    cpus = []
+    for part in cpuList.strip().split(","):
+        first, sep, last = part.partition("-")
+        if (first.isdigit() and (not sep or last.isdigit())):
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def summarizeResult(result):
+    # Throughput and network delay of all the clients of one test
+    histogram = {}
+    events = 0
+    delaySum = 0.0
+    for delay in result["networkDelay"]:
+        for msec, nevents in delay["histogram"].items():
+            histogram[msec] = histogram.get(msec, 0) + int(nevents)
+            events += int(nevents)
+        delaySum += float(delay["average"]) * \
+            sum(int(n) for n in delay["histogram"].values())
+    summary = {"throughput(MB/sec)": float(result["throughput(MB/sec)"]),
+               "throughput(msg/sec)": float(result["throughput(msg/sec)"]),
+               "average": round(delaySum / events, 3) if events else None,
+               "cli%": int(result["cli%"].rstrip("%")),
+               "srv%": int(result["srv%"].rstrip("%"))}
+    for pct in delayPercentiles:
+        summary["p%s" % (pct)] = histPercentile(histogram, pct)
+    return summary
+
+
+def parseRdmaMode(spec):
+    # RDMA matrix mode like "all+usecm+mtu4096" into its settings, None if
+    # it is not valid
+    words = spec.split("+")
+    if (words[0] not in rdmaModes):
+        return None
+    mode = {"rdmaMode": words[0], "sinline": False, "usecm": False,
+            "pathMtu": "", "serviceLevel": ""}
+    for word in words[1:]:
+        if (word in ["sinline", "usecm"]):
+            mode[word] = True
+        elif (word.startswith("mtu") and word[3:] in pathMtus):
+            mode["pathMtu"] = word[3:]
+        elif (word.startswith("sl") and word[2:].isdigit() and
+                int(word[2:]) <= MAX_SERVICE_LEVEL):
+            mode["serviceLevel"] = word[2:]
+        else:
+            return None
+    return mode
+
+
+def multiRailSummary(tests, stepResults):
+    # Per test, the throughput of every rail alone with its share of the
+    # mean rail, and of 1 to N ports with the speedup over one port and the
+    # efficiency against the sum of the rails they use
+    summary = {}
+    for test in tests:
+        rails = []
+        ports = []
+        for kind, value, results in stepResults:
+            result = [result for result in results
+                      if result["test"] == test][0]
+            rate = float(result["throughput(MB/sec)"])
+            if (kind == "rail"):
+                rails.append({"rail": value, "throughput(MB/sec)": rate,
+                              "ports": result.get("railPorts", {})})
+            else:
+                ports.append({"ports": value, "throughput(MB/sec)": rate})
+        mean = sum(rail["throughput(MB/sec)"] for rail in rails) / len(rails)
+        for rail in rails:
+            rail["share(%)"] = round(rail["throughput(MB/sec)"] * 100 / mean,
+                                     1) if mean else None
+        single = ports[0]["throughput(MB/sec)"] if ports else None
+        for entry in ports:
+            railSum = sum(rail["throughput(MB/sec)"]
+                          for rail in rails[:entry["ports"]])
+            entry["speedup"] = round(entry["throughput(MB/sec)"] / single,
+                                     2) if single else None
+            entry["efficiency(%)"] = round(
+                entry["throughput(MB/sec)"] * 100 / railSum, 1) \
+                if railSum else None
+        summary[test] = {"rails": rails, "ports": ports}
+    return summary
+
+
+def histPercentile(histogram, pct):
+    # Smallest histogram bucket (msec) that holds pct percent of the events
+    total = sum(int(n) for n in histogram.values())
+    if (not total):
+        return None
+    count = 0
+    for msec in sorted(histogram.keys(), key=float):
+        count += int(histogram[msec])
+        if (count * 100.0 >= total * pct):
+            return float(msec)
+
+
+def diffNetData(netDataBefore, netDataAfter):
     netData = {}
-    for node in allNodes:
-        # TODO
+    for node in netDataBefore.keys():
         netData[node] = {}
-        retransInfo = chkcmd(
-            "%s %s nstat -az TcpRetransSegs" % (ssh, node))
-        try:
-            netData[node]["retransmit"] = re.search(
-                r"TcpRetransSegs *(\d+)", retransInfo).group(1)
-        except Exception:
-            halt("Error, cannot match for retransmit data in "
-                 "\"nstat -az TcpRetransSegs\" output on node %s" % (node))
-        ipLinkInfo = chkcmd(
-            "%s %s \"ip -s link show %s\"" % (ssh, node, netDev[node]))
-        ipLinkFormat = r"RX:\s*bytes\s*packets\s*errors\s*dropped\s*missed\s*mcast\s+\d+\s+\d+\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+TX:\s*bytes\s*packets\s*errors\s*dropped\s*carrier\s*collsns\s+\d+\s+\d+\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)"
-        
-        ipLink = re.search(ipLinkFormat, ipLinkInfo)
-        if (not ipLink):
-            halt("Error, cannot match for network related data in "
-                 "\"ip -s link\" output on node %s" % (node))
-        netData[node]["rxErrors"] = ipLink.group(1)
-        netData[node]["rxDropped"] = ipLink.group(2)
-        netData[node]["rxOverrun"] = ipLink.group(3)
-        netData[node]["rxMcast"] = ipLink.group(4)
-        netData[node]["txErrors"] = ipLink.group(5)
-        netData[node]["txDropped"] = ipLink.group(6)
-        netData[node]["txCarrier"] = ipLink.group(7)
-        netData[node]["txCollsns"] = ipLink.group(8)
+        for key in netDataBefore[node].keys():
+            netData[node][key] = int(netDataAfter[node][key]) - \
+                int(netDataBefore[node][key])
     return netData
 
 
@@ -307,7 +1627,18 @@ def shortUsage():
     print("          [-R|--receiverThr nReceiverThread] "
           "[-W|--workerThr nWorkerThread] [-T|--testerThr nTesterThread]")
     print("          [-r|--rebuild] [-d|--directory dir] [-h|--help]")
-    print("          [-p|--rdmaPorts]")
+    print("          [-p|--rdmaPorts] [-P|--pattern pattern] "
+          "[-n|--nodes node1,node2,...]")
+    print("          [--parallel nConnection] [--sweep param=v1:v2:...] "
+          "[--search grid|halving]")
+    print("          [--sizes buffsize1:buffsize2:...] [--sharedQueue]")
+    print("          [--interval sec] [--numa local|remote|compare]")
+    print("          [--hugepages 2M|1G|compare] "
+          "[--zerocopy send|recv|on|compare]")
+    print("          [--multirail] [--rdmaMode on|all|inline] [--sinline] "
+          "[--usecm]")
+    print("          [--pathMtu mtu] [--serviceLevel sl] "
+          "[--rdmaMatrix mode1,mode2,...|default]")
 
 
 def longUsage():
@@ -320,40 +1651,145 @@ def longUsage():
     print("          [-R|--receiverThr nReceiverThread] "
           "[-W|--workerThr nWorkerThread] [-T|--testerThr nTesterThread]")
     print("          [-r|--rebuild] [-d|--directory dir] [-h|--help]")
-    print("          [--RDMA]")
+    print("          [-p|--rdmaPorts] [-P|--pattern pattern] "
+          "[-n|--nodes node1,node2,...]")
+    print("          [--parallel nConnection] [--sweep param=v1:v2:...] "
+          "[--search grid|halving]")
+    print("          [--sizes buffsize1:buffsize2:...] [--sharedQueue]")
+    print("          [--interval sec] [--numa local|remote|compare]")
+    print("          [--hugepages 2M|1G|compare] "
+          "[--zerocopy send|recv|on|compare]")
+    print("          [--multirail] [--rdmaMode on|all|inline] [--sinline] "
+          "[--usecm]")
+    print("          [--pathMtu mtu] [--serviceLevel sl] "
+          "[--rdmaMatrix mode1,mode2,...|default]")
     print("")
     print("This tool is a wrapper over nsdperf.C which helps to "
           "automatically build and execute nsdperf tests with given "
           "configurations.")
     print("All needed files and also test results in json format will be "
           "put under %s." % (nsdperfPath))
+    print("Test results are written one json object per line, one line "
+          "per test.")
+    print("The same can be done from python with the NsdperfSession class "
+          "of this module.")
     print("")
     print("Node settings:")
     print("-s|--server server1,server2,...: server node list "
           "saparated by comma")
     print("-c|--client client1,client2,...: client node list "
           "saparated by comma")
+    print("-n|--nodes node1,node2,...: node list saparated by comma for "
+          "traffic patterns, used instead of --server and --client")
+    print("")
+    print("Traffic patterns:")
+    print("-P|--pattern pattern: one of n:m|all2all|incast|fanout|ring, "
+          "default is \"n:m\"")
+    print("    n:m: clients talk to all servers as given by --server and "
+          "--client")
+    print("    all2all: every node is both client and server and talks to "
+          "every other node")
+    print("    incast: n:1, first node is the only server, all other nodes "
+          "write into it, default test is \"write\"")
+    print("    fanout: 1:n, first node is the only server, all other nodes "
+          "read from it, default test is \"read\"")
+    print("    ring: every node is both client and server and only talks to "
+          "the next node in address order")
     print("")
     print("Test settings:")
     print("-t|--test test1,test2,...: tests saparated by comma")
     print("-l|--testTime testTimeInSec: test time duration in seconds")
+    print("--interval sec: report the throughput every sec seconds during "
+          "each test, per client and server,")
+    print("    per client, per server and in total. Stored as \"intervals\" "
+          "on the results")
     print("Accepted tests: write|read|nwrite|swrite|sread|rw, default is "
           "\"read,nwrite\"")
     print("")
     print("Buffer settings:")
     print("-b|--buffsize buffsizeInByte: test buffer size in bytes")
     print("-k|--socksize sockSizeInByte: socket buffer size in bytes")
+    print("--hugepages 2M|1G|compare: back the nsdperf buffer pools with "
+          "huge pages of that size, or run the")
+    print("    tests with normal pages and every huge page size (compare). "
+          "Nodes without free huge pages")
+    print("    fall back to normal pages. The pool of every node and its "
+          "RDMA registration time are stored")
+    print("    as \"bufferPool\" on the results")
+    print("--zerocopy send|recv|on|compare: send the test data with "
+          "MSG_ZEROCOPY (send), drop the received")
+    print("    test data in the kernel instead of copying it (recv), both "
+          "(on), or run the tests without and")
+    print("    with every mode (compare). Shows whether the data copies and "
+          "not the network limit the throughput")
     print("")
     print("Thread settings:")
     print("-R|--receiverThr nReceiverThread: receiver thread number")
     print("-W|--workerThr nWorkerThread: worker thread number")
     print("-T|--testerThr nTesterThread: tester thread number")
+    print("--parallel nConnection: number of parallel socket connections "
+          "per client and server")
+    print("--numa local|remote|compare: bind the nsdperf threads and "
+          "memory of every node to the NUMA node")
+    print("    of the test NIC (local), to another NUMA node (remote), or run "
+          "the tests with both (compare).")
+    print("    The placement is stored on the results")
+    print("--sharedQueue: all worker threads share one message queue, as "
+          "before nsdperf 1.31, instead of")
+    print("    a queue per 8 workers with work stealing. Use it to compare "
+          "both queue designs")
+    print("")
+    print("Sweep settings:")
+    print("--sweep param=v1:v2:...: run the tests for every value of param, "
+          "can be given once per param. Accepted params: "
+          "buffsize|socksize|receiverThr|workerThr|testerThr|parallel")
+    print("    All combinations of the given values are tested. Servers are "
+          "started once per receiverThr and workerThr values,")
+    print("    the rest of params are changed on the running nsdperf "
+          "session. Use a short --testTime for each run.")
+    print("--search grid|halving: grid runs all the combinations once, "
+          "halving (successive halving) keeps the best half")
+    print("    and doubles the test time on each round until two are left, "
+          "the best of the last round wins.")
+    print("    Default is \"grid\"")
+    print("The throughput table and the best configuration are printed and "
+          "saved to nsdperfSweep.json")
+    print("--sizes buffsize1:buffsize2:...: message size sweep, runs the "
+          "tests for every buffer size in bytes (%s-%s)"
+          % (MIN_BUFFSIZE, MAX_BUFFSIZE))
+    print("    on the same nsdperf session and prints throughput and network "
+          "delay percentiles versus buffer size")
     print("")
     print("Others:")
     print("-r|--rebuild: force rebuild the nsdperf executable before tests")
     print("-d|--directory dir: absolute path of local directory on "
           "each node to save nsdperf executable and output files, "
           "default is \"/tmp/nsdperf\"")
+    print("--multirail: with --rdmaPorts, run the tests over every RDMA port "
+          "of the clients alone (rail) and")
+    print("    then over the first 1 to N ports on the same nsdperf session. "
+          "Prints the throughput per rail,")
+    print("    per number of ports and the scaling efficiency against the sum "
+          "of the rails, saved to")
+    print("    nsdperfMultiRail.json")
+    print("--rdmaMode on|all|inline: with --rdmaPorts, RDMA for the data "
+          "messages (on, default), for all messages")
+    print("    (all), or for all messages with small data inline (inline)")
+    print("--sinline: use inline data in the RDMA sends, the buffer size "
+          "must fit in the inline data")
+    print("--usecm: use the RDMA Connection Manager to connect")
+    print("--pathMtu mtu: RDMA path MTU, one of %s" % ("|".join(pathMtus)))
+    print("--serviceLevel sl: RDMA service level, 0 to %s"
+          % (MAX_SERVICE_LEVEL))
+    print("--rdmaMatrix mode1,mode2,...|default: run the tests with every "
+          "RDMA mode on the same nsdperf session,")
+    print("    a mode is %s followed by +sinline, +usecm, +mtuN or +slN, like "
+          "\"all+usecm+mtu4096\"." % ("|".join(rdmaModes)))
+    print("    Servers are started once per path MTU and service level. "
+          "Prints the throughput, network delay")
+    print("    percentiles and CPU use per mode, saved to "
+          "nsdperfRdmaMatrix.json. default is %s"
+          % (",".join(defaultRdmaMatrix)))
     print("-p|--rdmaPorts '{\"node1\": \"port11,port12\", "
           "\"node2\": \"port21,port22\", ...}': "
           "set different RDMA ports for each node and enable RDMA tests. ")
@@ -362,185 +1798,163 @@ def longUsage():
     print("-h|--help: print this help message")
 
 
-def log(msg):
-    LOG_LOCK.acquire()
+def log(msg, logFile=None):
     timeStamp = getTimeStamp()
     tid = threading.currentThread().name
-    print("%s: %s: %s" % (timeStamp, tid, msg))
-    LOG_LOCK.release()
+    if (logFile is None):
+        print("%s: %s: %s" % (timeStamp, tid, msg))
+    else:
+        logFile.write("%s: %s: %s\n" % (timeStamp, tid, msg))
+        logFile.flush()
 
 
 def getTimeStamp():
     return time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime())
 
 
-def halt(msg):
-    log('\033[91m' + msg + '\033[0m')
-    sys.exit(1)
-
-
-def chkcmdLiveOutput(cmd):
-    cmd = cmd.rstrip()
-    log("CMD: %s" % (cmd))
-    p = subprocess.Popen(
-        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    lines = []
-    rc = p.poll()
-    while True:
-        line = p.stdout.readline()
-        rc = p.poll()
-        line = line.rstrip()
-        if (rc != None and (line == '' or line == b'')):
-            break
-        if PYTHON3:
-            strline = ''.join(chr(x) for x in line)
-            log(line)
-            lines.append(strline)
-        else:
-            log(line)
-            lines.append(line)
-    if (rc):
-        halt("Error, command failed with rc = %s" % (rc))
-    out = '\n'
-    return out.join(lines)
-
-
-def chkcmd(cmd):
-    [rc, out, err] = runcmd(cmd)
-    out = out.rstrip()
-    err = err.rstrip()
-    if (rc):
-        halt("Error, command <%s> get rc <%s> output <%s> error <%s>"
-             % (cmd, rc, out, err))
-    return out
-
-
-def runcmd(cmd):
-    cmd.rstrip()
-    log("CMD: %s" % (cmd))
-    if (re.search("2>&1", str(cmd))):
-        cmd = cmd + " 2>&1"
-    p = subprocess.Popen(
-        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if PYTHON3:
-        try:
-            [out, err] = p.communicate(timeout = int(conf["ttime"]) + timerWindow)
-        except subprocess.TimeoutExpired:
-            killProcess(p)
-            [out, err] = p.communicate()
-        rc = p.wait()
-        strout = ''.join(chr(x) for x in out)
-        return [rc, strout, err]
-    else:
-        timer = threading.Timer(int(conf["ttime"]) + timerWindow, killProcess, [p])
-        try:
-            timer.start()
-            [out, err] = p.communicate()
-        finally:
-            timer.cancel()
-        rc = p.wait()
-        return [rc, out, err]
+def cmdHost(cmd):
+    # Node a ssh or scp command runs on, empty for local commands
+    words = cmd.split()
+    if (words and words[0] == "ssh"):
+        idx = 1
+        while (idx < len(words) and words[idx].startswith("-")):
+            idx += 2
+        if (idx < len(words)):
+            return words[idx]
+    elif (words and words[0] == "scp"):
+        return words[-1].split(":")[0]
+    return ""
 
-def killProcess(process):
-    log("Warning: test command not completing within (ttime + timerWindow), killing the subprocess")
-    process.kill()
 
-def killer(node, string):
-    runcmd("%s %s killall -r .*%s.*" % (ssh, node, string))
+def spanStart(name, host="", command=""):
+    return {"name": name, "host": host, "command": command,
+            "start": time.time(),
+            "thread": threading.currentThread().name}
+
+
+def parseArgs(argv):
+    # Command line options into (directory, settings for configure)
+    conf = dict(defaultConf)
+    conf["sweep"] = []
+    directory = nsdperfPath
+    try:
+        opts, args = getopt.getopt(
+            argv, "hs:c:n:t:l:b:k:R:W:T:rd:p:vP:",
+            ["help", "server=", "client=", "nodes=", "test=", "testTime=",
+             "buffsize=", "socksize=", "nReciverThr=", "nWorkerThr=",
+             "nTesterThr=", "rebuild", "directory=", "rdmaPorts=",
+             "debugLevel", "pattern=", "parallel=", "sweep=", "search=",
+             "sizes=", "sharedQueue", "interval=", "numa=",
+             "hugepages=", "zerocopy=", "multirail", "rdmaMode=", "sinline",
+             "usecm", "pathMtu=", "serviceLevel=", "rdmaMatrix="])
+    except getopt.GetoptError:
+        shortUsage()
+        sys.exit(1)
+
+    for op, value in opts:
+        if op in ("-h", "--help"):
+            longUsage()
+            sys.exit(0)
+        elif op in ("-s", "--server"):
+            conf["server"] = value.split(",")
+        elif op in ("-c", "--client"):
+            conf["client"] = value.split(",")
+        elif op in ("-n", "--nodes"):
+            conf["nodes"] = value.split(",")
+        elif op in ("-P", "--pattern"):
+            conf["pattern"] = value
+        elif op in ("-t", "--test"):
+            conf["test"] = value.split(",")
+        elif op in ("-l", "--testTime"):
+            conf["ttime"] = value
+        elif op in ("-b", "--buffsize"):
+            conf["buffsize"] = value
+        elif op in ("-k", "--socksize"):
+            conf["socksize"] = value
+        elif op in ("-R", "--nReciverThr"):
+            conf["receiverThr"] = value
+        elif op in ("-W", "--nWorkerThr"):
+            conf["workerThr"] = value
+        elif op in ("-T", "--nTesterThr"):
+            conf["testerThr"] = value
+        elif op == "--parallel":
+            conf["parallel"] = value
+        elif op == "--sweep":
+            param, sep, values = value.partition("=")
+            if (not sep or not values):
+                raise NsdperfError("Error: --sweep expects "
+                                   "param=value1:value2:..., got <%s>"
+                                   % (value))
+            if (param in [p for p, v in conf["sweep"]]):
+                raise NsdperfError("Error: sweep parameter <%s> given more "
+                                   "than once" % (param))
+            conf["sweep"].append((param, values.split(":")))
+        elif op == "--search":
+            conf["search"] = value
+        elif op == "--sizes":
+            conf["sizes"] = value.split(":")
+        elif op == "--sharedQueue":
+            conf["sharedQueue"] = True
+        elif op == "--interval":
+            conf["interval"] = value
+        elif op == "--numa":
+            conf["numa"] = value
+        elif op == "--hugepages":
+            conf["hugepages"] = value
+        elif op == "--zerocopy":
+            conf["zerocopy"] = value
+        elif op == "--multirail":
+            conf["multirail"] = True
+        elif op == "--rdmaMode":
+            conf["rdmaMode"] = value
+        elif op == "--sinline":
+            conf["sinline"] = True
+        elif op == "--usecm":
+            conf["usecm"] = True
+        elif op == "--pathMtu":
+            conf["pathMtu"] = value
+        elif op == "--serviceLevel":
+            conf["serviceLevel"] = value
+        elif op == "--rdmaMatrix":
+            if (value == "default"):
+                conf["rdmaMatrix"] = list(defaultRdmaMatrix)
+            else:
+                conf["rdmaMatrix"] = value.split(",")
+        elif op in ("-r", "--rebuild"):
+            conf["rebuild"] = True
+        elif op in ("-d", "--directory"):
+            directory = value
+        elif op in ("-p", "--rdmaPorts"):
+            conf["rdmaPorts"] = value
+        elif op in ("-v", "--debugLevel"):
+            conf["debugLevel"] = 3
+        else:
+            log("Error: Unknown option %s" % (op))
+            shortUsage()
+            sys.exit(1)
+    return directory, conf
 
 
 # ========== main ==========
 
-# Obtain command line options
-conf = {'server': '', 'client': '', 'test': '', 'ttime': '', 'buffsize': '',
-        'socksize': '', 'receiverThr': '', 'workerThr': '', 'testerThr': '',
-        'rebuild': '', 'directory': '', 'rdmaPorts': '', 'debugLevel': ''}
-
-try:
-    opts, args = getopt.getopt(
-        sys.argv[1:], "hs:c:n:t:l:b:k:R:W:T:rd:p:v",
-        ["help", "server=", "client=", "test=", "testTime=", "buffsize=",
-         "socksize=", "nReciverThr=", "nWorkerThr=", "nTesterThr=", "rebuild",
-         "directory=", "rdmaPorts=", "debugLevel"])
-except getopt.GetoptError:
-    shortUsage()
-    sys.exit(1)
-
-for op, value in opts:
-    if op in ("-h", "--help"):
-        longUsage()
-        sys.exit(0)
-    elif op in ("-s", "--server"):
-        conf["server"] = value.split(",")
-    elif op in ("-c", "--client"):
-        conf["client"] = value.split(",")
-    elif op in ("-t", "--test"):
-        conf["test"] = value.split(",")
-    elif op in ("-l", "--testTime"):
-        conf["ttime"] = value
-    elif op in ("-b", "--buffsize"):
-        conf["buffsize"] = value
-    elif op in ("-k", "--socksize"):
-        conf["socksize"] = value
-    elif op in ("-R", "--nReciverThr"):
-        conf["receiverThr"] = value
-    elif op in ("-W", "--nWorkerThr"):
-        conf["workerThr"] = value
-    elif op in ("-T", "--nTesterThr"):
-        conf["testerThr"] = value
-    elif op in ("-r", "--rebuild"):
-        conf["rebuild"] = True
-    elif op in ("-d", "--directory"):
-        nsdperfPath = value
-    elif op in ("-p", "--rdmaPorts"):
-        try:
-            conf["rdmaPorts"] = json.loads(str(value))
-        except Exception as e:
-            log("I get non-json format --rdmaPorts input: <%s>" % value)
-            log("Set it to be the RDMA ports for all nodes")
-            rdmaPorts = {}
-            for node in conf["server"]:
-                rdmaPorts[node] = value
-            for node in conf["client"]:
-                rdmaPorts[node] = value
-            conf["rdmaPorts"] = rdmaPorts
-    elif op in ("-v", "--debugLevel"):
-        conf["debugLevel"] = 3
-    else:
-        log("Error: Unknown option %s" % (op))
-        shortUsage()
+
+def main():
+    try:
+        directory, conf = parseArgs(sys.argv[1:])
+    except NsdperfError as e:
+        log('\033[91m' + str(e) + '\033[0m')
+        sys.exit(1)
+    session = NsdperfSession(directory)
+    try:
+        session.configure(**conf)
+        session.run()
+    except NsdperfError:
         sys.exit(1)
 
-# process input arguments
-processArgs()
-
-# global variables that needs processing based on input args
-nsdperfCmdFile = "%s/nsdperfCmd" % (nsdperfPath)
-nsdperfResultFile = "%s/nsdperfResult.json" % (nsdperfPath)
-nsdperfexe = "%s/nsdperfexe" % (nsdperfPath)
-# allNodes
-allNodes = []
-allNodes.extend(conf["server"])
-allNodes.extend(conf["client"])
-# localNode
-localNode = getLocalNode(allNodes)
-# netDev
-netDev = getNodeDev(allNodes)
-
-# create nsdperfexe executable on all nodes if needed
-threads = []
-for node in allNodes:
-    thr = threading.Thread(target=createExecutable, args=(node,))
-    thr.start()
-    threads.append(thr)
-for thr in threads:
-    thr.join()
-
-# delete old result file before test
-runcmd("rm -rf %s" % (nsdperfResultFile))
-# run test
-runTest(conf["server"], conf["client"])
-
-log("========== All tests completed, congratulations! ==========")
-log("========== Test result with json format is in file <%s> ==========" %
-    (nsdperfResultFile))
+    log("========== All tests completed, congratulations! ==========")
+    log("========== Test result with json format is in file <%s> ==========" %
+        (session.nsdperfResultFile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Colorful constants
+RED = '\033[91m'
+GREEN = '\033[92m'
+YELLOW = '\033[93m'
+NOCOLOR = '\033[0m'
+
+# Runs per command
+RUNS = 10
+
+KOET = os.path.join(os.path.dirname(os.path.realpath(__file__)), "koet.py")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Measures the wall time koet.py needs to import and to ' +
+                    'run each subcommand that does not touch the hosts, ' +
+                    'every run on a new interpreter')
+    parser.add_argument(
+        '-n',
+        '--runs',
+        action='store',
+        dest='runs',
+        help='runs per command. Defaults to ' + str(RUNS),
+        metavar='RUNS',
+        type=int,
+        default=RUNS)
+    parser.add_argument(
+        '--logdir',
+        action='store',
+        dest='logdir',
+        help='log directory of a koet run to also time --analyze and ' +
+             'compare with it',
+        metavar='LOGDIR',
+        default="")
+    args = parser.parse_args()
+    if args.runs < 1:
+        sys.exit(RED + "QUIT: " + NOCOLOR + "runs must be 1 or more\n")
+    if args.logdir and not os.path.isdir(args.logdir):
+        sys.exit(RED + "QUIT: " + NOCOLOR + "log directory " + args.logdir +
+                 " does not exist\n")
+    return args.runs, args.logdir
+
+
+def benchmark_commands(logdir):
+    # (name, command) pairs, import alone first to compare against
+    koet_dir = os.path.dirname(KOET)
+    commands = [
+        ("import", [sys.executable, "-c",
+                    "import sys; sys.path.insert(0, " + repr(koet_dir) +
+                    "); import koet"]),
+        ("--version", [sys.executable, KOET, "--version"]),
+        ("--help", [sys.executable, KOET, "--help"]),
+        ("history --help", [sys.executable, KOET, "history", "--help"]),
+        ("compare --help", [sys.executable, KOET, "compare", "--help"])]
+    if logdir:
+        commands.append(("--analyze", [sys.executable, KOET, "--analyze",
+                                       logdir]))
+        commands.append(("compare", [sys.executable, KOET, "compare",
+                                     logdir, logdir]))
+    return commands
+
+
+def time_command(command, runs):
+    # Wall times in msec of runs executions of command, output discarded
+    times = []
+    for run in range(runs):
+        start = time.time()
+        subprocess.call(command, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+        times.append((time.time() - start) * 1000)
+    return sorted(times)
+
+
+def main():
+    runs, logdir = parse_arguments()
+    print("Startup time of " + KOET + " over " + str(runs) + " run[s]")
+    print("")
+    print("%-16s %12s %12s %12s" % ("Command", "min msec", "median msec",
+                                    "max msec"))
+    for name, command in benchmark_commands(logdir):
+        times = time_command(command, runs)
+        print("%-16s %12.1f %12.1f %12.1f" % (name, times[0],
+                                               times[len(times) // 2],
+                                               times[-1]))
+    print("")
+
+
+if __name__ == '__main__':
+    main()